@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator, Literal
+
+import httpx
+
+Policy = Literal["least_outstanding", "p2c"]
+"""Политика выбора билдера: наименьшее число запросов в работе или лучший из двух случайных."""
+
+
+@dataclass
+class _Builder:
+    """Состояние одного codex-runner'а в пуле."""
+    url: str
+    outstanding: int = 0
+    latency: float | None = None
+    failures: int = 0
+    ejected_until: float = 0.0
+    requests: int = 0
+    errors: int = 0
+
+
+def _is_health_failure(exc: BaseException) -> bool:
+    """Сбой, говорящий о нездоровье runner'а: сеть, 5xx или 429; отказ модели (400) — нет."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500 or exc.response.status_code == 429
+    return isinstance(exc, httpx.TransportError)
+
+
+class BuilderPool:
+    """
+    Пул URL билдеров с учётом нагрузки: для каждого URL хранятся запросы в работе,
+    EWMA задержки и число сбоев подряд.
+
+    `lease()` выбирает билдер по политике (`least_outstanding` — меньше запросов в работе,
+    при равенстве быстрее; `p2c` — то же сравнение для двух случайных URL). Ещё не
+    опрошенные билдеры считаются самыми быстрыми, так что каждый получает первый запрос.
+    После `eject_after` сбоев подряд URL исключается на `eject_for` секунд; если исключены
+    все, выбор идёт среди всех. Один успешный ответ обнуляет счётчик сбоев.
+    Задержки последних `window` успешных запросов дают квантиль для дедлайна хеджирования.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        policy: Policy = "least_outstanding",
+        eject_after: int = 3,
+        eject_for: float = 30.0,
+        alpha: float = 0.3,
+        rng: random.Random | None = None,
+        window: int = 256,
+    ) -> None:
+        if not urls:
+            raise ValueError("builder pool needs at least one URL")
+        self.policy = policy
+        self.eject_after = eject_after
+        self.eject_for = eject_for
+        self.alpha = alpha
+        self._builders = [_Builder(url) for url in urls]
+        self._samples: deque[float] = deque(maxlen=window)
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    @property
+    def urls(self) -> list[str]:
+        return [b.url for b in self._builders]
+
+    def __len__(self) -> int:
+        return len(self._builders)
+
+    @staticmethod
+    def _load(b: _Builder) -> tuple[int, float]:
+        return b.outstanding, b.latency or 0.0
+
+    def _pick(self) -> _Builder:
+        now = time.monotonic()
+        healthy = [b for b in self._builders if b.ejected_until <= now] or self._builders
+        if self.policy == "p2c" and len(healthy) > 2:
+            healthy = self._rng.sample(healthy, 2)
+        return min(healthy, key=self._load)
+
+    @contextmanager
+    def lease(self) -> Iterator[str]:
+        """Выдаёт URL билдера на время запроса и учитывает его исход и задержку."""
+        with self._lock:
+            b = self._pick()
+            b.outstanding += 1
+            b.requests += 1
+        with self._leased(b) as url:
+            yield url
+
+    @contextmanager
+    def lease_idle(self) -> Iterator[str | None]:
+        """
+        Как `lease`, но только среди неисключённых билдеров без запросов в работе
+        (для хеджирования); если таких нет, выдаёт None.
+        """
+        now = time.monotonic()
+        with self._lock:
+            idle = [b for b in self._builders if b.outstanding == 0 and b.ejected_until <= now]
+            b = min(idle, key=self._load) if idle else None
+            if b is not None:
+                b.outstanding += 1
+                b.requests += 1
+        if b is None:
+            yield None
+            return
+        with self._leased(b) as url:
+            yield url
+
+    def latency_quantile(self, q: float, min_samples: int = 8) -> float | None:
+        """Квантиль `q` задержек последних успешных запросов; None, пока их меньше `min_samples`."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < max(1, min_samples):
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    @contextmanager
+    def _leased(self, b: _Builder) -> Iterator[str]:
+        """Учитывает исход и задержку запроса к уже занятому билдеру `b`."""
+        started = time.monotonic()
+        try:
+            yield b.url
+        except Exception as exc:
+            with self._lock:
+                b.outstanding -= 1
+                if _is_health_failure(exc):
+                    b.errors += 1
+                    b.failures += 1
+                    if b.failures >= self.eject_after:
+                        b.ejected_until = time.monotonic() + self.eject_for
+            raise
+        except BaseException:
+            # Отмена (first_green, закрытие моста) ничего не говорит о здоровье билдера
+            with self._lock:
+                b.outstanding -= 1
+            raise
+        else:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                b.outstanding -= 1
+                b.failures = 0
+                b.latency = elapsed if b.latency is None else (1 - self.alpha) * b.latency + self.alpha * elapsed
+                self._samples.append(elapsed)
+
+    def stats(self) -> list[dict[str, object]]:
+        """Состояние каждого билдера: нагрузка, EWMA задержки, сбои и исключение из пула."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "url": b.url,
+                    "outstanding": b.outstanding,
+                    "latency": b.latency,
+                    "failures": b.failures,
+                    "ejected": b.ejected_until > now,
+                    "requests": b.requests,
+                    "errors": b.errors,
+                }
+                for b in self._builders
+            ]
+
+
+# --- бюджет повторов ---------------------------------------------------------
+#
+# Мост получает один `RequestStats` на всё время работы (вложенный мост делит его с
+# внешним, как trace ID): повторы запросов на 5xx/429 расходуют общий бюджет, так что
+# деградировавший билдер не умножает нагрузку, а счётчики попадают в результат моста.
+
+_REQUEST_STATS: ContextVar["RequestStats | None"] = ContextVar("aw_request_stats", default=None)
+
+
+class RequestStats:
+    """Потокобезопасные счётчики запросов моста к билдерам и бюджет их повторов."""
+
+    def __init__(self, retry_budget: int) -> None:
+        self.retry_budget = retry_budget
+        self._counts: dict[str, float] = {
+            "retries": 0, "retries_denied": 0, "hedges": 0, "hedge_wins": 0, "wasted_seconds": 0.0,
+        }
+        self._lock = threading.Lock()
+
+    def spend_retry(self) -> bool:
+        """Берёт повтор из бюджета; False (и `retries_denied`), если бюджет исчерпан."""
+        with self._lock:
+            if self._counts["retries"] >= self.retry_budget:
+                self._counts["retries_denied"] += 1
+                return False
+            self._counts["retries"] += 1
+            return True
+
+    def add(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counts[name] += value
+
+    def snapshot(self) -> dict[str, float]:
+        """Текущие значения счётчиков."""
+        with self._lock:
+            return dict(self._counts)
+
+
+@contextmanager
+def request_stats(retry_budget: int) -> Iterator[RequestStats]:
+    """Счётчики запросов на время блока: уже действующие (вложенный мост) или новые."""
+    stats = _REQUEST_STATS.get()
+    if stats is not None:
+        yield stats
+        return
+    stats = RequestStats(retry_budget)
+    token = _REQUEST_STATS.set(stats)
+    try:
+        yield stats
+    finally:
+        _REQUEST_STATS.reset(token)
+
+
+def current_request_stats() -> RequestStats | None:
+    """Счётчики текущего моста, если он их завёл."""
+    return _REQUEST_STATS.get()
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+
+def content_key(*parts: str | list[str]) -> str:
+    """SHA-256 от упорядоченного набора строк (списки хешируются поэлементно)."""
+    h = hashlib.sha256()
+    for part in parts:
+        items = part if isinstance(part, list) else [part]
+        h.update(str(len(items)).encode())
+        for item in items:
+            h.update(hashlib.sha256(item.encode()).digest())
+    return h.hexdigest()
+
+
+class MemoryCache:
+    """Потокобезопасный LRU-кэш JSON-значений с TTL на запись."""
+
+    def __init__(self, max_entries: int, ttl: float) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        """Возвращает значение, если оно есть и не просрочено."""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict[str, Any], ttl: float | None = None) -> None:
+        """Сохраняет значение и вытесняет самые старые записи сверх лимита."""
+        with self._lock:
+            self._entries[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCache:
+    """
+    Кэш JSON-значений в обычном каталоге: один файл на ключ, переживает рестарты.
+    При превышении `max_entries` удаляются файлы с самым старым временем доступа;
+    каталог проверяется раз в `EVICT_EVERY` записей, чтобы не сканировать его на каждой.
+    """
+
+    EVICT_EVERY = 32
+
+    def __init__(self, root: Path, max_entries: int, ttl: float) -> None:
+        self.root = root
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        """Читает значение с диска; просроченные и повреждённые файлы удаляются."""
+        item = self.get_item(key)
+        return None if item is None else item[1]
+
+    def get_item(self, key: str) -> tuple[float, dict[str, Any]] | None:
+        """Как `get`, но вместе со временем истечения записи (unix time)."""
+        path = self._path(key)
+        try:
+            item = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if item.get("expires_at", 0) < time.time():
+            path.unlink(missing_ok=True)
+            return None
+        os.utime(path)
+        return item["expires_at"], item["value"]
+
+    def set(self, key: str, value: dict[str, Any], ttl: float | None = None) -> None:
+        """Атомарно записывает значение (через временный файл) и подрезает каталог."""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        item = {"expires_at": time.time() + (self.ttl if ttl is None else ttl), "value": value}
+        tmp.write_text(json.dumps(item, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+        with self._lock:
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY:
+                return
+        self._evict()
+
+    def _evict(self) -> None:
+        """Удаляет самые давно использованные файлы сверх `max_entries`."""
+        with self._lock:
+            files = list(self.root.glob("*/*.json"))
+            if len(files) <= self.max_entries:
+                return
+            files.sort(key=lambda p: p.stat().st_mtime)
+            for path in files[: len(files) - self.max_entries]:
+                path.unlink(missing_ok=True)
+
+
+class TieredCache:
+    """
+    Память → (опционально) диск; попадание на диске поднимает значение в память
+    с оставшимся сроком жизни записи, а не с TTL памяти по умолчанию.
+    """
+
+    def __init__(self, memory: MemoryCache, disk: DiskCache | None = None) -> None:
+        self.memory = memory
+        self.disk = disk
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        """Ищет значение в памяти, затем на диске; обновляет счётчики."""
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            item = self.disk.get_item(key)
+            if item is not None:
+                expires_at, value = item
+                self.memory.set(key, value, expires_at - time.time())
+                with self._lock:
+                    self.disk_hits += 1
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: dict[str, Any], ttl: float | None = None) -> None:
+        """Сохраняет значение во все уровни."""
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            self.disk.set(key, value, ttl)
+
+    def stats(self) -> dict[str, int]:
+        """Счётчики попаданий/промахов и заполненность памяти."""
+        with self._lock:
+            return {
+                "entries": len(self.memory),
+                "max_entries": self.memory.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
@@ -2,28 +2,81 @@ from __future__ import annotations
 
 import json
 import sys
+import time
+from pathlib import Path
 from typing import Any
 
 import httpx
 import typer
 
+from agents_wrangler.jobs import FINAL_STATUSES, JOB_WORKERS, JOBS_DB, JobRecord, JobSpec, JobStore, JobWorker
+
 app = typer.Typer(help="CLI для общения с ядром Agent Wrangler.")
 
+# Опции режима заданий: мост выполняет воркер (`aw worker`) через оркестратор Python,
+# поэтому ему нужны адреса сервисов, а не ядра
+_DB = typer.Option(JOBS_DB, "--db", help="База заданий SQLite (AW_JOBS_DB)")
+_JOB = typer.Option(False, "--job", help="Поставить мост в очередь заданий и сразу вернуть run ID")
+_BUILDER_URLS = typer.Option(None, "--builder-url", help="URL билдера Codex для --job (можно повторять)")
+_TESTER_URL = typer.Option("http://localhost:7001", "--tester-url", help="URL tester-service для --job")
+
 
-def _print_json(data: dict[str, Any]) -> None:
+def _print_json(data: Any) -> None:
     """Красиво печатает JSON‑ответы."""
     sys.stdout.write(json.dumps(data, ensure_ascii=False, indent=2) + "\n")
 
 
+def _enqueue(db: Path, spec: JobSpec) -> None:
+    """Ставит мост в очередь и печатает run ID."""
+    run_id = JobStore(db).submit(spec)
+    _print_json({"run_id": run_id, "status": "queued"})
+
+
+def _summary(record: JobRecord) -> dict[str, Any]:
+    """Состояние задания без результата; от ошибки остаётся последняя строка трейсбека."""
+    end = record.finished or (time.time() if record.started else None)
+    return {
+        "run_id": record.id,
+        "kind": record.kind,
+        "status": record.status,
+        "task": record.spec.task,
+        "attempts": record.attempts,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created)),
+        "elapsed": round(end - record.started, 3) if end and record.started else None,
+        "worker": record.worker,
+        "error": record.error.strip().splitlines()[-1] if record.error and record.error.strip() else None,
+    }
+
+
+def _record(store: JobStore, run_id: str) -> JobRecord:
+    record = store.get(run_id)
+    if record is None:
+        sys.stderr.write(f"run {run_id!r} not found\n")
+        raise typer.Exit(code=2)
+    return record
+
+
 @app.command()
 def submit(
     task: str = typer.Option(..., "--task", "-t", help="Человеческое описание задачи"),
     builders: int = typer.Option(3, "--builders", "-n", min=1, max=8, help="Число параллельных билдеров"),
     core_url: str = typer.Option("http://localhost:8080", "--core-url", help="Базовый URL ядра"),
+    timeout: float = typer.Option(60.0, "--timeout", help="Лимит ожидания ответа ядра, секунды"),
+    job: bool = _JOB,
+    builder_urls: list[str] | None = _BUILDER_URLS,
+    tester_url: str = _TESTER_URL,
+    db: Path = _DB,
 ) -> None:
     """Отправляет задачу в простой мост (best‑of‑N)."""
+    if job:
+        spec = JobSpec(
+            kind="bridge", task=task, builder_urls=builder_urls or ["http://localhost:7002"],
+            tester_url=tester_url, candidates=builders,
+        )
+        _enqueue(db, spec)
+        return
     payload = {"task": task, "builders": builders}
-    with httpx.Client(timeout=60.0) as client:
+    with httpx.Client(timeout=timeout) as client:
         r = client.post(f"{core_url}/api/v1/bridge", json=payload)
         r.raise_for_status()
         _print_json(r.json())
@@ -36,15 +89,92 @@ def submit_multi(
     reviewers: int = typer.Option(2, "--reviewers", "-k", min=0, max=8, help="Число ревьюеров"),
     specialists: int = typer.Option(2, "--specialists", "-s", min=0, max=8, help="Число специалистов на компонент"),
     core_url: str = typer.Option("http://localhost:8080", "--core-url", help="Базовый URL ядра"),
+    timeout: float = typer.Option(90.0, "--timeout", help="Лимит ожидания ответа ядра, секунды"),
+    job: bool = _JOB,
+    builder_urls: list[str] | None = _BUILDER_URLS,
+    tester_url: str = _TESTER_URL,
+    architect_url: str = typer.Option("http://localhost:7002", "--architect-url", help="URL архитектора Codex для --job"),
+    reviewer_url: str = typer.Option("http://localhost:7002", "--reviewer-url", help="URL ревьюера Codex для --job"),
+    db: Path = _DB,
 ) -> None:
     """Отправляет задачу в мультиагентный мост: архитектор → билдеры → специалисты → финальный ревью."""
+    if job:
+        # Ревьюеров в мосте Python один: финальный ревью делает первый URL
+        spec = JobSpec(
+            kind="multi", task=task, builder_urls=builder_urls or ["http://localhost:7002"], tester_url=tester_url,
+            candidates=builders, plan_urls=[architect_url], review_urls=[reviewer_url], specialists=specialists,
+        )
+        _enqueue(db, spec)
+        return
     payload = {
         "task": task,
         "builders": builders,
         "reviewers": reviewers,
         "specialists": specialists,
     }
-    with httpx.Client(timeout=90.0) as client:
+    with httpx.Client(timeout=timeout) as client:
         r = client.post(f"{core_url}/api/v1/bridge/multi", json=payload)
         r.raise_for_status()
         _print_json(r.json())
+
+
+@app.command()
+def worker(
+    workers: int = typer.Option(JOB_WORKERS, "--workers", "-w", min=1, help="Сколько мостов выполнять одновременно"),
+    until_idle: bool = typer.Option(False, "--until-idle", help="Завершиться, когда очередь опустеет"),
+    db: Path = _DB,
+) -> None:
+    """Выполняет задания из очереди (`submit --job`); несколько воркеров могут делить одну базу."""
+    done = JobWorker(JobStore(db), workers=workers).run(until_idle=until_idle)
+    _print_json({"completed": done})
+
+
+@app.command()
+def status(
+    run_id: str | None = typer.Argument(None, help="Run ID или его префикс; без него — последние задания"),
+    limit: int = typer.Option(20, "--limit", min=1, help="Сколько последних заданий показать"),
+    db: Path = _DB,
+) -> None:
+    """Показывает состояние задания или список последних заданий."""
+    store = JobStore(db)
+    if run_id:
+        _print_json(_summary(_record(store, run_id)))
+    else:
+        _print_json([_summary(r) for r in store.recent(limit)])
+
+
+@app.command()
+def watch(
+    run_id: str = typer.Argument(..., help="Run ID или его префикс"),
+    interval: float = typer.Option(1.0, "--interval", help="Период опроса базы, секунды"),
+    db: Path = _DB,
+) -> None:
+    """Печатает события задания по мере появления (JSON по строке) до его завершения."""
+    store = JobStore(db)
+    record = _record(store, run_id)
+    seq = 0
+    while True:
+        for event in store.events(record.id, after=seq):
+            sys.stdout.write(event.model_dump_json() + "\n")
+            sys.stdout.flush()
+            seq = event.seq
+        if record.status in FINAL_STATUSES:
+            raise typer.Exit(code=0 if record.status == "succeeded" else 1)
+        time.sleep(interval)
+        record = _record(store, record.id)
+
+
+@app.command()
+def result(
+    run_id: str = typer.Argument(..., help="Run ID или его префикс"),
+    db: Path = _DB,
+) -> None:
+    """Печатает результат завершённого моста; код 1 — мост упал, 2 — ещё не завершён."""
+    record = _record(JobStore(db), run_id)
+    if record.status == "failed":
+        sys.stderr.write(record.error or "failed\n")
+        raise typer.Exit(code=1)
+    if record.status != "succeeded":
+        sys.stderr.write(f"run {record.id} is {record.status}\n")
+        raise typer.Exit(code=2)
+    _print_json(record.result)
@@ -1,20 +1,56 @@
 from __future__ import annotations
 
+import asyncio
 import json
+import math
 import os
-import shutil
+import signal
 import subprocess
-import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import AsyncIterator, Callable
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
-app = FastAPI(title="codex-runner", version="0.2.0")
+from agents_wrangler.cache import DiskCache, MemoryCache, TieredCache, content_key
+from agents_wrangler.diff_store import DiffStore, install
+from agents_wrangler.telemetry import Registry, instrument
+from agents_wrangler.workspaces import Workspace, WorkspacePool, git, set_readonly
 
-DEMO_APP_DIR = Path(__file__).resolve().parent.parent / "demo_app"
+# Проект, над которым работает Codex (по умолчанию — demo_app из репозитория)
+DEMO_APP_DIR = Path(os.environ.get("CODEX_TARGET_DIR", Path(__file__).resolve().parent.parent / "demo_app"))
 CODEX_BIN = os.environ.get("CODEX_BIN", "codex")
 DEFAULT_MODEL = os.environ.get("CODEX_MODEL", "qwen2.5-coder:7b-instruct")
+# Как часто проверять, что клиент ещё ждёт ответа, пока работает `codex exec`
+DISCONNECT_POLL_S = 0.5
+# Сколько `codex exec` выполняется одновременно и сколько запросов может ждать своей очереди;
+# сверх этого runner сразу отвечает 429, а не копит запросы до 180-секундных таймаутов
+MAX_CONCURRENCY = int(os.environ.get("CODEX_MAX_CONCURRENCY", "2"))
+MAX_QUEUE = int(os.environ.get("CODEX_MAX_QUEUE", "8"))
+# Сколько чистых рабочих копий baseline держать наготове для implement
+WORKSPACES_READY = int(os.environ.get("CODEX_WORKSPACES", str(MAX_CONCURRENCY)))
+
+# Кэш ответов (включается явно): ключ — роль, модель, промпт и хеш baseline-проекта.
+# implement кэшируется, только если клиент запросил seed или детерминированный режим.
+CACHE_ENABLED = os.environ.get("CODEX_CACHE", "0") == "1"
+CACHE_ENTRIES = int(os.environ.get("CODEX_CACHE_ENTRIES", "256"))
+CACHE_DIR = os.environ.get("CODEX_CACHE_DIR")
+CACHE_DISK_ENTRIES = int(os.environ.get("CODEX_CACHE_DISK_ENTRIES", "5000"))
+CACHE_TTLS = {
+    "plan": float(os.environ.get("CODEX_CACHE_TTL_PLAN", "86400")),
+    "review": float(os.environ.get("CODEX_CACHE_TTL_REVIEW", "86400")),
+    "implement": float(os.environ.get("CODEX_CACHE_TTL_IMPLEMENT", "3600")),
+}
+# Заголовок запроса `X-AW-Cache: bypass` заставляет выполнить Codex и перезаписать запись
+CACHE_HEADER = "X-AW-Cache"
+
+# Бюджет хранилища диффов для ревью по ссылкам (см. agents_wrangler.diff_store)
+DIFF_STORE_MB = int(os.environ.get("CODEX_DIFF_STORE_MB", "64"))
 
 
 class Plan(BaseModel):
@@ -35,15 +71,25 @@ class PlanRequest(BaseModel):
 
 
 class ImplementRequest(BaseModel):
-    """Запрос на реализацию патча для задачи."""
+    """
+    Запрос на реализацию патча для задачи.
+    `seed` или `deterministic` сообщают, что клиенту подходит повтор ранее полученного
+    ответа на тот же запрос, — только такие вызовы implement попадают в кэш.
+    """
     task: str = Field(..., description="Описание цели")
     model: str | None = None
+    seed: int | None = None
+    deterministic: bool = False
+
+    def cacheable(self) -> bool:
+        return self.seed is not None or self.deterministic
 
 
 class ReviewRequest(BaseModel):
-    """Запрос на финальный ревью набора патчей."""
+    """Запрос на финальный ревью набора патчей: тексты `diffs` или ссылки `diff_refs` из `PUT /diffs`."""
     task: str = Field(..., description="Описание цели")
-    diffs: list[str] = Field(..., description="Список unified diff")
+    diffs: list[str] = Field(default_factory=list, description="Список unified diff")
+    diff_refs: list[str] | None = Field(default=None, description="SHA-256 диффов, загруженных через PUT /diffs")
     model: str | None = None
 
 
@@ -54,16 +100,305 @@ class PatchResponse(BaseModel):
     stderr: str
 
 
-def _run(cmd: list[str], cwd: Path, timeout: int = 180) -> subprocess.CompletedProcess:
-    """Запускает команду в каталоге `cwd` с таймаутом, возвращает CompletedProcess."""
-    return subprocess.run(cmd, cwd=cwd, capture_output=True, text=True, timeout=timeout)
+class ClientDisconnected(RuntimeError):
+    """Клиент закрыл соединение, не дождавшись ответа; процесс Codex остановлен."""
+
+
+class QueueFull(RuntimeError):
+    """Все слоты заняты и очередь ожидания заполнена; `retry_after` — через сколько секунд повторить."""
+
+    def __init__(self, retry_after: int) -> None:
+        super().__init__("codex runner is busy")
+        self.retry_after = retry_after
+
+
+class ExecQueue:
+    """
+    Допуск запросов к `codex exec`: не более `concurrency` процессов одновременно
+    и не более `max_queue` ожидающих; остальные отклоняются сразу через `QueueFull`.
+    Освободившийся слот передаётся первому ожидающему (FIFO). Все методы вызываются
+    из event loop сервиса, поэтому блокировки не нужны.
+    """
+
+    def __init__(self, concurrency: int, max_queue: int) -> None:
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        # Скользящее среднее длительности запуска — для оценки Retry-After
+        self.avg_duration = 10.0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for fut in self._waiters if not fut.done())
+
+    def retry_after(self) -> int:
+        """Сколько секунд, по текущей загрузке, ждать освобождения слота в очереди."""
+        rounds = (self.queued + 1) / max(1, self.concurrency)
+        return max(1, math.ceil(self.avg_duration * rounds))
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Занимает слот на время блока `async with`, при необходимости дождавшись очереди."""
+        if self.in_flight < self.concurrency and not self.queued:
+            self.in_flight += 1
+        elif self.queued >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull(self.retry_after())
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                # Слот мог быть уже передан нам перед отменой — возвращаем его следующему
+                if fut.done() and not fut.cancelled():
+                    self._release()
+                raise
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.avg_duration = 0.8 * self.avg_duration + 0.2 * (time.monotonic() - started)
+            self.completed += 1
+            self._release()
+
+    def _release(self) -> None:
+        """Передаёт слот первому живому ожидающему либо освобождает его."""
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> dict[str, int]:
+        """Лимиты, текущая загрузка и счётчики обработанных/отклонённых запросов."""
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+EXEC_QUEUE = ExecQueue(MAX_CONCURRENCY, MAX_QUEUE)
+RESPONSES = TieredCache(
+    MemoryCache(CACHE_ENTRIES, max(CACHE_TTLS.values())),
+    DiskCache(Path(CACHE_DIR), CACHE_DISK_ENTRIES, max(CACHE_TTLS.values())) if CACHE_DIR else None,
+)
+# Счётчики кэша по ролям: hits/misses/bypassed
+CACHE_STATS: dict[str, dict[str, int]] = {role: {"hits": 0, "misses": 0, "bypassed": 0} for role in CACHE_TTLS}
+
+METRICS = Registry()
+QUEUE_WAIT_SECONDS = METRICS.histogram("aw_codex_queue_wait_seconds", "Ожидание слота `codex exec`", ("role",))
+EXEC_SECONDS = METRICS.histogram("aw_codex_exec_seconds", "Выполнение `codex exec`", ("role", "status"))
+WORKSPACE_SECONDS = METRICS.histogram("aw_codex_workspace_seconds", "Подготовка рабочей копии или снапшота", ("role",))
+
+# Baseline-репозиторий проекта строится один раз: implement получает рабочие копии
+# через `git worktree` из пула, plan и review читают общий снапшот только для чтения.
+WORKSPACES = WorkspacePool(DEMO_APP_DIR, WORKSPACES_READY)
+_SNAPSHOT: Workspace | None = None
+_SNAPSHOT_LOCK = threading.Lock()
+
+
+def _baseline_hash() -> str:
+    """Хеш дерева baseline: ответы на старый baseline не переиспользуются после его изменения."""
+    WORKSPACES.start()
+    assert WORKSPACES.baseline is not None
+    return WORKSPACES.baseline.tree
+
+
+def _readonly_snapshot() -> Workspace:
+    """Общая рабочая копия baseline без прав записи; создаётся при первом обращении."""
+    global _SNAPSHOT
+    with _SNAPSHOT_LOCK:
+        if _SNAPSHOT is None:
+            WORKSPACES.start()
+            assert WORKSPACES.baseline is not None
+            ws = WORKSPACES.baseline.add_worktree()
+            set_readonly(ws.target, True)
+            _SNAPSHOT = ws
+        return _SNAPSHOT
+
+
+@asynccontextmanager
+async def _workspace() -> AsyncIterator[Workspace]:
+    """
+    Рабочая копия из пула на время блока `async with`. Выдача может создать worktree на месте,
+    поэтому идёт в потоке; если запрос отменён, пока поток работает, копия возвращается
+    в пул сразу после его завершения, а не теряется.
+    """
+    lease = WORKSPACES.acquire()
+    entering = asyncio.ensure_future(asyncio.to_thread(lease.__enter__))
+    try:
+        ws = await asyncio.shield(entering)
+    except asyncio.CancelledError:
+        entering.add_done_callback(
+            lambda f: None if f.cancelled() or f.exception() else lease.__exit__(None, None, None)
+        )
+        raise
+    try:
+        yield ws
+    finally:
+        # Копия сбрасывается к baseline в фоне и возвращается в пул
+        lease.__exit__(None, None, None)
+
+
+def _verify_snapshot(ws: Workspace) -> None:
+    """
+    Возвращает снапшот к baseline, если Codex всё же что-то в нём изменил
+    (права не защищают от процесса, запущенного под root).
+    """
+    with _SNAPSHOT_LOCK:
+        if not git(["status", "--porcelain"], ws.root).stdout.strip():
+            return
+        assert WORKSPACES.baseline is not None
+        set_readonly(ws.target, False)
+        WORKSPACES.baseline.reset(ws)
+        set_readonly(ws.target, True)
+
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Строит baseline, пул рабочих копий и снапшот при старте; убирает их при остановке."""
+    global _SNAPSHOT
+    await asyncio.to_thread(_readonly_snapshot)
+    yield
+    if _SNAPSHOT is not None:
+        # Иначе rmtree не сможет удалить файлы из каталогов без права записи
+        set_readonly(_SNAPSHOT.target, False)
+        _SNAPSHOT = None
+    WORKSPACES.close()
+
 
+app = FastAPI(title="codex-runner", version="0.2.0", lifespan=_lifespan)
+instrument(app, METRICS, "codex")
+DIFFS = DiffStore(DIFF_STORE_MB * 1024 * 1024)
+install(app, DIFFS)
 
-def _ensure_repo(root: Path) -> None:
-    """Инициализирует git-репозиторий с baseline-коммитом для последующих diff."""
-    subprocess.run(["git", "init"], cwd=root, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    subprocess.run(["git", "add", "."], cwd=root, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    subprocess.run(["git", "commit", "-m", "baseline"], cwd=root, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def _cache_lookup(
+    role: str,
+    model: str,
+    prompt: str,
+    request: Request | None,
+    response: Response | None,
+    enabled: bool = True,
+    variant: str = "",
+) -> tuple[str | None, dict | None]:
+    """
+    Ищет ответ роли в кэше. Возвращает (ключ для последующей записи, найденное значение);
+    ключ None — кэш для этого вызова не используется. Итог пишется в заголовок `X-AW-Cache`.
+    """
+    if not (CACHE_ENABLED and enabled):
+        return None, None
+    key = content_key(role, model, prompt, variant, _baseline_hash())
+    bypass = request is not None and request.headers.get(CACHE_HEADER, "").lower() == "bypass"
+    value = None if bypass else RESPONSES.get(key)
+    outcome = "bypassed" if bypass else ("hits" if value is not None else "misses")
+    CACHE_STATS[role][outcome] += 1
+    if response is not None:
+        response.headers[CACHE_HEADER] = {"bypassed": "bypass", "hits": "hit", "misses": "miss"}[outcome]
+    return key, value
+
+
+def _cache_store(role: str, key: str | None, value: dict) -> None:
+    """Сохраняет успешный ответ роли с её TTL."""
+    if key is not None:
+        RESPONSES.set(key, value, CACHE_TTLS[role])
+
+
+OnLine = Callable[[str, str], None]
+"""Получатель строк вывода `codex exec` по мере появления: (имя потока stdout/stderr, строка)."""
+
+
+def _kill(proc: asyncio.subprocess.Process) -> None:
+    """Убивает процесс вместе с его группой (Codex запускает дочерние команды)."""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def _pump(stream: asyncio.StreamReader, name: str, on_line: OnLine) -> bytes:
+    """Читает поток процесса до конца, отдавая `on_line` каждую строку, как только она завершена."""
+    data = bytearray()
+    tail = b""
+    while chunk := await stream.read(65536):
+        data += chunk
+        *lines, tail = (tail + chunk).split(b"\n")
+        for line in lines:
+            on_line(name, line.decode("utf-8", "replace"))
+    if tail:
+        on_line(name, tail.decode("utf-8", "replace"))
+    return bytes(data)
+
+
+async def _communicate(proc: asyncio.subprocess.Process, on_line: OnLine) -> tuple[bytes, bytes]:
+    """`proc.communicate()`, который по ходу отдаёт строки stdout и stderr в `on_line`."""
+    out, err = await asyncio.gather(_pump(proc.stdout, "stdout", on_line), _pump(proc.stderr, "stderr", on_line))
+    await proc.wait()
+    return out, err
+
+
+async def _run(
+    cmd: list[str], cwd: Path, timeout: int = 180, request: Request | None = None, on_line: OnLine | None = None,
+) -> subprocess.CompletedProcess:
+    """
+    Запускает команду в каталоге `cwd` с таймаутом, не блокируя event loop; возвращает CompletedProcess.
+    Если передан `request` и клиент отключился, процесс убивается и бросается `ClientDisconnected`.
+    С `on_line` строки вывода отдаются по мере появления.
+    """
+    deadline = time.monotonic() + timeout
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, cwd=cwd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, start_new_session=True,
+    )
+    output = asyncio.ensure_future(proc.communicate() if on_line is None else _communicate(proc, on_line))
+    try:
+        while True:
+            done, _ = await asyncio.wait({output}, timeout=DISCONNECT_POLL_S)
+            if done:
+                stdout, stderr = output.result()
+                return subprocess.CompletedProcess(
+                    cmd, proc.returncode, stdout.decode("utf-8", "replace"), stderr.decode("utf-8", "replace"),
+                )
+            if time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            if request is not None and await request.is_disconnected():
+                raise ClientDisconnected("client disconnected, codex exec killed")
+    finally:
+        if not output.done():
+            _kill(proc)
+            await asyncio.shield(output)
+
+
+async def _codex_exec(
+    role: str, model: str, prompt: str, cwd: Path, request: Request | None, on_line: OnLine | None = None,
+) -> subprocess.CompletedProcess:
+    """Запускает `codex exec`, дождавшись слота в `EXEC_QUEUE`; ненулевой код возврата — ошибка."""
+    queued = time.monotonic()
+    async with EXEC_QUEUE.slot():
+        QUEUE_WAIT_SECONDS.observe(time.monotonic() - queued, role=role)
+        started = time.monotonic()
+        status = "error"
+        try:
+            proc = await _run([CODEX_BIN, "--oss", "-m", model, "exec", prompt], cwd=cwd, request=request, on_line=on_line)
+            status = "ok" if proc.returncode == 0 else "failed"
+        finally:
+            EXEC_SECONDS.observe(time.monotonic() - started, role=role, status=status)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip() or "codex exec failed")
+    return proc
+
+
+def _busy(exc: QueueFull) -> HTTPException:
+    """Ответ 429 с подсказкой, когда повторить запрос."""
+    return HTTPException(status_code=429, detail=str(exc), headers={"Retry-After": str(exc.retry_after)})
 
 
 def _json_from_text(text: str) -> dict:
@@ -76,91 +411,175 @@ def _json_from_text(text: str) -> dict:
 
 
 def _diff(root: Path) -> str:
-    """Возвращает unified diff текущего состояния относительно baseline."""
-    proc = subprocess.run(["git", "diff"], cwd=root, capture_output=True, text=True)
-    return proc.stdout
+    """Возвращает unified diff текущего состояния относительно baseline, включая новые файлы."""
+    git(["add", "-A"], root)
+    return git(["diff", "--cached"], root).stdout
+
+
+@app.get("/codex/status")
+def codex_status() -> dict[str, int]:
+    """Загрузка runner'а: лимиты, число выполняющихся и ожидающих `codex exec`."""
+    return EXEC_QUEUE.stats()
+
+
+@app.get("/codex/cache")
+def codex_cache_stats() -> dict:
+    """Состояние кэша ответов: включён ли он, общие счётчики и счётчики по ролям."""
+    return {"enabled": CACHE_ENABLED, **RESPONSES.stats(), "roles": CACHE_STATS}
 
 
 @app.post("/codex/plan", response_model=Plan)
-def codex_plan(req: PlanRequest) -> Plan:
+async def codex_plan(req: PlanRequest, request: Request = None, response: Response = None) -> Plan:
     """
     Просит локальный Codex сформировать JSON-план задачи.
     Ожидается строгое JSON-представление: {"components":[{"name":"...","target_files":["..."]}, ...]}.
     """
-    work = Path(tempfile.mkdtemp(prefix="aw_codex_plan_"))
+    model = req.model or DEFAULT_MODEL
+    prompt = (
+        "ROLE: Software Architect\n"
+        "Output STRICT JSON: {\"components\":[{\"name\":\"...\",\"target_files\":[\"...\"]}]}\n"
+        f"Goal:\n{req.task}\n"
+    )
+    key, cached = _cache_lookup("plan", model, prompt, request, response)
+    if cached is not None:
+        return Plan.model_validate(cached)
+    with WORKSPACE_SECONDS.time(role="plan"):
+        snapshot = await asyncio.to_thread(_readonly_snapshot)
+    used = True
     try:
-        target = work / "demo_app"
-        shutil.copytree(DEMO_APP_DIR, target)
-        model = req.model or DEFAULT_MODEL
-        prompt = (
-            "ROLE: Software Architect\n"
-            "Output STRICT JSON: {\"components\":[{\"name\":\"...\",\"target_files\":[\"...\"]}]}\n"
-            f"Goal:\n{req.task}\n"
-        )
-        proc = _run([CODEX_BIN, "--oss", "-m", model, "exec", prompt], cwd=target)
-        if proc.returncode != 0:
-            raise RuntimeError(proc.stderr.strip() or "codex exec failed")
+        proc = await _codex_exec("plan", model, prompt, snapshot.target, request)
         data = _json_from_text(proc.stdout)
-        return Plan(components=data.get("components", []))
+        plan = Plan(components=data.get("components", []))
+    except QueueFull as exc:
+        # Отказ допуска: Codex в снапшоте не запускался, проверять нечего
+        used = False
+        raise _busy(exc)
     except Exception as exc:  # noqa: BLE001
         raise HTTPException(status_code=400, detail=str(exc))
     finally:
-        shutil.rmtree(work, ignore_errors=True)
+        if used:
+            await asyncio.to_thread(_verify_snapshot, snapshot)
+    _cache_store("plan", key, plan.model_dump())
+    return plan
+
+
+async def _implement_events(req: ImplementRequest, request: Request | None) -> AsyncIterator[str]:
+    """
+    NDJSON-поток implement: строки вывода Codex (`{"event": "stdout"|"stderr", "line"}`) по мере
+    появления, затем `{"event": "result", "result": ...}` или `{"event": "error", "status", "detail"}`.
+    Если клиент отключился, поток закрывается и `codex exec` убивается.
+    """
+    events: asyncio.Queue[dict | None] = asyncio.Queue()
+
+    async def _job() -> None:
+        try:
+            patch = await _implement(req, request, None, lambda name, line: events.put_nowait({"event": name, "line": line}))
+            events.put_nowait({"event": "result", "result": patch.model_dump()})
+        except HTTPException as exc:
+            events.put_nowait({"event": "error", "status": exc.status_code, "detail": exc.detail})
+        finally:
+            events.put_nowait(None)
+
+    job = asyncio.ensure_future(_job())
+    try:
+        while (event := await events.get()) is not None:
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+    finally:
+        job.cancel()
+        await asyncio.gather(job, return_exceptions=True)
 
 
 @app.post("/codex/implement", response_model=PatchResponse)
-def codex_implement(req: ImplementRequest) -> PatchResponse:
+async def codex_implement(
+    req: ImplementRequest, request: Request = None, response: Response = None, stream: bool = False,
+):
     """
     Просит локальный Codex внести правки в копию demo-приложения и возвращает unified diff.
-    Используется неинтерактивный режим `codex exec`.
+    Используется неинтерактивный режим `codex exec`. С `?stream=true` отдаёт NDJSON
+    с выводом Codex по мере появления и результатом в последней строке.
     """
-    work = Path(tempfile.mkdtemp(prefix="aw_codex_impl_"))
+    if stream:
+        return StreamingResponse(_implement_events(req, request), media_type="application/x-ndjson")
+    return await _implement(req, request, response)
+
+
+async def _implement(
+    req: ImplementRequest, request: Request | None, response: Response | None, on_line: OnLine | None = None,
+) -> PatchResponse:
+    """Тело implement; ошибки — `HTTPException`."""
+    model = req.model or DEFAULT_MODEL
+    prompt = (
+        "ROLE: Senior Implementer\n"
+        "Edit files to achieve the goal and keep changes minimal.\n"
+        f"Goal:\n{req.task}\n"
+    )
+    key, cached = _cache_lookup(
+        "implement", model, prompt, request, response, enabled=req.cacheable(), variant=f"seed={req.seed}",
+    )
+    if cached is not None:
+        patch = PatchResponse.model_validate(cached)
+        DIFFS.put([patch.diff])
+        return patch
+    workspace = _workspace()
+    with WORKSPACE_SECONDS.time(role="implement"):
+        ws = await workspace.__aenter__()
     try:
-        target = work / "demo_app"
-        shutil.copytree(DEMO_APP_DIR, target)
-        _ensure_repo(work)
-        model = req.model or DEFAULT_MODEL
-        prompt = (
-            "ROLE: Senior Implementer\n"
-            "Edit files to achieve the goal and keep changes minimal.\n"
-            f"Goal:\n{req.task}\n"
-        )
-        proc = _run([CODEX_BIN, "--oss", "-m", model, "exec", prompt], cwd=target)
-        if proc.returncode != 0:
-            raise RuntimeError(proc.stderr.strip() or "codex exec failed")
-        diff = _diff(work)
+        # В потоковом режиме отключение клиента отслеживает StreamingResponse (он отменяет задачу),
+        # поэтому `request` для опроса не передаётся
+        watch = request if on_line is None else None
+        proc = await _codex_exec("implement", model, prompt, ws.target, watch, on_line)
+        diff = await asyncio.to_thread(_diff, ws.root)
         if not diff.strip():
             raise RuntimeError("codex produced no changes")
-        return PatchResponse(diff=diff, stdout=proc.stdout, stderr=proc.stderr)
+        patch = PatchResponse(diff=diff, stdout=proc.stdout, stderr=proc.stderr)
+    except QueueFull as exc:
+        raise _busy(exc)
     except Exception as exc:  # noqa: BLE001
         raise HTTPException(status_code=400, detail=str(exc))
     finally:
-        shutil.rmtree(work, ignore_errors=True)
+        await workspace.__aexit__(None, None, None)
+    _cache_store("implement", key, patch.model_dump())
+    # Дифф, скорее всего, придёт сюда же на ревью: клиент сможет сослаться на него по хешу
+    DIFFS.put([patch.diff])
+    return patch
 
 
 @app.post("/codex/review", response_model=Review)
-def codex_review(req: ReviewRequest) -> Review:
+async def codex_review(req: ReviewRequest, request: Request = None, response: Response = None) -> Review:
     """
     Просит локальный Codex дать короткий JSON-вердикт по набору патчей.
     Ожидается строгое JSON-представление: {"score": 0..1, "rationale": "..."}.
     """
-    work = Path(tempfile.mkdtemp(prefix="aw_codex_review_"))
+    model = req.model or DEFAULT_MODEL
+    if req.diff_refs:
+        diffs = DIFFS.resolve(req.diff_refs)
+    else:
+        diffs = req.diffs
+        DIFFS.put(diffs)
+    patches = "\n---\n".join(diffs)
+    prompt = (
+        "ROLE: Senior Reviewer\n"
+        "Assess the proposed patches and return STRICT JSON {\"score\": <0..1>, \"rationale\": \"...\"}.\n"
+        f"Goal:\n{req.task}\nPatches:\n{patches}\n"
+    )
+    key, cached = _cache_lookup("review", model, prompt, request, response)
+    if cached is not None:
+        return Review.model_validate(cached)
+    with WORKSPACE_SECONDS.time(role="review"):
+        snapshot = await asyncio.to_thread(_readonly_snapshot)
+    used = True
     try:
-        target = work / "demo_app"
-        shutil.copytree(DEMO_APP_DIR, target)
-        model = req.model or DEFAULT_MODEL
-        patches = "\n---\n".join(req.diffs)
-        prompt = (
-            "ROLE: Senior Reviewer\n"
-            "Assess the proposed patches and return STRICT JSON {\"score\": <0..1>, \"rationale\": \"...\"}.\n"
-            f"Goal:\n{req.task}\nPatches:\n{patches}\n"
-        )
-        proc = _run([CODEX_BIN, "--oss", "-m", model, "exec", prompt], cwd=target)
-        if proc.returncode != 0:
-            raise RuntimeError(proc.stderr.strip() or "codex exec failed")
+        proc = await _codex_exec("review", model, prompt, snapshot.target, request)
         data = _json_from_text(proc.stdout)
-        return Review(score=float(data.get("score", 0.5)), rationale=str(data.get("rationale", "n/a")))
+        review = Review(score=float(data.get("score", 0.5)), rationale=str(data.get("rationale", "n/a")))
+    except QueueFull as exc:
+        # Отказ допуска: Codex в снапшоте не запускался, проверять нечего
+        used = False
+        raise _busy(exc)
     except Exception as exc:  # noqa: BLE001
         raise HTTPException(status_code=400, detail=str(exc))
     finally:
-        shutil.rmtree(work, ignore_errors=True)
+        if used:
+            await asyncio.to_thread(_verify_snapshot, snapshot)
+    _cache_store("review", key, review.model_dump())
+    return review
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Iterable
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+# Хранилище диффов по содержимому: клиент один раз загружает дифф через `PUT /diffs`,
+# а в следующих запросах передаёт только его SHA-256. Если сервис ссылку не знает
+# (вытеснена, сервис перезапущен), он отвечает 409 со списком `missing`; клиент
+# догружает эти диффы и повторяет запрос. Сервисы с хранилищем отмечают каждый ответ
+# заголовком `X-AW-Diff-Store`, по которому клиент понимает, что ссылки можно слать.
+
+DIFF_STORE_HEADER = "X-AW-Diff-Store"
+# Распакованное тело gzip-запроса больше этого размера отвергается (защита от «zip-бомб»)
+MAX_GUNZIP_BYTES = 64 * 1024 * 1024
+
+
+def diff_ref(diff: str) -> str:
+    """Ссылка на дифф: SHA-256 его текста."""
+    return hashlib.sha256(diff.encode("utf-8", "surrogateescape")).hexdigest()
+
+
+class MissingDiffs(KeyError):
+    """В хранилище нет диффов с этими ссылками."""
+
+    def __init__(self, refs: list[str]) -> None:
+        super().__init__(", ".join(refs))
+        self.refs = refs
+
+
+class DiffStore:
+    """Потокобезопасный LRU диффов по ссылке с бюджетом по суммарному размеру текстов."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, diffs: Iterable[str]) -> list[str]:
+        """Сохраняет диффы и возвращает их ссылки в том же порядке."""
+        refs = []
+        with self._lock:
+            for diff in diffs:
+                ref = diff_ref(diff)
+                refs.append(ref)
+                if ref in self._entries:
+                    self._entries.move_to_end(ref)
+                    continue
+                self._entries[ref] = diff
+                self._bytes += len(diff)
+            while len(self._entries) > 1 and self._bytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= len(old)
+        return refs
+
+    def resolve(self, refs: list[str]) -> list[str]:
+        """Тексты диффов по ссылкам; если каких-то нет — `MissingDiffs` со всеми недостающими."""
+        with self._lock:
+            found = [self._entries.get(ref) for ref in refs]
+            missing = list(dict.fromkeys(ref for ref, diff in zip(refs, found) if diff is None))
+            for ref, diff in zip(refs, found):
+                if diff is not None:
+                    self._entries.move_to_end(ref)
+            self.hits += len(refs) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            raise MissingDiffs(missing)
+        return found  # type: ignore[return-value]
+
+    def stats(self) -> dict[str, int]:
+        """Число диффов, занятый бюджет и счётчики попаданий."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class DiffUpload(BaseModel):
+    """Тело `PUT /diffs`: тексты диффов."""
+    diffs: list[str]
+
+
+class DiffRefs(BaseModel):
+    """Ответ `PUT /diffs`: ссылки на загруженные диффы в порядке загрузки."""
+    refs: list[str]
+
+
+class GzipRequests:
+    """ASGI-middleware: распаковывает тела запросов с `Content-Encoding: gzip`."""
+
+    def __init__(self, app: Any, max_bytes: int = MAX_GUNZIP_BYTES) -> None:
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        headers = dict(scope.get("headers") or []) if scope["type"] == "http" else {}
+        if headers.get(b"content-encoding", b"").lower() != b"gzip":
+            await self.app(scope, receive, send)
+            return
+        chunks = []
+        more = True
+        while more:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more = message.get("more_body", False)
+        try:
+            inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            body = inflater.decompress(b"".join(chunks), self.max_bytes + 1)
+            if len(body) > self.max_bytes or not inflater.eof:
+                raise ValueError("gzip body is truncated or too large")
+        except (zlib.error, ValueError) as exc:
+            await JSONResponse({"detail": f"invalid gzip body: {exc}"}, status_code=400)(scope, receive, send)
+            return
+        scope = {
+            **scope,
+            "headers": [
+                (k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")
+            ] + [(b"content-length", str(len(body)).encode())],
+        }
+        sent = False
+
+        async def _receive() -> dict:
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app(scope, _receive, send)
+
+
+class AdvertiseDiffStore:
+    """ASGI-middleware: отмечает каждый ответ заголовком `X-AW-Diff-Store`."""
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def _send(message: dict) -> None:
+            if message["type"] == "http.response.start":
+                headers = [*message.get("headers", []), (DIFF_STORE_HEADER.lower().encode(), b"sha256")]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, _send)
+
+
+def install(app: FastAPI, store: DiffStore) -> None:
+    """
+    Подключает к сервису хранилище диффов: `PUT /diffs`, `GET /diffs` (статистика),
+    ответ 409 со списком `missing` на неизвестные ссылки, распаковку gzip-запросов
+    и заголовок `X-AW-Diff-Store` во всех ответах.
+    """
+    app.add_middleware(AdvertiseDiffStore)
+    app.add_middleware(GzipRequests)
+
+    @app.exception_handler(MissingDiffs)
+    async def _missing(request: Request, exc: MissingDiffs) -> JSONResponse:
+        return JSONResponse({"detail": "unknown diff refs, upload them via PUT /diffs", "missing": exc.refs}, 409)
+
+    @app.put("/diffs", response_model=DiffRefs)
+    def put_diffs(req: DiffUpload) -> DiffRefs:
+        """Загружает диффы; повторная загрузка того же текста ничего не меняет."""
+        return DiffRefs(refs=store.put(req.diffs))
+
+    @app.get("/diffs")
+    def diff_stats() -> dict[str, int]:
+        """Состояние хранилища диффов."""
+        return store.stats()
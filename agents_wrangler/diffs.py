@@ -0,0 +1,345 @@
+from __future__ import annotations
+
+import hashlib
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+
+# Заголовок ханка: "@@ -a[,b] +c[,d] @@ [контекст функции]"
+_HUNK_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+def _path(header: str) -> str:
+    """Путь из строки `--- a/x` / `+++ b/x` без метки времени, которую добавляет diff -u."""
+    return header[4:].split("\t", 1)[0].strip()
+
+
+def _split_files(lines: list[str]) -> list[list[str]]:
+    """
+    Делит дифф на секции по файлам. Секция начинается со строки `diff --git` либо, для
+    обычного `diff -u` с несколькими файлами, с пары `---`/`+++` после ханков предыдущего файла.
+    """
+    sections: list[list[str]] = []
+    current: list[str] = []
+    in_hunk = False
+    for i, line in enumerate(lines):
+        next_line = lines[i + 1] if i + 1 < len(lines) else ""
+        plain_header = line.startswith("--- ") and next_line.startswith("+++ ")
+        if line.startswith("diff --git ") or (plain_header and in_hunk):
+            if current:
+                sections.append(current)
+            current, in_hunk = [], False
+        in_hunk = in_hunk or line.startswith("@@")
+        current.append(line)
+    if current:
+        sections.append(current)
+    return sections
+
+
+def _normalize_section(section: list[str]) -> tuple[str, list[str]]:
+    """Приводит секцию одного файла к каноническому виду; возвращает (путь, строки)."""
+    out: list[str] = []
+    old = new = ""
+    for line in section:
+        if line.startswith("index ") or line.startswith("diff --git "):
+            # Хеши blob'ов и дублирующая строка с путями не влияют на смысл патча
+            continue
+        if line.startswith("--- ") or line.startswith("+++ "):
+            path = _path(line)
+            if line.startswith("---"):
+                old = path
+            else:
+                new = path
+            out.append(f"{line[:3]} {path}")
+            continue
+        m = _HUNK_RE.match(line)
+        if m:
+            a, b, c, d = m.groups()
+            out.append(f"@@ -{a},{b or 1} +{c},{d or 1} @@")
+        elif line.startswith("@@"):
+            out.append("@@")
+        else:
+            out.append(line.rstrip())
+    while out and not out[-1]:
+        out.pop()
+    path = new if new and new != "/dev/null" else old
+    if path.startswith(("a/", "b/")):
+        path = path[2:]
+    return path, out
+
+
+def normalize_diff(diff: str) -> str:
+    """
+    Канонический вид unified diff для сравнения кандидатов: без строк `index`/`diff --git`
+    и меток времени, с явными счётчиками в заголовках ханков (без контекста функции),
+    без хвостовых пробелов и с файлами, упорядоченными по пути.
+    """
+    lines = diff.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    sections = [_normalize_section(s) for s in _split_files(lines)]
+    sections = [s for s in sections if s[1]]
+    sections.sort(key=lambda s: s[0])
+    return "".join("\n".join(body) + "\n" for _, body in sections)
+
+
+def diff_fingerprint(diff: str) -> str:
+    """SHA-256 канонического вида диффа: равные отпечатки — эквивалентные патчи."""
+    return hashlib.sha256(normalize_diff(diff).encode()).hexdigest()
+
+
+# --- применение патчей ------------------------------------------------------
+#
+# Движок применяет unified diff прямо в процессе: разбирает секции файлов (включая
+# новые, удалённые и переименованные), ищет каждый ханк сначала на месте из заголовка,
+# затем со смещением и, если не нашёл, с fuzz — отбрасывая до `fuzz` строк контекста
+# с краёв, как GNU patch. Счётчики строк в заголовках ханков не проверяются: патчи от
+# моделей часто их путают, а граница ханка и так видна по следующему `@@`.
+# Файлы записываются только если применились все ханки.
+
+_NO_NEWLINE = "\\ No newline at end of file"
+
+
+@dataclass
+class Hunk:
+    """Ханк: позиция в старом файле и строки с префиксами ' ', '-', '+'."""
+    header: str
+    old_start: int
+    lines: list[str] = field(default_factory=list)
+    # Маркер `\ No newline at end of file` после строки старой / новой стороны
+    old_no_newline: bool = False
+    new_no_newline: bool = False
+
+    @property
+    def old(self) -> list[str]:
+        return [line[1:] for line in self.lines if line[0] in " -"]
+
+    @property
+    def new(self) -> list[str]:
+        return [line[1:] for line in self.lines if line[0] in " +"]
+
+    def context(self) -> tuple[int, int]:
+        """Число строк контекста в начале и в конце ханка."""
+        kinds = [line[0] for line in self.lines]
+        lead = next((i for i, k in enumerate(kinds) if k != " "), len(kinds))
+        trail = next((i for i, k in enumerate(reversed(kinds)) if k != " "), len(kinds))
+        return lead, trail
+
+
+@dataclass
+class FilePatch:
+    """Изменения одного файла; `old_path`/`new_path` равны None для нового/удалённого файла."""
+    old_path: str | None
+    new_path: str | None
+    hunks: list[Hunk] = field(default_factory=list)
+    new_mode: str | None = None
+
+
+@dataclass
+class HunkFailure:
+    """Ханк (или файл целиком при `hunk == 0`), который не удалось применить."""
+    path: str
+    hunk: int
+    header: str
+    reason: str
+
+    def __str__(self) -> str:
+        where = f"hunk #{self.hunk} ({self.header})" if self.hunk else "file"
+        return f"{self.path}: {where}: {self.reason}"
+
+
+class PatchError(ValueError):
+    """Патч не разобран или не применился; `failures` — какие ханки и почему."""
+
+    def __init__(self, failures: list[HunkFailure]) -> None:
+        super().__init__("; ".join(map(str, failures)))
+        self.failures = failures
+
+
+def _strip_prefix(path: str) -> str | None:
+    """Путь без префикса `a/`/`b/`; None для `/dev/null`."""
+    if path == "/dev/null":
+        return None
+    return path[2:] if path.startswith(("a/", "b/")) else path
+
+
+def _parse_section(section: list[str]) -> FilePatch:
+    """Разбирает секцию одного файла: расширенные заголовки git, `---`/`+++` и ханки."""
+    old: str | None = ""
+    new: str | None = ""
+    new_mode = None
+    renamed = False
+    hunks: list[Hunk] = []
+    while section and not section[-1]:
+        section = section[:-1]
+    for line in section:
+        m = _HUNK_RE.match(line)
+        if m:
+            hunks.append(Hunk(header=line.split(" @@", 1)[0] + " @@", old_start=int(m.group(1))))
+        elif hunks:
+            hunk = hunks[-1]
+            if line.startswith("\\"):
+                kind = hunk.lines[-1][0] if hunk.lines else " "
+                hunk.old_no_newline = hunk.old_no_newline or kind in " -"
+                hunk.new_no_newline = hunk.new_no_newline or kind in " +"
+            elif line[:1] in (" ", "-", "+"):
+                hunk.lines.append(line)
+            elif not line:
+                # Пустая строка контекста, у которой редактор срезал пробел
+                hunk.lines.append(" ")
+            else:
+                raise PatchError([HunkFailure(new or old or "?", len(hunks), hunk.header, f"unexpected line {line!r}")])
+        elif line.startswith("diff --git "):
+            parts = line[len("diff --git "):].split(" b/", 1)
+            if len(parts) == 2:
+                old, new = _strip_prefix(parts[0]), parts[1]
+        elif line.startswith("--- "):
+            old = _strip_prefix(_path(line))
+        elif line.startswith("+++ "):
+            new = _strip_prefix(_path(line))
+        elif line.startswith("rename from "):
+            old, renamed = line[len("rename from "):], True
+        elif line.startswith("rename to "):
+            new, renamed = line[len("rename to "):], True
+        elif line.startswith("new file mode "):
+            old, new_mode = None, line.split()[-1]
+        elif line.startswith("deleted file mode "):
+            new = None
+        elif line.startswith("new mode "):
+            new_mode = line.split()[-1]
+        elif line.startswith(("GIT binary patch", "Binary files ")):
+            raise PatchError([HunkFailure(new or old or "?", 0, "", "binary patches are not supported")])
+        elif line[:1] in (" ", "-", "+", "@"):
+            # Строки изменений без распознанного заголовка ханка (например, голый `@@`)
+            # нельзя молча пропускать: файл остался бы без изменений
+            raise PatchError([HunkFailure(new or old or "?", 0, "", f"line outside a hunk {line!r}")])
+    # "" — путь не встретился в заголовках; None — /dev/null
+    if old == "" and new == "":
+        raise PatchError([HunkFailure("?", 0, "", "no file header")])
+    if not hunks and not (renamed or old is None or new is None or new_mode):
+        raise PatchError([HunkFailure(new or old or "?", 0, "", "no hunks")])
+    return FilePatch(
+        old_path=new if old == "" else old, new_path=old if new == "" else new, hunks=hunks, new_mode=new_mode,
+    )
+
+
+def parse_patch(diff: str) -> list[FilePatch]:
+    """Разбирает unified diff (git или `diff -u`) на изменения по файлам."""
+    lines = diff.replace("\r\n", "\n").split("\n")
+    sections = [s for s in _split_files(lines) if any(line.strip() for line in s)]
+    return [_parse_section(s) for s in sections]
+
+
+def _find(lines: list[str], old: list[str], expected: int, lo: int) -> int | None:
+    """Позиция `old` в `lines` не раньше `lo`, ближайшая к `expected`."""
+    hi = len(lines) - len(old)
+    if hi < lo:
+        return None
+    expected = min(max(expected, lo), hi)
+    for d in range(max(expected - lo, hi - expected) + 1):
+        for pos in (expected - d, expected + d) if d else (expected,):
+            if lo <= pos <= hi and lines[pos:pos + len(old)] == old:
+                return pos
+    return None
+
+
+def _apply_hunks(
+    path: str, lines: list[str], newline: bool, hunks: list[Hunk], fuzz: int, failures: list[HunkFailure],
+) -> tuple[list[str], bool]:
+    """Применяет ханки к строкам файла; неприменившиеся ханки добавляются в `failures`."""
+    # Сдвиг строк относительно нумерации старого файла: изменение длины уже
+    # применённых ханков плюс смещение, с которым они нашлись
+    shift = 0
+    lo = 0
+    for index, hunk in enumerate(hunks, start=1):
+        old, new = hunk.old, hunk.new
+        lead_ctx, trail_ctx = hunk.context()
+        # Для ханка без старых строк `old_start` — строка, после которой идёт вставка
+        base = hunk.old_start if not old else hunk.old_start - 1
+        expected = base + shift
+        pos = None
+        for f in range(fuzz + 1):
+            lead, trail = min(f, lead_ctx), min(f, trail_ctx)
+            if f and not (lead or trail):
+                break
+            old_f, new_f = old[lead:len(old) - trail], new[lead:len(new) - trail]
+            pos = _find(lines, old_f, expected + lead, lo) if old_f else min(max(expected + lead, lo), len(lines))
+            if pos is not None:
+                break
+        if pos is None:
+            failures.append(HunkFailure(path, index, hunk.header, "context does not match"))
+            continue
+        end = pos + len(old_f)
+        if end == len(lines) and (new_f or hunk.new_no_newline):
+            newline = not hunk.new_no_newline
+        lines = lines[:pos] + new_f + lines[end:]
+        shift = pos - lead - base + len(new_f) - len(old_f)
+        lo = pos + len(new_f)
+    return lines, newline
+
+
+def _safe_path(root: Path, rel: str) -> Path:
+    """Путь внутри `root`; абсолютные пути и выход через `..` запрещены."""
+    if Path(rel).is_absolute() or ".." in Path(rel).parts:
+        raise PatchError([HunkFailure(rel, 0, "", "path escapes the project root")])
+    return root / rel
+
+
+def apply_patch(root: Path, diff: str, fuzz: int = 2) -> list[str]:
+    """
+    Применяет unified diff к дереву `root` без внешних процессов и возвращает пути
+    изменённых файлов. Если не применился хоть один ханк, ничего не пишется и бросается
+    `PatchError` со списком неудачных ханков.
+    """
+    patches = parse_patch(diff)
+    if not patches:
+        raise PatchError([HunkFailure("?", 0, "", "no file changes in patch")])
+    failures: list[HunkFailure] = []
+    writes: dict[str, tuple[str | None, str | None]] = {}
+    for fp in patches:
+        src = fp.old_path
+        path = fp.new_path or fp.old_path or "?"
+        content = ""
+        if src is not None:
+            if src in writes:
+                content = writes[src][0] or ""
+            else:
+                target = _safe_path(root, src)
+                if not target.is_file():
+                    failures.append(HunkFailure(src, 0, "", "no such file"))
+                    continue
+                content = target.read_bytes().decode("utf-8", "surrogateescape")
+        elif _safe_path(root, path).exists():
+            failures.append(HunkFailure(path, 0, "", "file already exists"))
+            continue
+        newline = content.endswith("\n") or not content
+        lines = content.split("\n")
+        if newline:
+            lines.pop()
+        before = len(failures)
+        lines, newline = _apply_hunks(path, lines, newline, fp.hunks, fuzz, failures)
+        if len(failures) > before:
+            continue
+        if src is not None and src != fp.new_path:
+            # Удаление или переименование: старый путь исчезает
+            writes[src] = (None, None)
+        if fp.new_path is None:
+            continue
+        text = "\n".join(lines) + ("\n" if lines and newline else "")
+        writes[fp.new_path] = (text, fp.new_mode)
+    if failures:
+        raise PatchError(failures)
+
+    for rel, (text, mode) in writes.items():
+        target = _safe_path(root, rel)
+        if text is None:
+            target.unlink(missing_ok=True)
+            # Как и git, убираем опустевшие каталоги
+            parent = target.parent
+            while parent != root and parent.is_dir() and not any(parent.iterdir()):
+                parent.rmdir()
+                parent = parent.parent
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(text.encode("utf-8", "surrogateescape"))
+        if mode is not None:
+            target.chmod(0o755 if mode.endswith("755") else 0o644)
+    return list(writes)
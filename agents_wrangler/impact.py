@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import ast
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+
+from agents_wrangler.diffs import PatchError, parse_patch
+
+# Выбор затронутых тестов по графу импортов: для каждого .py-файла проекта известно,
+# какие локальные модули он импортирует; тестовый файл затронут, если он транзитивно
+# импортирует изменённый файл. Граф строится по AST один раз на baseline, а файлы,
+# изменённые стеком диффов, перечитываются из рабочей копии.
+#
+# Выбор консервативен: изменение не-.py файла, conftest.py, удаление или переименование
+# файла требует полного прогона. Импорты через importlib/__import__ граф не видит.
+
+# Каталоги, которые не обходятся при построении графа
+_SKIP_DIRS = {".git", "__pycache__", ".venv", "venv", "node_modules", ".pytest_cache"}
+
+
+def is_test_file(path: str) -> bool:
+    """Файл, который pytest соберёт по умолчанию: `test_*.py` или `*_test.py`."""
+    name = PurePosixPath(path).name
+    return name.endswith(".py") and (name.startswith("test_") or name.endswith("_test.py"))
+
+
+def _parametrize_size(dec: ast.expr) -> int:
+    """Число наборов в `@pytest.mark.parametrize(..., [...])`; 1, если список не литерал."""
+    if isinstance(dec, ast.Call) and getattr(dec.func, "attr", "") == "parametrize" and len(dec.args) > 1:
+        values = dec.args[1]
+        if isinstance(values, (ast.List, ast.Tuple)):
+            return max(len(values.elts), 1)
+    return 1
+
+
+def _count_tests(tree: ast.Module) -> int:
+    """Статическая оценка числа тестов модуля с учётом литеральной параметризации."""
+    def _funcs(body: list[ast.stmt]) -> int:
+        n = 0
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name.startswith("test"):
+                size = 1
+                for dec in node.decorator_list:
+                    size *= _parametrize_size(dec)
+                n += size
+        return n
+
+    total = _funcs(tree.body)
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name.startswith("Test"):
+            total += _funcs(node.body)
+    return total
+
+
+def _imported_names(tree: ast.Module, package: str) -> set[str]:
+    """Абсолютные имена модулей, которые импортирует файл из пакета `package`."""
+    names: set[str] = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                parts = package.split(".") if package else []
+                base = parts[:len(parts) - node.level + 1] if node.level > 1 else parts
+                prefix = ".".join([*base, *([node.module] if node.module else [])])
+            else:
+                prefix = node.module or ""
+            if prefix:
+                names.add(prefix)
+            # `from pkg import mod` может импортировать подмодуль
+            names.update(f"{prefix}.{alias.name}" if prefix else alias.name for alias in node.names)
+    return names
+
+
+@dataclass
+class ImportGraph:
+    """
+    Локальные импорты проекта: `deps[path]` — файлы, которые импортирует `path`,
+    `tests[path]` — оценка числа тестов тестового файла. Пути относительны корню
+    рабочей копии, как в диффах (`demo_app/app.py`).
+    """
+    project: str
+    deps: dict[str, set[str]] = field(default_factory=dict)
+    tests: dict[str, int] = field(default_factory=dict)
+    # Исходники, из которых построены рёбра: нужны, чтобы разрешить импорты заново
+    _trees: dict[str, ast.Module] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def build(cls, root: Path, project: str) -> ImportGraph:
+        """Строит граф по всем .py-файлам каталога `root / project`."""
+        graph = cls(project)
+        base = root / project
+        for path in sorted(base.rglob("*.py")):
+            if _SKIP_DIRS.intersection(path.relative_to(base).parts):
+                continue
+            graph._parse(root, path.relative_to(root).as_posix())
+        graph._link()
+        return graph
+
+    def updated(self, root: Path, paths: set[str]) -> ImportGraph:
+        """Копия графа, в которой `paths` перечитаны из `root` (несуществующие — удалены)."""
+        graph = ImportGraph(self.project, tests=dict(self.tests), _trees=dict(self._trees))
+        for rel in paths:
+            graph._trees.pop(rel, None)
+            graph.tests.pop(rel, None)
+            if rel.endswith(".py") and (root / rel).is_file():
+                graph._parse(root, rel)
+        graph._link()
+        return graph
+
+    def _parse(self, root: Path, rel: str) -> None:
+        try:
+            tree = ast.parse((root / rel).read_bytes(), rel)
+        except (SyntaxError, ValueError):
+            # Непарсящийся файл ничего не импортирует, но тесты, которые его импортируют, затронуты
+            tree = ast.Module(body=[], type_ignores=[])
+        self._trees[rel] = tree
+        if is_test_file(rel):
+            self.tests[rel] = _count_tests(tree)
+
+    def _link(self) -> None:
+        """Разрешает импорты каждого файла в пути файлов проекта."""
+        modules: dict[str, str] = {}
+        for rel in self._trees:
+            parts = list(PurePosixPath(rel).with_suffix("").parts)
+            if parts[-1] == "__init__":
+                parts.pop()
+            # Модуль доступен и от корня рабочей копии (`demo_app.app`), и от каталога проекта (`app`)
+            modules.setdefault(".".join(parts), rel)
+            if len(parts) > 1:
+                modules.setdefault(".".join(parts[1:]), rel)
+        self.deps = {}
+        for rel, tree in self._trees.items():
+            parts = list(PurePosixPath(rel).parent.parts)
+            package = ".".join(parts)
+            found: set[str] = set()
+            for name in _imported_names(tree, package):
+                pieces = name.split(".")
+                # Импорт `a.b.c` исполняет и `a/__init__.py`, `a/b/__init__.py`;
+                # кроме того, pytest кладёт каталог теста в sys.path для соседних модулей
+                for i in range(1, len(pieces) + 1):
+                    for candidate in (".".join(pieces[:i]), ".".join([*parts, *pieces[:i]])):
+                        if candidate in modules and modules[candidate] != rel:
+                            found.add(modules[candidate])
+            self.deps[rel] = found
+
+    def impacted(self, changed: set[str]) -> set[str]:
+        """Тестовые файлы, которые транзитивно импортируют один из `changed` (или сами изменены)."""
+        users: dict[str, set[str]] = {}
+        for rel, deps in self.deps.items():
+            for dep in deps:
+                users.setdefault(dep, set()).add(rel)
+        seen = set(changed)
+        stack = list(changed)
+        while stack:
+            for user in users.get(stack.pop(), ()):
+                if user not in seen:
+                    seen.add(user)
+                    stack.append(user)
+        return {rel for rel in seen if rel in self.tests}
+
+
+@dataclass
+class ChangedFiles:
+    """Пути, которые меняет дифф; `full_reason` — почему выбор тестов невозможен."""
+    paths: set[str] = field(default_factory=set)
+    full_reason: str = ""
+
+
+def changed_files(diff: str) -> ChangedFiles:
+    """Разбирает дифф и решает, можно ли по нему выбирать тесты."""
+    try:
+        patches = parse_patch(diff)
+    except PatchError as exc:
+        return ChangedFiles(full_reason=f"unparsable diff: {exc}")
+    out = ChangedFiles()
+    for fp in patches:
+        for path in (fp.old_path, fp.new_path):
+            if path is not None:
+                out.paths.add(path)
+        path = fp.new_path or fp.old_path or ""
+        if fp.old_path is not None and fp.old_path != fp.new_path:
+            out.full_reason = out.full_reason or f"{fp.old_path} is removed or renamed"
+        elif not path.endswith(".py"):
+            out.full_reason = out.full_reason or f"{path} is not a Python module"
+        elif PurePosixPath(path).name == "conftest.py":
+            out.full_reason = out.full_reason or f"{path} may affect every test"
+    return out
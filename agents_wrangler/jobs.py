@@ -0,0 +1,359 @@
+from __future__ import annotations
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Literal
+
+import httpx
+from pydantic import BaseModel, TypeAdapter
+
+from agents_wrangler.orchestrator import (
+    BestOfNResult,
+    BridgeEvent,
+    MultiBridgeResult,
+    OnEvent,
+    Selection,
+    SpecialistMode,
+    TestSelect,
+    bridge_best_of_n,
+    bridge_multi,
+)
+
+# Режим заданий: мост ставится в очередь SQLite и сразу получает run ID, а выполняют его
+# воркеры (`aw worker`) с ограниченным параллелизмом. Состояние, события и результат
+# хранятся в той же базе, поэтому обрыв соединения или закрытый терминал работу не теряют.
+# Несколько воркеров (в том числе в разных процессах) делят одну базу: задание
+# захватывается транзакцией, а задание упавшего воркера (без heartbeat дольше
+# `STALE_AFTER`) возвращается в очередь, пока не исчерпаны попытки.
+
+JOBS_DB = Path(os.environ.get("AW_JOBS_DB", Path.home() / ".agents_wrangler" / "jobs.sqlite3"))
+JOB_WORKERS = int(os.environ.get("AW_JOB_WORKERS", "2"))
+# Секунды без heartbeat, после которых задание считается брошенным воркером
+STALE_AFTER = float(os.environ.get("AW_JOB_STALE_AFTER", "60"))
+MAX_ATTEMPTS = int(os.environ.get("AW_JOB_MAX_ATTEMPTS", "3"))
+# Лимит на каждый HTTP-вызов моста: в режиме заданий терминал не ждёт, так что он щедрый
+JOB_HTTP_TIMEOUT = float(os.environ.get("AW_JOB_HTTP_TIMEOUT", "600"))
+
+JobKind = Literal["bridge", "multi"]
+"""Какой мост запускает задание: best-of-N или мультиагентный конвейер."""
+
+JobStatus = Literal["queued", "running", "succeeded", "failed"]
+
+FINAL_STATUSES = ("succeeded", "failed")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    heartbeat REAL,
+    worker TEXT,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_queue ON runs (status, created);
+CREATE TABLE IF NOT EXISTS events (
+    run_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (run_id, seq)
+);
+"""
+
+
+class JobSpec(BaseModel):
+    """Параметры моста для задания; поля мультиконвейера не используются в `kind="bridge"`."""
+    kind: JobKind = "bridge"
+    task: str
+    builder_urls: list[str]
+    tester_url: str
+    candidates: int | None = None
+    selection: Selection = "best"
+    plan_urls: list[str] = []
+    review_urls: list[str] = []
+    specialists: int = 0
+    specialist_mode: SpecialistMode = "incremental"
+    test_select: TestSelect = "all"
+
+
+class JobRecord(BaseModel):
+    """Состояние задания; `result` — результат моста в JSON-виде, `error` — трейсбек падения."""
+    id: str
+    kind: JobKind
+    status: JobStatus
+    spec: JobSpec
+    attempts: int = 0
+    created: float
+    started: float | None = None
+    finished: float | None = None
+    worker: str | None = None
+    result: dict | None = None
+    error: str | None = None
+
+
+class JobEvent(BaseModel):
+    """Событие задания: смена статуса или событие моста (см. `BridgeEvent`); `seq` растёт внутри задания с 1."""
+    run_id: str
+    seq: int
+    ts: float
+    event: str
+    data: dict = {}
+
+
+class JobStore:
+    """Очередь и история заданий в SQLite; каждое обращение открывает своё соединение."""
+
+    def __init__(self, path: Path | str = JOBS_DB) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # WAL сохраняется в файле базы: читатели (`aw watch`) не блокируют воркеры
+        with closing(sqlite3.connect(self.path, timeout=30.0)) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+
+    @contextmanager
+    def _tx(self, write: bool = True) -> Iterator[sqlite3.Connection]:
+        """
+        Транзакция; пишущая сразу берёт блокировку на запись, так что захват задания
+        не гоняется с другим воркером.
+        """
+        with closing(sqlite3.connect(self.path, timeout=30.0, isolation_level=None)) as db:
+            db.row_factory = sqlite3.Row
+            db.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    @staticmethod
+    def _event(db: sqlite3.Connection, run_id: str, event: str, data: dict) -> None:
+        seq = db.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM events WHERE run_id = ?", (run_id,)).fetchone()[0]
+        db.execute(
+            "INSERT INTO events (run_id, seq, ts, event, data) VALUES (?, ?, ?, ?, ?)",
+            (run_id, seq, time.time(), event, json.dumps(data, ensure_ascii=False)),
+        )
+
+    @staticmethod
+    def _record(row: sqlite3.Row) -> JobRecord:
+        return JobRecord(
+            id=row["id"], kind=row["kind"], status=row["status"], spec=JobSpec.model_validate_json(row["spec"]),
+            attempts=row["attempts"], created=row["created"], started=row["started"], finished=row["finished"],
+            worker=row["worker"], result=json.loads(row["result"]) if row["result"] else None, error=row["error"],
+        )
+
+    def submit(self, spec: JobSpec) -> str:
+        """Ставит мост в очередь и возвращает run ID."""
+        run_id = uuid.uuid4().hex[:12]
+        with self._tx() as db:
+            db.execute(
+                "INSERT INTO runs (id, kind, spec, status, created) VALUES (?, ?, ?, 'queued', ?)",
+                (run_id, spec.kind, spec.model_dump_json(), time.time()),
+            )
+            self._event(db, run_id, "queued", {"kind": spec.kind})
+        return run_id
+
+    def claim(self, worker: str, stale_after: float = STALE_AFTER, max_attempts: int = MAX_ATTEMPTS) -> JobRecord | None:
+        """
+        Захватывает самое старое задание из очереди. Перед этим задания без heartbeat дольше
+        `stale_after` возвращаются в очередь, а исчерпавшие `max_attempts` помечаются упавшими.
+        """
+        now = time.time()
+        with self._tx() as db:
+            for row in db.execute(
+                "SELECT id, attempts FROM runs WHERE status = 'running' AND heartbeat < ?", (now - stale_after,),
+            ).fetchall():
+                if row["attempts"] >= max_attempts:
+                    error = f"worker lost {row['attempts']} times"
+                    db.execute(
+                        "UPDATE runs SET status = 'failed', finished = ?, error = ? WHERE id = ?", (now, error, row["id"]),
+                    )
+                    self._event(db, row["id"], "failed", {"error": error})
+                else:
+                    db.execute("UPDATE runs SET status = 'queued', worker = NULL WHERE id = ?", (row["id"],))
+                    self._event(db, row["id"], "requeued", {"reason": "stale heartbeat"})
+            row = db.execute("SELECT id FROM runs WHERE status = 'queued' ORDER BY created, id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE runs SET status = 'running', attempts = attempts + 1, started = ?, heartbeat = ?, worker = ? "
+                "WHERE id = ?",
+                (now, now, worker, row["id"]),
+            )
+            self._event(db, row["id"], "running", {"worker": worker})
+            return self._record(db.execute("SELECT * FROM runs WHERE id = ?", (row["id"],)).fetchone())
+
+    def heartbeat(self, run_ids: list[str]) -> None:
+        """Отмечает, что воркер ещё выполняет эти задания."""
+        if not run_ids:
+            return
+        with self._tx() as db:
+            db.executemany(
+                "UPDATE runs SET heartbeat = ? WHERE id = ? AND status = 'running'",
+                [(time.time(), run_id) for run_id in run_ids],
+            )
+
+    def finish(self, run_id: str, result: dict) -> None:
+        """Сохраняет результат успешного моста."""
+        with self._tx() as db:
+            db.execute(
+                "UPDATE runs SET status = 'succeeded', finished = ?, result = ? WHERE id = ?",
+                (time.time(), json.dumps(result, ensure_ascii=False), run_id),
+            )
+            self._event(db, run_id, "succeeded", {"trace_id": result.get("trace_id", "")})
+
+    def fail(self, run_id: str, error: str) -> None:
+        """Помечает задание упавшим; `error` — трейсбек, в событие попадает его последняя строка."""
+        with self._tx() as db:
+            db.execute(
+                "UPDATE runs SET status = 'failed', finished = ?, error = ? WHERE id = ?", (time.time(), error, run_id),
+            )
+            self._event(db, run_id, "failed", {"error": error.strip().splitlines()[-1] if error.strip() else ""})
+
+    def add_event(self, run_id: str, event: str, data: dict | None = None) -> None:
+        """Добавляет событие прогресса задания."""
+        with self._tx() as db:
+            self._event(db, run_id, event, data or {})
+
+    def get(self, run_id: str) -> JobRecord | None:
+        """Задание по run ID (допускается уникальный префикс)."""
+        if not run_id or any(c not in "0123456789abcdef" for c in run_id):
+            return None
+        with self._tx(write=False) as db:
+            rows = db.execute("SELECT * FROM runs WHERE id LIKE ? LIMIT 2", (f"{run_id}%",)).fetchall()
+        return self._record(rows[0]) if len(rows) == 1 else None
+
+    def recent(self, limit: int = 20, status: JobStatus | None = None) -> list[JobRecord]:
+        """Последние задания, новые первыми."""
+        query = "SELECT * FROM runs" + (" WHERE status = ?" if status else "") + " ORDER BY created DESC LIMIT ?"
+        with self._tx(write=False) as db:
+            rows = db.execute(query, (status, limit) if status else (limit,)).fetchall()
+        return [self._record(row) for row in rows]
+
+    def events(self, run_id: str, after: int = 0) -> list[JobEvent]:
+        """События задания с номером больше `after`."""
+        with self._tx(write=False) as db:
+            rows = db.execute(
+                "SELECT * FROM events WHERE run_id = ? AND seq > ? ORDER BY seq", (run_id, after),
+            ).fetchall()
+        return [
+            JobEvent(run_id=row["run_id"], seq=row["seq"], ts=row["ts"], event=row["event"], data=json.loads(row["data"]))
+            for row in rows
+        ]
+
+
+def run_job(
+    client: httpx.Client, spec: JobSpec, on_event: OnEvent | None = None, timeout: float | None = None,
+) -> BestOfNResult | MultiBridgeResult:
+    """
+    Выполняет мост задания; `on_event` получает события моста, `timeout` — лимит на каждый
+    HTTP-вызов моста (по умолчанию `JOB_HTTP_TIMEOUT`).
+    """
+    timeout = JOB_HTTP_TIMEOUT if timeout is None else timeout
+    if spec.kind == "multi":
+        return bridge_multi(
+            client=client,
+            task=spec.task,
+            plan_urls=spec.plan_urls,
+            builder_urls=spec.builder_urls,
+            review_urls=spec.review_urls,
+            tester_url=spec.tester_url,
+            specialists_per_component=spec.specialists,
+            timeout=timeout,
+            selection=spec.selection,
+            candidates=spec.candidates,
+            specialist_mode=spec.specialist_mode,
+            test_select=spec.test_select,
+            on_event=on_event,
+        )
+    return bridge_best_of_n(
+        client, spec.task, spec.builder_urls, spec.tester_url, timeout=timeout, selection=spec.selection,
+        candidates=spec.candidates, on_event=on_event,
+    )
+
+
+def _event_data(event: BridgeEvent) -> dict:
+    """Данные события моста для базы: от результатов тестов остаются только счётчики, без вывода и исходов."""
+    data = dict(event.data)
+    if isinstance(data.get("result"), dict):
+        data["result"] = {k: v for k, v in data["result"].items() if k not in ("stdout", "stderr", "tests", "timings")}
+    return data
+
+
+def dump_result(result: Any) -> dict:
+    """Результат моста (dataclass с pydantic-моделями внутри) в JSON-совместимый словарь."""
+    return TypeAdapter(type(result)).dump_python(result, mode="json")
+
+
+class JobWorker:
+    """
+    Выполняет задания из `JobStore` не более чем по `workers` одновременно.
+    Пока задания идут, воркер обновляет их heartbeat каждые `poll` секунд.
+    """
+
+    def __init__(self, store: JobStore, workers: int = JOB_WORKERS, poll: float = 1.0) -> None:
+        self.store = store
+        self.workers = max(1, workers)
+        self.poll = poll
+        self.name = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        """Просит `run` не брать новые задания и вернуться после текущих."""
+        self._stop.set()
+
+    def _execute(self, record: JobRecord) -> None:
+        def _progress(event: BridgeEvent) -> None:
+            self.store.add_event(record.id, event.event, _event_data(event))
+
+        try:
+            with httpx.Client() as client:
+                result = run_job(client, record.spec, _progress)
+        except Exception:
+            self.store.fail(record.id, traceback.format_exc())
+        else:
+            self.store.finish(record.id, dump_result(result))
+
+    def run(self, until_idle: bool = False) -> int:
+        """
+        Цикл воркера до `stop()` (или до пустой очереди при `until_idle`).
+        Возвращает число выполненных заданий.
+        """
+        running: dict[Future, str] = {}
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="aw-job") as pool:
+            while True:
+                for fut in [f for f in running if f.done()]:
+                    running.pop(fut)
+                    done += 1
+                claimed = False
+                while not self._stop.is_set() and len(running) < self.workers:
+                    record = self.store.claim(self.name)
+                    if record is None:
+                        break
+                    claimed = True
+                    running[pool.submit(self._execute, record)] = record.id
+                if not running and (self._stop.is_set() or (until_idle and not claimed)):
+                    return done
+                self.store.heartbeat(list(running.values()))
+                if running:
+                    wait(running, timeout=self.poll, return_when=FIRST_COMPLETED)
+                elif not claimed:
+                    self._stop.wait(self.poll)
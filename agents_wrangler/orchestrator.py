@@ -1,12 +1,51 @@
 from __future__ import annotations
 
+import asyncio
+import contextvars
 import dataclasses
+import functools
+import gzip
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from dataclasses import dataclass
-from typing import Iterable
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Iterator, Literal, TypeVar
 
 import httpx
 from pydantic import BaseModel
 
+from agents_wrangler.builder_pool import BuilderPool, RequestStats, current_request_stats, request_stats
+from agents_wrangler.diff_store import DIFF_STORE_HEADER, diff_ref
+from agents_wrangler.diffs import diff_fingerprint
+from agents_wrangler.telemetry import current_trace_id, stage, trace, trace_headers
+
+T = TypeVar("T")
+
+
+Selection = Literal["best", "first_green"]
+"""Режим выбора победителя best-of-N: дождаться всех кандидатов или первого полностью зелёного."""
+
+SpecialistMode = Literal["incremental", "speculative"]
+"""Как добавлять специалистов: по одному с тестом после каждого или все параллельно с проверкой стека."""
+
+TestSelect = Literal["all", "impacted"]
+"""Какие тесты запускать в пробах специалистов: весь набор или только затронутые патчем."""
+
+# Хеджирование запросов к билдерам: если билдер не ответил за этот квантиль недавних
+# задержек пула, тот же запрос дублируется на свободный билдер и берётся первый ответ.
+# Пока у пула меньше HEDGE_MIN_SAMPLES замеров, хеджей нет; HEDGE_QUANTILE=0 их отключает.
+HEDGE_QUANTILE = float(os.environ.get("AW_HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("AW_HEDGE_MIN_SAMPLES", "8"))
+# Повторы запросов к билдерам на 5xx/429 на весь мост (вложенный мост делит бюджет с внешним)
+RETRY_BUDGET = int(os.environ.get("AW_RETRY_BUDGET", "4"))
+# Пауза перед k-м повтором — случайная в [0, RETRY_BACKOFF * 2**k] секунд
+RETRY_BACKOFF = float(os.environ.get("AW_RETRY_BACKOFF", "0.5"))
+
 
 class Plan(BaseModel):
     """JSON-план архитектора Codex."""
@@ -26,132 +65,1465 @@ class PatchResponse(BaseModel):
     stderr: str
 
 
+class TestOutcome(BaseModel):
+    """Исход одного теста по данным tester-service."""
+    nodeid: str
+    outcome: str
+    duration: float = 0.0
+
+
+class TestSelection(BaseModel):
+    """Какие тесты запускал tester-service: режим, выбранные файлы и сколько тестов пропущено."""
+    mode: str = "all"
+    reason: str = ""
+    test_files: list[str] = []
+    tests_skipped: int = 0
+
+
 class TestRunResult(BaseModel):
-    """Результат тестов tester-service."""
+    """Результат тестов tester-service (старые тестеры не присылают errors/skipped, исходы тестов и выбор)."""
     tests_total: int
     tests_passed: int
     tests_failed: int
     return_code: int
     stdout: str
     stderr: str
+    cached: bool = False
+    tests_errors: int = 0
+    tests_skipped: int = 0
+    tests_xfailed: int = 0
+    tests: list[TestOutcome] = []
+    timings: dict[str, float] = {}
+    selection: TestSelection | None = None
+
+    @property
+    def failures(self) -> int:
+        """Упавшие тесты вместе с ошибками setup/teardown и сбора."""
+        return self.tests_failed + self.tests_errors
 
 
 @dataclass
 class BestOfNResult:
-    """Результат best-of-N: кандидаты, их метрики и победитель."""
+    """
+    Результат best-of-N: кандидаты, их метрики и победитель.
+    `duplicate_groups` — индексы кандидатов с эквивалентными диффами (группы от двух штук);
+    каждая группа тестировалась один раз.
+    `candidate_timings` — секунды по этапам для каждого кандидата: implement, test и
+    этапы tester-service (workspace, apply, pytest); дубликаты получают тайминги прогона группы.
+    `request_stats` — запросы к билдерам за мост: retries, retries_denied, hedges, hedge_wins
+    и wasted_seconds (время проигравших хеджей до выбора ответа).
+    """
     candidate_diffs: list[str]
     candidate_tests: list[TestRunResult]
     winner_index: int
+    cancelled: int = 0
+    duplicate_groups: list[list[int]] = dataclasses.field(default_factory=list)
+    candidate_timings: list[dict[str, float]] = dataclasses.field(default_factory=list)
+    request_stats: dict[str, float] = dataclasses.field(default_factory=dict)
+    trace_id: str = ""
 
 
 @dataclass
 class MultiBridgeResult:
-    """Результат мультиагентного конвейера."""
+    """
+    Результат мультиагентного конвейера. `timings` — секунды по этапам моста (plan, base,
+    baseline_test, specialists, final_test, review), `specialist_timings` — по этапам каждого специалиста.
+    `request_stats` — счётчики запросов к билдерам за весь конвейер (см. `BestOfNResult`).
+    """
     plan: Plan
     base: BestOfNResult
     accepted_diffs: list[str]
     final_tests: TestRunResult
     review: Review
+    timings: dict[str, float] = dataclasses.field(default_factory=dict)
+    specialist_timings: list[dict[str, float]] = dataclasses.field(default_factory=list)
+    request_stats: dict[str, float] = dataclasses.field(default_factory=dict)
+    trace_id: str = ""
+
+
+@dataclass
+class BridgeEvent:
+    """
+    Событие хода моста для `on_event`; `data` — JSON-совместимые подробности, индексы —
+    номера запуска кандидатов и специалистов.
+    best-of-N: candidate_started, diff_received, candidate_tested, winner;
+    мультимост: plan, baseline_tested, specialist_started, specialist_tested,
+    specialist_accepted, final_tested, review. `done` — последнее событие
+    `iter_bridge_events`/`astream_bridge`, с результатом моста в `result`.
+    """
+    event: str
+    data: dict[str, Any] = dataclasses.field(default_factory=dict)
+    trace_id: str = ""
+    result: Any = None
+
+
+OnEvent = Callable[[BridgeEvent], None]
+"""Получатель событий моста; sync-мосты вызывают его и из своих потоков."""
+
+
+def _emitter(on_event: OnEvent | None) -> Callable[..., None]:
+    """`emit(event, **data)`, передающая событие с текущим trace ID в `on_event` (без него — ничего)."""
+    if on_event is None:
+        return lambda event, **data: None
+    return lambda event, **data: on_event(BridgeEvent(event, data, current_trace_id() or ""))
+
+
+def _winner_event(emit: Callable[..., None], results: list[TestRunResult | None], res: BestOfNResult) -> None:
+    """Событие `winner` с номером запуска победителя (в результате кандидаты без прогона выброшены)."""
+    tested = [i for i, tr in enumerate(results) if tr is not None]
+    if tested:
+        emit("winner", index=tested[res.winner_index], failures=res.candidate_tests[res.winner_index].failures)
+
+
+def _traced(fn: Callable[..., T]) -> Callable[..., T]:
+    """
+    Выполняет мост под trace ID и счётчиками запросов (новыми или уже действующими
+    у внешнего моста) и записывает их в `trace_id` и `request_stats` результата.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        with trace() as trace_id, request_stats(RETRY_BUDGET) as stats:
+            return dataclasses.replace(fn(*args, **kwargs), trace_id=trace_id, request_stats=stats.snapshot())
+    return wrapper
+
+
+def _submit(pool: ThreadPoolExecutor, fn: Callable[..., T], *args: Any) -> Future[T]:
+    """`pool.submit` с копией текущего контекста: trace ID доходит до запросов из потоков."""
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _map(pool: ThreadPoolExecutor, fn: Callable[[Any], T], items: Iterable[Any]) -> list[T]:
+    """Параллельный `map` через `_submit`; результаты в порядке `items`."""
+    return [f.result() for f in [_submit(pool, fn, item) for item in items]]
+
+
+def _timed(fn: Callable[..., T], *args: Any) -> tuple[T, float]:
+    """Вызывает `fn` и возвращает результат вместе с длительностью вызова в секундах."""
+    started = time.monotonic()
+    return fn(*args), time.monotonic() - started
 
 
-def _post_json(client: httpx.Client, url: str, payload: dict) -> dict:
+def _post_json(client: httpx.Client, url: str, payload: dict, timeout: float = 60.0) -> dict:
     """Выполняет POST JSON и возвращает JSON-ответ как словарь."""
-    r = client.post(url, json=payload, timeout=60.0)
+    r = client.post(url, json=payload, timeout=timeout, headers=trace_headers())
+    _note_diff_store(r)
+    r.raise_for_status()
+    return r.json()
+
+
+# --- ссылки на диффы --------------------------------------------------------
+#
+# Сервисы с хранилищем диффов (см. agents_wrangler.diff_store) помечают ответы
+# заголовком `X-AW-Diff-Store`. Для них вместо текстов стека отправляются SHA-256:
+# каждый дифф загружается через `PUT /diffs` один раз, а на 409 недостающие
+# догружаются и запрос повторяется. Остальным сервисам уходят тексты, как раньше.
+
+# Origin сервиса с хранилищем → ссылки на диффы, которые у него уже есть
+_DIFF_STORES: dict[str, set[str]] = {}
+# Тела `PUT /diffs` от этого размера сжимаются gzip
+GZIP_MIN_BYTES = 16 * 1024
+
+
+def _origin(url: str) -> str:
+    u = httpx.URL(url)
+    return f"{u.scheme}://{u.netloc.decode()}"
+
+
+def _note_diff_store(r: httpx.Response) -> None:
+    """Запоминает сервис, ответивший заголовком хранилища диффов."""
+    if DIFF_STORE_HEADER in r.headers:
+        _DIFF_STORES.setdefault(_origin(str(r.request.url)), set())
+
+
+def _remember_diffs(url: str, diffs: Iterable[str]) -> None:
+    """Отмечает диффы, которые сервис уже сохранил (получил текстом или сам сгенерировал)."""
+    known = _DIFF_STORES.get(_origin(url))
+    if known is not None:
+        known.update(diff_ref(d) for d in diffs)
+
+
+def _diff_texts(value: list) -> dict[str, str]:
+    """Ссылка → текст для списка диффов или списка стеков."""
+    flat = [d for item in value for d in ([item] if isinstance(item, str) else item)]
+    return {diff_ref(d): d for d in flat}
+
+
+def _as_refs(value: list) -> list:
+    return [diff_ref(item) if isinstance(item, str) else _as_refs(item) for item in value]
+
+
+def _upload(diffs: list[str]) -> tuple[bytes, dict[str, str]]:
+    """Тело и заголовки `PUT /diffs`; крупные тела сжимаются gzip."""
+    body = json.dumps({"diffs": diffs}).encode()
+    headers = {"Content-Type": "application/json", **trace_headers()}
+    if len(body) >= GZIP_MIN_BYTES:
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
+
+
+def _stored(origin: str, r: httpx.Response) -> None:
+    """Разбирает ответ `PUT /diffs` и отмечает загруженные диффы как известные сервису."""
+    r.raise_for_status()
+    _DIFF_STORES.setdefault(origin, set()).update(r.json()["refs"])
+
+
+@dataclass
+class _RefPost:
+    """
+    Запрос с диффами к сервису с хранилищем: тело со ссылками вместо текстов и решения,
+    какие тексты загрузить до запроса и какие догрузить после ответа 409.
+    """
+    origin: str
+    known: set[str]
+    texts: dict[str, str]
+    body: dict
+
+    def upload(self) -> list[str]:
+        """Диффы, которых у сервиса ещё нет."""
+        return [d for ref, d in self.texts.items() if ref not in self.known]
+
+    def reupload(self, r: httpx.Response) -> list[str] | None:
+        """
+        Диффы для повторной загрузки после ответа `r` или None, если повтор не нужен.
+        На 409 сервис вытеснил или потерял часть диффов (например, после рестарта).
+        """
+        if r.status_code != 409:
+            return None
+        missing = r.json().get("missing", [])
+        self.known.difference_update(missing)
+        return [self.texts[ref] for ref in missing if ref in self.texts]
+
+
+def _ref_post(url: str, payload: dict, key: str, ref_key: str) -> _RefPost | None:
+    """
+    Запрос со ссылками `ref_key` вместо текстов `payload[key]` или None, если у сервиса нет
+    хранилища: тогда тексты уходят как есть и запоминаются через `_remember_diffs`.
+    """
+    origin = _origin(url)
+    known = _DIFF_STORES.get(origin)
+    if known is None:
+        return None
+    body = {**{k: v for k, v in payload.items() if k != key}, ref_key: _as_refs(payload[key])}
+    return _RefPost(origin, known, _diff_texts(payload[key]), body)
+
+
+def _put_diffs(client: httpx.Client, origin: str, diffs: list[str], timeout: float) -> None:
+    """Загружает диффы в хранилище сервиса."""
+    if not diffs:
+        return
+    body, headers = _upload(diffs)
+    _stored(origin, client.put(f"{origin}/diffs", content=body, headers=headers, timeout=timeout))
+
+
+def _post_diffs(
+    client: httpx.Client, url: str, payload: dict, key: str, ref_key: str, timeout: float = 60.0,
+) -> dict:
+    """
+    POST запроса с диффами в `payload[key]`: сервису с хранилищем уходят ссылки `ref_key`
+    (неизвестные ему диффы загружаются заранее, 409 обрабатывается одной догрузкой),
+    остальным — тексты.
+    """
+    post = _ref_post(url, payload, key, ref_key)
+    if post is None:
+        data = _post_json(client, url, payload, timeout)
+        _remember_diffs(url, _diff_texts(payload[key]).values())
+        return data
+    _put_diffs(client, post.origin, post.upload(), timeout)
+    r = client.post(url, json=post.body, timeout=timeout, headers=trace_headers())
+    missing = post.reupload(r)
+    if missing is not None:
+        _put_diffs(client, post.origin, missing, timeout)
+        r = client.post(url, json=post.body, timeout=timeout, headers=trace_headers())
     r.raise_for_status()
     return r.json()
 
 
-def codex_plan(client: httpx.Client, codex_url: str, task: str) -> Plan:
+def codex_plan(client: httpx.Client, codex_url: str, task: str, timeout: float = 60.0) -> Plan:
     """Вызывает архитектора Codex и возвращает план работ."""
-    data = _post_json(client, f"{codex_url.rstrip('/')}/codex/plan", {"task": task})
+    data = _post_json(client, f"{codex_url.rstrip('/')}/codex/plan", {"task": task}, timeout)
     return Plan.model_validate(data)
 
 
-def codex_implement(client: httpx.Client, codex_url: str, task: str) -> PatchResponse:
+def codex_implement(client: httpx.Client, codex_url: str, task: str, timeout: float = 60.0) -> PatchResponse:
     """Просит билдера Codex сгенерировать unified diff под задачу."""
-    data = _post_json(client, f"{codex_url.rstrip('/')}/codex/implement", {"task": task})
-    return PatchResponse.model_validate(data)
+    url = f"{codex_url.rstrip('/')}/codex/implement"
+    patch = PatchResponse.model_validate(_post_json(client, url, {"task": task}, timeout))
+    _remember_diffs(url, [patch.diff])
+    return patch
 
 
-def codex_review(client: httpx.Client, codex_url: str, task: str, diffs: list[str]) -> Review:
+def _as_pool(builders: list[str] | BuilderPool) -> BuilderPool:
+    """Список URL превращается в новый пул; готовый пул передаётся как есть и сохраняет статистику."""
+    return builders if isinstance(builders, BuilderPool) else BuilderPool(builders)
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    """Повторять имеет смысл перегрузку и сбои билдера (5xx, 429), но не отказ модели."""
+    return isinstance(exc, httpx.HTTPStatusError) and (
+        exc.response.status_code >= 500 or exc.response.status_code == 429
+    )
+
+
+def _backoff(attempt: int) -> float:
+    """Пауза перед повтором `attempt` (с нуля): full jitter поверх экспоненты."""
+    return random.uniform(0, RETRY_BACKOFF * 2 ** attempt)
+
+
+def _stats() -> RequestStats:
+    """Счётчики текущего моста; вне моста — одноразовые, с собственным бюджетом на вызов."""
+    return current_request_stats() or RequestStats(RETRY_BUDGET)
+
+
+def _hedge_delay(pool: BuilderPool) -> float | None:
+    """Сколько ждать ответа билдера перед хеджем; None — не хеджировать."""
+    if HEDGE_QUANTILE <= 0 or len(pool) < 2:
+        return None
+    return pool.latency_quantile(HEDGE_QUANTILE, HEDGE_MIN_SAMPLES)
+
+
+def _retry_delay(exc: httpx.HTTPStatusError, attempt: int, stats: RequestStats) -> float | None:
+    """Пауза перед повтором `attempt` или None, если ошибка не повторяемая либо бюджет моста исчерпан."""
+    if not _is_retryable(exc) or not stats.spend_retry():
+        return None
+    return _backoff(attempt)
+
+
+def _hedge_winner(
+    done: Iterable[Any],
+    pending: Iterable[Any],
+    started: dict[Any, float],
+    hedge: Any,
+    stats: RequestStats,
+    error: BaseException | None,
+) -> tuple[PatchResponse | None, BaseException | None]:
+    """
+    Разбирает завершившиеся запросы хеджа (sync- или asyncio-futures): первый успешный ответ
+    или None и первая ошибка. Победа хеджа и время, потраченное ещё идущими запросами
+    `pending`, учитываются в `stats`.
+    """
+    for fut in done:
+        error = error or fut.exception()
+        if fut.exception() is not None or fut.result() is None:
+            continue
+        if fut is hedge:
+            stats.add("hedge_wins")
+        now = time.monotonic()
+        for other in pending:
+            stats.add("wasted_seconds", now - started[other])
+        return fut.result(), error
+    return None, error
+
+
+def _implement_once(pool: BuilderPool, client: httpx.Client, task: str, timeout: float) -> PatchResponse:
+    with pool.lease() as url:
+        return codex_implement(client, url, task, timeout)
+
+
+def _implement_idle(
+    pool: BuilderPool, client: httpx.Client, task: str, timeout: float, stats: RequestStats,
+) -> PatchResponse | None:
+    """Хедж: тот же запрос на свободный билдер; None, если свободных нет."""
+    with pool.lease_idle() as url:
+        if url is None:
+            return None
+        stats.add("hedges")
+        return codex_implement(client, url, task, timeout)
+
+
+def _hedged_implement(
+    pool: BuilderPool, client: httpx.Client, task: str, timeout: float, stats: RequestStats,
+) -> PatchResponse:
+    """
+    `codex_implement` с хеджированием: если ответа нет дольше `_hedge_delay`, тот же запрос
+    уходит на свободный билдер и берётся первый успешный ответ. Проигравший sync-запрос
+    дорабатывает в фоне; его время до выбора ответа учитывается как `wasted_seconds`.
+    """
+    delay = _hedge_delay(pool)
+    if delay is None:
+        return _implement_once(pool, client, task, timeout)
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="aw-hedge")
+    try:
+        started = {_submit(executor, _implement_once, pool, client, task, timeout): time.monotonic()}
+        done, _ = wait(started, timeout=delay)
+        if done:
+            return next(iter(done)).result()
+        hedge = _submit(executor, _implement_idle, pool, client, task, timeout, stats)
+        started[hedge] = time.monotonic()
+        pending = set(started)
+        error: BaseException | None = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            patch, error = _hedge_winner(done, pending, started, hedge, stats, error)
+            if patch is not None:
+                return patch
+        assert error is not None
+        raise error
+    finally:
+        executor.shutdown(wait=False)
+
+
+def _implement_on(pool: BuilderPool, client: httpx.Client, task: str, timeout: float = 60.0) -> PatchResponse:
+    """
+    `codex_implement` на билдере, выбранном пулом по текущей нагрузке, с хеджированием
+    медленных ответов и повторами на 5xx/429 в пределах бюджета моста (пауза с jitter).
+    """
+    stats = _stats()
+    attempt = 0
+    while True:
+        try:
+            return _hedged_implement(pool, client, task, timeout, stats)
+        except httpx.HTTPStatusError as exc:
+            delay = _retry_delay(exc, attempt, stats)
+            if delay is None:
+                raise
+        time.sleep(delay)
+        attempt += 1
+
+
+def codex_review(
+    client: httpx.Client, codex_url: str, task: str, diffs: list[str], timeout: float = 60.0,
+) -> Review:
     """Просит ревью Codex оценить набор диффов."""
-    data = _post_json(client, f"{codex_url.rstrip('/')}/codex/review", {"task": task, "diffs": diffs})
+    url = f"{codex_url.rstrip('/')}/codex/review"
+    data = _post_diffs(client, url, {"task": task, "diffs": diffs}, "diffs", "diff_refs", timeout)
     return Review.model_validate(data)
 
 
-def tester_run(client: httpx.Client, tester_url: str, diffs: list[str]) -> TestRunResult:
+def _testrun_payload(key: str, value: list, select: TestSelect) -> dict:
+    """Тело запроса к tester-service; `select` передаётся, только если он не по умолчанию."""
+    return {key: value, "select": select} if select != "all" else {key: value}
+
+
+def tester_run(
+    client: httpx.Client, tester_url: str, diffs: list[str], timeout: float = 60.0, select: TestSelect = "all",
+) -> TestRunResult:
     """Запускает pytest над копией демо-проекта, последовательно применяя диффы."""
-    data = _post_json(client, f"{tester_url.rstrip('/')}/testrun", {"diffs": diffs})
+    payload = _testrun_payload("diffs", diffs, select)
+    data = _post_diffs(client, f"{tester_url.rstrip('/')}/testrun", payload, "diffs", "diff_refs", timeout)
     return TestRunResult.model_validate(data)
 
 
+# Тестеры, ответившие 404/405 на /testrun/batch: для них сразу используется /testrun
+_BATCH_UNSUPPORTED: set[str] = set()
+
+
+def _batch_results(data: dict) -> list[TestRunResult]:
+    """Разбирает ответ /testrun/batch; ошибка любого стека превращается в исключение."""
+    out: list[TestRunResult] = []
+    for item in sorted(data["results"], key=lambda it: it["index"]):
+        if item.get("error"):
+            raise RuntimeError(f"tester failed on stack #{item['index']}: {item['error']}")
+        out.append(TestRunResult.model_validate(item["result"]))
+    return out
+
+
+def tester_run_batch(
+    client: httpx.Client,
+    tester_url: str,
+    stacks: list[list[str]],
+    timeout: float = 60.0,
+    select: TestSelect = "all",
+) -> list[TestRunResult] | None:
+    """
+    Тестирует несколько независимых стеков диффов одним запросом к /testrun/batch.
+    Возвращает результаты в порядке `stacks` или None, если пакетный запрос не удался
+    (любой ответ не 2xx или сетевая ошибка) — тогда стеки тестируются по одному через /testrun.
+    Tester, ответивший 404/405, запоминается как не поддерживающий пакеты.
+    """
+    base = tester_url.rstrip("/")
+    if base in _BATCH_UNSUPPORTED:
+        return None
+    try:
+        payload = _testrun_payload("stacks", stacks, select)
+        data = _post_diffs(client, f"{base}/testrun/batch", payload, "stacks", "stack_refs", timeout)
+    except (httpx.HTTPStatusError, httpx.TransportError) as exc:
+        if isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code in (404, 405):
+            _BATCH_UNSUPPORTED.add(base)
+        return None
+    return _batch_results(data)
+
+
+def _is_better(tr: TestRunResult, best: TestRunResult | None) -> bool:
+    """Правило выбора: минимальные failures (включая errors), при равенстве — максимальные passed."""
+    return best is None or tr.failures < best.failures or (
+        tr.failures == best.failures and tr.tests_passed > best.tests_passed
+    )
+
+
+def _is_full_pass(tr: TestRunResult) -> bool:
+    """Кандидат без падений и со всеми пройденными тестами обыграть уже нельзя."""
+    return tr.failures == 0 and tr.tests_total > 0 and tr.tests_passed == tr.tests_total
+
+
+def _select_winner(results: list[TestRunResult]) -> int:
+    """Возвращает индекс лучшего результата; при равенстве побеждает меньший индекс."""
+    winner_idx = 0
+    best: TestRunResult | None = None
+    for i, tr in enumerate(results):
+        if _is_better(tr, best):
+            best = tr
+            winner_idx = i
+    return winner_idx
+
+
+def _best_of_n_result(
+    diffs: list[str],
+    results: list[TestRunResult | None],
+    groups: dict[str, list[int]],
+    timings: list[dict[str, float]],
+) -> BestOfNResult:
+    """Собирает итог best-of-N из протестированных кандидатов, перенумеровав группы дубликатов."""
+    tested = [i for i in range(len(diffs)) if results[i] is not None]
+    pos = {i: k for k, i in enumerate(tested)}
+    dups = [sorted(pos[i] for i in members if i in pos) for members in groups.values()]
+    tests = [results[i] for i in tested]
+    return BestOfNResult(
+        candidate_diffs=[diffs[i] for i in tested],
+        candidate_tests=tests,
+        winner_index=_select_winner(tests),
+        cancelled=len(diffs) - len(tested),
+        duplicate_groups=sorted(g for g in dups if len(g) > 1),
+        candidate_timings=[{**timings[i], **tests[k].timings} for k, i in enumerate(tested)],
+    )
+
+
+def _unique_stacks(diffs: list[str], groups: dict[str, list[int]]) -> list[int]:
+    """Группирует кандидатов по отпечатку диффа; возвращает представителей групп по порядку."""
+    for i, diff in enumerate(diffs):
+        groups.setdefault(diff_fingerprint(diff), []).append(i)
+    return [members[0] for members in groups.values()]
+
+
+@_traced
 def bridge_best_of_n(
     client: httpx.Client,
     task: str,
-    builder_urls: list[str],
+    builder_urls: list[str] | BuilderPool,
     tester_url: str,
+    max_concurrency: int | None = None,
+    timeout: float = 60.0,
+    selection: Selection = "best",
+    batch_tests: bool = True,
+    candidates: int | None = None,
+    on_event: OnEvent | None = None,
 ) -> BestOfNResult:
     """
     Параллельно запрашивает билдеров Codex, тестирует каждый diff и выбирает лучший по метрикам.
     Правило выбора: минимальные failures, при равенстве — максимальные passed.
+
+    Запросы к билдерам уходят одновременно (не более `max_concurrency`, по умолчанию — все),
+    а каждый diff отправляется в tester сразу по готовности, так что тесты идут
+    параллельно с генерацией. `max_concurrency=1` воспроизводит последовательный режим.
+
+    В режиме `selection="first_green"` мост возвращается, как только кандидат прошёл все
+    тесты: остальные вызовы снимаются с очереди, а уже отправленные sync-запросы
+    дорабатывают в фоне без ожидания (настоящую отмену даёт `abridge_best_of_n`).
+
+    При `batch_tests` (по умолчанию) в режиме "best" все диффы отправляются в tester одним
+    запросом /testrun/batch; если tester его не поддерживает — по одному через /testrun.
+    Эквивалентные диффы (см. `diff_fingerprint`) тестируются один раз, результат
+    копируется дубликатам.
+
+    `builder_urls` — список URL или `BuilderPool`; билдер для каждого из `candidates`
+    (по умолчанию — по числу URL) выбирается пулом в момент отправки запроса.
+    `timeout` — лимит на каждый HTTP-вызов моста, секунды.
+
+    `on_event` получает `BridgeEvent` по ходу моста: кандидат запущен, дифф получен,
+    кандидат протестирован, выбран победитель.
     """
-    diffs: list[str] = []
-    for i, url in enumerate(builder_urls):
-        resp = codex_implement(client, url, task)
-        diffs.append(resp.diff)
+    builders = _as_pool(builder_urls)
+    emit = _emitter(on_event)
+    n = candidates or len(builders)
+    workers = max(1, min(max_concurrency or n, n))
+    diffs: list[str] = [""] * n
+    results: list[TestRunResult | None] = [None] * n
+    timings: list[dict[str, float]] = [{} for _ in range(n)]
+    groups: dict[str, list[int]] = {}
+    early_exit = False
+    use_batch = batch_tests and selection == "best" and tester_url.rstrip("/") not in _BATCH_UNSUPPORTED
+
+    def _build(i: int) -> PatchResponse:
+        emit("candidate_started", index=i)
+        return _implement_on(builders, client, task, timeout)
+
+    def _tested(i: int, tr: TestRunResult, elapsed: float) -> None:
+        results[i] = tr
+        timings[i]["test"] = elapsed
+        emit("candidate_tested", index=i, result=tr.model_dump())
+
+    build_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="aw-build")
+    test_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="aw-test")
+    pending: dict[Future, tuple[str, int]] = {
+        _submit(build_pool, _timed, _build, i): ("build", i) for i in range(n)
+    }
+    try:
+        while pending and not early_exit:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                kind, i = pending.pop(fut)
+                if kind == "build":
+                    patch, timings[i]["implement"] = fut.result()
+                    diffs[i] = patch.diff
+                    emit("diff_received", index=i, diff=patch.diff, seconds=timings[i]["implement"])
+                    if use_batch:
+                        continue
+                    members = groups.setdefault(diff_fingerprint(diffs[i]), [])
+                    members.append(i)
+                    if len(members) == 1:
+                        pending[_submit(test_pool, _timed, tester_run, client, tester_url, [diffs[i]], timeout)] = ("test", i)
+                    elif results[members[0]] is not None:
+                        _tested(i, results[members[0]], timings[members[0]]["test"])
+                else:
+                    tr, elapsed = fut.result()
+                    for j in groups[diff_fingerprint(diffs[i])]:
+                        _tested(j, tr, elapsed)
+                    early_exit = early_exit or (selection == "first_green" and _is_full_pass(results[i]))
+        if use_batch:
+            reps = _unique_stacks(diffs, groups)
+            stacks = [[diffs[i]] for i in reps]
+            started = time.monotonic()
+            batch = tester_run_batch(client, tester_url, stacks, timeout)
+            unique = batch if batch is not None else _map(
+                test_pool, lambda st: tester_run(client, tester_url, st, timeout), stacks,
+            )
+            elapsed = time.monotonic() - started
+            for members, tr in zip(groups.values(), unique):
+                for j in members:
+                    _tested(j, tr, elapsed)
+    finally:
+        # Ещё не стартовавшие вызовы не нужны: мост либо упал, либо уже выбрал победителя
+        for fut in pending:
+            fut.cancel()
+        build_pool.shutdown(wait=not (early_exit or pending), cancel_futures=True)
+        test_pool.shutdown(wait=not (early_exit or pending), cancel_futures=True)
+
+    res = _best_of_n_result(diffs, results, groups, timings)
+    _winner_event(emit, results, res)
+    return res
+
+
+def _specialist_prompt(comp: dict) -> str:
+    """Формирует задание специалисту по компоненту плана."""
+    return (
+        f"Implement specialized improvements for component '{comp.get('name','?')}', "
+        f"focus files: {', '.join(comp.get('target_files', [])) or 'any'}."
+    )
+
+
+def _not_worse(tr: TestRunResult, current: TestRunResult) -> bool:
+    """Дифф специалиста принимается, если метрики не ухудшаются относительно текущих."""
+    return tr.failures < current.failures or (
+        tr.failures == current.failures and tr.tests_passed >= current.tests_passed
+    )
 
-    results: list[TestRunResult] = []
-    winner_idx = 0
-    best: TestRunResult | None = None
-    for i, d in enumerate(diffs):
-        tr = tester_run(client, tester_url, [d])
-        results.append(tr)
-        better = best is None or tr.tests_failed < best.tests_failed or (
-            tr.tests_failed == best.tests_failed and tr.tests_passed > best.tests_passed
-        )
-        if better:
-            best = tr
-            winner_idx = i
 
-    return BestOfNResult(candidate_diffs=diffs, candidate_tests=results, winner_index=winner_idx)
+def _rejected(exc: Exception) -> bool:
+    """Tester не смог применить стек (конфликт патчей) — это отказ кандидату, а не сбой моста."""
+    return isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code == 400
 
 
+def _distinct(patches: list[str], accepted: list[str]) -> list[str]:
+    """Оставляет по одному патчу на отпечаток, отбрасывая эквивалентные уже принятым."""
+    seen = {diff_fingerprint(d) for d in accepted}
+    out: list[str] = []
+    for patch in patches:
+        fp = diff_fingerprint(patch)
+        if fp not in seen:
+            seen.add(fp)
+            out.append(patch)
+    return out
+
+
+def _rank_trials(trials: list[TestRunResult | None], current: TestRunResult) -> list[int]:
+    """Индексы не ухудшающих метрики проб, от лучшей к худшей (при равенстве — в исходном порядке)."""
+    ok = [i for i, tr in enumerate(trials) if tr is not None and _not_worse(tr, current)]
+    return sorted(ok, key=lambda i: (trials[i].failures, -trials[i].tests_passed, i))
+
+
+def _record_trials(
+    timings: list[dict[str, float]],
+    raw: list[str],
+    patches: list[str],
+    trials: list[TestRunResult | None],
+    elapsed: list[float],
+) -> None:
+    """Дописывает время пробы каждого патча (и этапы tester-service) специалисту, который его сгенерировал."""
+    for patch, tr, secs in zip(patches, trials, elapsed):
+        t = timings[raw.index(patch)]
+        t["test"] = secs
+        if tr is not None:
+            t.update(tr.timings)
+
+
+def _trial_events(
+    emit: Callable[..., None], raw: list[str], patches: list[str], trials: list[TestRunResult | None],
+) -> None:
+    """События `specialist_tested` по пробам; `result=None` — патч не применился поверх принятых."""
+    for patch, tr in zip(patches, trials):
+        emit("specialist_tested", index=raw.index(patch), diff=patch, result=tr.model_dump() if tr is not None else None)
+
+
+def _prior(current: TestRunResult, test_select: TestSelect) -> TestRunResult | None:
+    """Результат принятого стека, от которого считаются выборочные пробы, или None для полных прогонов."""
+    return current if test_select == "impacted" else None
+
+
+def _select_for(prior: TestRunResult | None) -> TestSelect:
+    """Выборочный прогон возможен, только если известны исходы тестов стека без пробного патча."""
+    return "impacted" if prior is not None and prior.tests else "all"
+
+
+def _merge_impacted(tr: TestRunResult, prior: TestRunResult) -> TestRunResult:
+    """
+    Достраивает выборочный прогон до полного: тесты файлов, которые tester не запускал,
+    сохраняют исход из `prior` — результата того же стека без последнего диффа.
+    """
+    if tr.selection is None or tr.selection.mode != "impacted":
+        return tr
+    files = set(tr.selection.test_files)
+    tests = [t for t in prior.tests if t.nodeid.split("::", 1)[0] not in files] + tr.tests
+    counts = Counter(t.outcome for t in tests)
+    passed = counts["passed"] + counts["xpassed"]
+    failures = counts["failed"] + counts["error"]
+    return tr.model_copy(update={
+        "tests": tests,
+        "tests_total": passed + failures,
+        "tests_passed": passed,
+        "tests_failed": counts["failed"],
+        "tests_errors": counts["error"],
+        "tests_skipped": counts["skipped"],
+        "tests_xfailed": counts["xfailed"],
+        "return_code": tr.return_code or int(failures > 0),
+    })
+
+
+def _is_partial(tr: TestRunResult) -> bool:
+    """Результат достроен из выборочного прогона и не заменяет полный прогон стека."""
+    return tr.selection is not None and tr.selection.mode == "impacted"
+
+
+def _merge_batch(trials: list[TestRunResult], prior: TestRunResult | None) -> list[TestRunResult | None]:
+    """Пробы из `/testrun/batch`, достроенные до полных по `prior` (если прогон был выборочным)."""
+    return [_merge_impacted(tr, prior) if prior is not None else tr for tr in trials]
+
+
+def _settle_trials(
+    emit: Callable[..., None],
+    timings: list[dict[str, float]],
+    raw: list[str],
+    patches: list[str],
+    trials: list[TestRunResult | None],
+    elapsed: list[float],
+    current: TestRunResult,
+) -> list[int]:
+    """Учитывает пробы спекулятивного режима (этапы и события) и возвращает их порядок для приёма."""
+    _record_trials(timings, raw, patches, trials, elapsed)
+    _trial_events(emit, raw, patches, trials)
+    return _rank_trials(trials, current)
+
+
+def _accept(
+    emit: Callable[..., None],
+    index: int,
+    patch: str,
+    tr: TestRunResult | None,
+    accepted: list[str],
+    current: TestRunResult,
+) -> tuple[list[str], TestRunResult]:
+    """Принимает патч специалиста `index`, если проба применилась и не ухудшила метрики; иначе ничего не меняет."""
+    if tr is None or not _not_worse(tr, current):
+        return accepted, current
+    emit("specialist_accepted", index=index, diff=patch)
+    return accepted + [patch], tr
+
+
+def _accept_combined(
+    emit: Callable[..., None],
+    raw: list[str],
+    stack: list[str],
+    order: list[int],
+    patches: list[str],
+    combined: TestRunResult | None,
+    best: TestRunResult,
+) -> tuple[list[str], TestRunResult] | None:
+    """
+    Общий стек спекулятивного режима принимается целиком, если он применился и не уступает
+    лучшей одиночной пробе `best`; None — патчи нужно добавлять по одному.
+    """
+    if combined is None or not _not_worse(combined, best):
+        return None
+    for i in order:
+        emit("specialist_accepted", index=raw.index(patches[i]), diff=patches[i])
+    return stack, combined
+
+
+def _first_seen(patch: str, tried: set[str]) -> bool:
+    """Отмечает отпечаток патча; False — эквивалентный патч уже принимался или отвергался."""
+    fp = diff_fingerprint(patch)
+    if fp in tried:
+        return False
+    tried.add(fp)
+    return True
+
+
+def _settle_specialist(
+    emit: Callable[..., None],
+    index: int,
+    patch: str,
+    tr: TestRunResult | None,
+    t: dict[str, float],
+    accepted: list[str],
+    current: TestRunResult,
+) -> tuple[list[str], TestRunResult]:
+    """
+    Итог пробы специалиста в пошаговом режиме: событие, этапы tester-service и решение
+    о приёме. Патч, не применившийся поверх принятых, отвергается как ухудшающий.
+    """
+    emit("specialist_tested", index=index, diff=patch, result=tr.model_dump() if tr is not None else None)
+    if tr is not None:
+        t.update(tr.timings)
+    return _accept(emit, index, patch, tr, accepted, current)
+
+
+def _try_tester_run(
+    client: httpx.Client, tester_url: str, diffs: list[str], timeout: float, prior: TestRunResult | None = None,
+) -> TestRunResult | None:
+    """
+    `tester_run`, возвращающий None, если стек не применился. С `prior` (результатом стека
+    без последнего диффа) запускаются только затронутые тесты, а итог достраивается по `prior`.
+    """
+    try:
+        tr = tester_run(client, tester_url, diffs, timeout, _select_for(prior))
+    except httpx.HTTPStatusError as exc:
+        if _rejected(exc):
+            return None
+        raise
+    return _merge_impacted(tr, prior) if prior is not None else tr
+
+
+def _speculative_specialists(
+    client: httpx.Client,
+    builders: BuilderPool,
+    tester_url: str,
+    prompts: list[str],
+    accepted: list[str],
+    current: TestRunResult,
+    timings: list[dict[str, float]],
+    test_select: TestSelect = "all",
+    on_event: OnEvent | None = None,
+    timeout: float = 60.0,
+) -> tuple[list[str], TestRunResult]:
+    """
+    Генерирует все патчи специалистов одновременно и параллельно тестирует каждый поверх
+    `accepted`. Не ухудшающие метрики патчи складываются в стек по убыванию качества и
+    проверяются одним полным прогоном; если стек не применился или уступает лучшей одиночной
+    пробе, патчи добавляются по одному с тестом после каждого (уже без вызовов Codex).
+    Пустой список `timings` заполняется этапами каждого специалиста (генерация и проба).
+    С `test_select="impacted"` одиночные пробы запускают только затронутые патчем тесты.
+    """
+    emit = _emitter(on_event)
+
+    def _generate(k: int) -> tuple[PatchResponse, float]:
+        emit("specialist_started", index=k)
+        return _timed(_implement_on, builders, client, prompts[k], timeout)
+
+    with ThreadPoolExecutor(max_workers=len(prompts), thread_name_prefix="aw-spec") as pool:
+        generated = _map(pool, _generate, range(len(prompts)))
+        timings.extend({"implement": elapsed} for _, elapsed in generated)
+        raw = [r.diff for r, _ in generated]
+        patches = _distinct(raw, accepted)
+        if not patches:
+            return accepted, current
+        stacks = [accepted + [p] for p in patches]
+        prior = _prior(current, test_select)
+        started = time.monotonic()
+        try:
+            trials: list[TestRunResult | None] | None = tester_run_batch(
+                client, tester_url, stacks, timeout, _select_for(prior),
+            )
+        except RuntimeError:
+            # Какой-то стек не применился: прогоняем по одному, чтобы отбросить только его
+            trials = None
+        if trials is None:
+            timed = _map(pool, lambda st: _timed(_try_tester_run, client, tester_url, st, timeout, prior), stacks)
+            trials = [tr for tr, _ in timed]
+            elapsed = [t for _, t in timed]
+        else:
+            trials = _merge_batch(trials, prior)
+            elapsed = [time.monotonic() - started] * len(stacks)
+    order = _settle_trials(emit, timings, raw, patches, trials, elapsed, current)
+    if not order:
+        return accepted, current
+
+    stack = accepted + [patches[i] for i in order]
+    combined = _try_tester_run(client, tester_url, stack, timeout)
+    done = _accept_combined(emit, raw, stack, order, patches, combined, trials[order[0]])
+    if done is not None:
+        return done
+
+    for i in order:
+        tr = _try_tester_run(client, tester_url, accepted + [patches[i]], timeout, _prior(current, test_select))
+        accepted, current = _accept(emit, raw.index(patches[i]), patches[i], tr, accepted, current)
+    return accepted, current
+
+
+@_traced
 def bridge_multi(
     client: httpx.Client,
     task: str,
     plan_urls: list[str],
-    builder_urls: list[str],
+    builder_urls: list[str] | BuilderPool,
     review_urls: list[str],
     tester_url: str,
     specialists_per_component: int,
+    timeout: float = 60.0,
+    selection: Selection = "best",
+    candidates: int | None = None,
+    specialist_mode: SpecialistMode = "incremental",
+    test_select: TestSelect = "all",
+    on_event: OnEvent | None = None,
 ) -> MultiBridgeResult:
     """
     Мультиагентный конвейер: архитектор → билдеры → специалисты → финальный ревью.
-    Специалисты добавляются жадно: дифф включается только если метрики не ухудшаются.
+    Специалисты добавляются жадно: дифф включается только если метрики не ухудшаются
+    и он применяется поверх уже принятых; дубликаты уже принятых или отвергнутых диффов
+    пропускаются без теста.
+    Базовые кандидаты и специалисты распределяются по билдерам одним `BuilderPool`.
+    `timeout` — лимит на каждый HTTP-вызов конвейера, секунды.
+
+    `specialist_mode="speculative"` запрашивает и тестирует всех специалистов параллельно
+    (см. `_speculative_specialists`): задержка определяется самым медленным специалистом,
+    а не их числом.
+
+    `test_select="impacted"` просит tester запускать в пробах специалистов только тесты,
+    затронутые патчем; исходы остальных берутся из прогона принятого стека. Базовый
+    best-of-N и итоговый стек всегда тестируются полностью.
+
+    `on_event` получает события базового best-of-N и этапов конвейера (см. `BridgeEvent`).
     """
-    plan = codex_plan(client, plan_urls[0], task)
+    builders = _as_pool(builder_urls)
+    emit = _emitter(on_event)
+    timings: dict[str, float] = {}
+    specialist_timings: list[dict[str, float]] = []
+    with stage(timings, "plan"):
+        plan = codex_plan(client, plan_urls[0], task, timeout)
+    emit("plan", components=plan.components)
 
-    base = bridge_best_of_n(client, task, builder_urls, tester_url)
+    with stage(timings, "base"):
+        base = bridge_best_of_n(
+            client, task, builders, tester_url, timeout=timeout, selection=selection, candidates=candidates,
+            on_event=on_event,
+        )
     accepted = [base.candidate_diffs[base.winner_index]]
-    current = tester_run(client, tester_url, accepted)
-
-    if specialists_per_component > 0:
-        for comp in plan.components:
-            for s in range(specialists_per_component):
-                prompt = (
-                    f"Implement specialized improvements for component '{comp.get('name','?')}', "
-                    f"focus files: {', '.join(comp.get('target_files', [])) or 'any'}."
-                )
-                spec_url = builder_urls[(len(accepted) + s) % len(builder_urls)]
-                patch = codex_implement(client, spec_url, prompt).diff
-                trial = accepted + [patch]
-                tr = tester_run(client, tester_url, trial)
-                better = tr.tests_failed < current.tests_failed or (
-                    tr.tests_failed == current.tests_failed and tr.tests_passed >= current.tests_passed
-                )
-                if better:
-                    accepted.append(patch)
-                    current = tr
-
-    review = codex_review(client, review_urls[0], task, accepted)
-    return MultiBridgeResult(plan=plan, base=base, accepted_diffs=accepted, final_tests=current, review=review)
+    with stage(timings, "baseline_test"):
+        current = tester_run(client, tester_url, accepted, timeout)
+    emit("baseline_tested", result=current.model_dump())
+
+    prompts = [_specialist_prompt(comp) for comp in plan.components for _ in range(specialists_per_component)]
+    with stage(timings, "specialists"):
+        if prompts and specialist_mode == "speculative":
+            accepted, current = _speculative_specialists(
+                client, builders, tester_url, prompts, accepted, current, specialist_timings, test_select, on_event,
+                timeout,
+            )
+        else:
+            # Эквивалентный уже принятому или уже отвергнутому патч повторно не тестируется
+            tried = {diff_fingerprint(d) for d in accepted}
+            for k, prompt in enumerate(prompts):
+                t: dict[str, float] = {}
+                specialist_timings.append(t)
+                emit("specialist_started", index=k)
+                with stage(t, "implement"):
+                    patch = _implement_on(builders, client, prompt, timeout).diff
+                if not _first_seen(patch, tried):
+                    continue
+                with stage(t, "test"):
+                    tr = _try_tester_run(client, tester_url, accepted + [patch], timeout, _prior(current, test_select))
+                accepted, current = _settle_specialist(emit, k, patch, tr, t, accepted, current)
+
+    if _is_partial(current):
+        with stage(timings, "final_test"):
+            current = tester_run(client, tester_url, accepted, timeout)
+    emit("final_tested", result=current.model_dump())
+
+    with stage(timings, "review"):
+        review = codex_review(client, review_urls[0], task, accepted, timeout)
+    emit("review", score=review.score, rationale=review.rationale)
+    return MultiBridgeResult(
+        plan=plan, base=base, accepted_diffs=accepted, final_tests=current, review=review,
+        timings=timings, specialist_timings=specialist_timings,
+    )
+
+
+# --- asyncio API ----------------------------------------------------------
+#
+# Асинхронные двойники функций выше поверх `httpx.AsyncClient`: один event loop
+# может вести десятки мостов одновременно. Отмена задачи моста отменяет все
+# вложенные HTTP-вызовы, `timeout` задаёт лимит на каждый отдельный вызов.
+
+
+async def _apost_json(client: httpx.AsyncClient, url: str, payload: dict, timeout: float = 60.0) -> dict:
+    """Асинхронно выполняет POST JSON и возвращает JSON-ответ как словарь."""
+    r = await client.post(url, json=payload, timeout=timeout, headers=trace_headers())
+    _note_diff_store(r)
+    r.raise_for_status()
+    return r.json()
+
+
+async def _aput_diffs(client: httpx.AsyncClient, origin: str, diffs: list[str], timeout: float) -> None:
+    """Асинхронная версия `_put_diffs`."""
+    if not diffs:
+        return
+    body, headers = _upload(diffs)
+    _stored(origin, await client.put(f"{origin}/diffs", content=body, headers=headers, timeout=timeout))
+
+
+async def _apost_diffs(
+    client: httpx.AsyncClient, url: str, payload: dict, key: str, ref_key: str, timeout: float,
+) -> dict:
+    """Асинхронная версия `_post_diffs`."""
+    post = _ref_post(url, payload, key, ref_key)
+    if post is None:
+        data = await _apost_json(client, url, payload, timeout)
+        _remember_diffs(url, _diff_texts(payload[key]).values())
+        return data
+    await _aput_diffs(client, post.origin, post.upload(), timeout)
+    r = await client.post(url, json=post.body, timeout=timeout, headers=trace_headers())
+    missing = post.reupload(r)
+    if missing is not None:
+        await _aput_diffs(client, post.origin, missing, timeout)
+        r = await client.post(url, json=post.body, timeout=timeout, headers=trace_headers())
+    r.raise_for_status()
+    return r.json()
+
+
+async def _atimed(aw: Awaitable[T]) -> tuple[T, float]:
+    """Асинхронная версия `_timed`."""
+    started = time.monotonic()
+    return await aw, time.monotonic() - started
+
+
+def _atraced(fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """Асинхронная версия `_traced`; задачи внутри моста наследуют trace ID и счётчики через контекст."""
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        with trace() as trace_id, request_stats(RETRY_BUDGET) as stats:
+            return dataclasses.replace(await fn(*args, **kwargs), trace_id=trace_id, request_stats=stats.snapshot())
+    return wrapper
+
+
+async def _gather_all(aws: Iterable[Awaitable[Any]]) -> list[Any]:
+    """
+    Конкурентно выполняет корутины и возвращает их результаты по порядку.
+    При первой ошибке или отмене снаружи отменяет оставшиеся задачи и дожидается их.
+    """
+    tasks = [asyncio.ensure_future(a) for a in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def acodex_plan(client: httpx.AsyncClient, codex_url: str, task: str, timeout: float = 60.0) -> Plan:
+    """Асинхронная версия `codex_plan`."""
+    data = await _apost_json(client, f"{codex_url.rstrip('/')}/codex/plan", {"task": task}, timeout)
+    return Plan.model_validate(data)
+
+
+async def acodex_implement(client: httpx.AsyncClient, codex_url: str, task: str, timeout: float = 60.0) -> PatchResponse:
+    """Асинхронная версия `codex_implement`."""
+    url = f"{codex_url.rstrip('/')}/codex/implement"
+    patch = PatchResponse.model_validate(await _apost_json(client, url, {"task": task}, timeout))
+    _remember_diffs(url, [patch.diff])
+    return patch
+
+
+async def _aimplement_once(pool: BuilderPool, client: httpx.AsyncClient, task: str, timeout: float) -> PatchResponse:
+    with pool.lease() as url:
+        return await acodex_implement(client, url, task, timeout)
+
+
+async def _aimplement_idle(
+    pool: BuilderPool, client: httpx.AsyncClient, task: str, timeout: float, stats: RequestStats,
+) -> PatchResponse | None:
+    """Асинхронная версия `_implement_idle`."""
+    with pool.lease_idle() as url:
+        if url is None:
+            return None
+        stats.add("hedges")
+        return await acodex_implement(client, url, task, timeout)
+
+
+async def _ahedged_implement(
+    pool: BuilderPool, client: httpx.AsyncClient, task: str, timeout: float, stats: RequestStats,
+) -> PatchResponse:
+    """Асинхронная версия `_hedged_implement`: проигравший запрос отменяется."""
+    delay = _hedge_delay(pool)
+    if delay is None:
+        return await _aimplement_once(pool, client, task, timeout)
+    primary = asyncio.ensure_future(_aimplement_once(pool, client, task, timeout))
+    started = {primary: time.monotonic()}
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        hedge = asyncio.ensure_future(_aimplement_idle(pool, client, task, timeout, stats))
+        started[hedge] = time.monotonic()
+        pending = set(started)
+        error: BaseException | None = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            patch, error = _hedge_winner(done, pending, started, hedge, stats, error)
+            if patch is not None:
+                return patch
+        assert error is not None
+        raise error
+    finally:
+        for t in started:
+            t.cancel()
+        await asyncio.gather(*started, return_exceptions=True)
+
+
+async def _aimplement_on(pool: BuilderPool, client: httpx.AsyncClient, task: str, timeout: float) -> PatchResponse:
+    """Асинхронная версия `_implement_on`."""
+    stats = _stats()
+    attempt = 0
+    while True:
+        try:
+            return await _ahedged_implement(pool, client, task, timeout, stats)
+        except httpx.HTTPStatusError as exc:
+            delay = _retry_delay(exc, attempt, stats)
+            if delay is None:
+                raise
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+async def acodex_review(
+    client: httpx.AsyncClient, codex_url: str, task: str, diffs: list[str], timeout: float = 60.0,
+) -> Review:
+    """Асинхронная версия `codex_review`."""
+    url = f"{codex_url.rstrip('/')}/codex/review"
+    data = await _apost_diffs(client, url, {"task": task, "diffs": diffs}, "diffs", "diff_refs", timeout)
+    return Review.model_validate(data)
+
+
+async def atester_run(
+    client: httpx.AsyncClient, tester_url: str, diffs: list[str], timeout: float = 60.0, select: TestSelect = "all",
+) -> TestRunResult:
+    """Асинхронная версия `tester_run`."""
+    payload = _testrun_payload("diffs", diffs, select)
+    data = await _apost_diffs(client, f"{tester_url.rstrip('/')}/testrun", payload, "diffs", "diff_refs", timeout)
+    return TestRunResult.model_validate(data)
+
+
+async def atester_run_batch(
+    client: httpx.AsyncClient,
+    tester_url: str,
+    stacks: list[list[str]],
+    timeout: float = 60.0,
+    select: TestSelect = "all",
+) -> list[TestRunResult] | None:
+    """Асинхронная версия `tester_run_batch`."""
+    base = tester_url.rstrip("/")
+    if base in _BATCH_UNSUPPORTED:
+        return None
+    try:
+        payload = _testrun_payload("stacks", stacks, select)
+        data = await _apost_diffs(client, f"{base}/testrun/batch", payload, "stacks", "stack_refs", timeout)
+    except (httpx.HTTPStatusError, httpx.TransportError) as exc:
+        if isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code in (404, 405):
+            _BATCH_UNSUPPORTED.add(base)
+        return None
+    return _batch_results(data)
+
+
+@_atraced
+async def abridge_best_of_n(
+    client: httpx.AsyncClient,
+    task: str,
+    builder_urls: list[str] | BuilderPool,
+    tester_url: str,
+    max_concurrency: int | None = None,
+    timeout: float = 60.0,
+    selection: Selection = "best",
+    batch_tests: bool = True,
+    candidates: int | None = None,
+    on_event: OnEvent | None = None,
+) -> BestOfNResult:
+    """
+    Асинхронная версия `bridge_best_of_n` с тем же правилом выбора победителя и событиями.
+    При `selection="first_green"` незавершённые кандидаты отменяются: их HTTP-соединения
+    закрываются, и codex-runner убивает соответствующие процессы `codex exec`.
+    """
+    builders = _as_pool(builder_urls)
+    emit = _emitter(on_event)
+    n = candidates or len(builders)
+    workers = max(1, min(max_concurrency or n, n))
+    build_sem = asyncio.Semaphore(workers)
+    test_sem = asyncio.Semaphore(workers)
+    diffs: list[str] = [""] * n
+    results: list[TestRunResult | None] = [None] * n
+    timings: list[dict[str, float]] = [{} for _ in range(n)]
+    groups: dict[str, list[int]] = {}
+    # Один прогон на отпечаток диффа; дубликаты ждут его через shield, чтобы их отмена его не снимала
+    shared: dict[str, asyncio.Task[TestRunResult]] = {}
+    use_batch = batch_tests and selection == "best" and tester_url.rstrip("/") not in _BATCH_UNSUPPORTED
+
+    async def _run(stack: list[str]) -> TestRunResult:
+        async with test_sem:
+            return await atester_run(client, tester_url, stack, timeout)
+
+    async def _test(i: int) -> TestRunResult:
+        fp = diff_fingerprint(diffs[i])
+        groups.setdefault(fp, []).append(i)
+        if fp not in shared:
+            shared[fp] = asyncio.ensure_future(_run([diffs[i]]))
+        with stage(timings[i], "test"):
+            results[i] = await asyncio.shield(shared[fp])
+        emit("candidate_tested", index=i, result=results[i].model_dump())
+        return results[i]
+
+    async def _candidate(i: int) -> TestRunResult | None:
+        async with build_sem:
+            emit("candidate_started", index=i)
+            with stage(timings[i], "implement"):
+                diffs[i] = (await _aimplement_on(builders, client, task, timeout)).diff
+        emit("diff_received", index=i, diff=diffs[i], seconds=timings[i]["implement"])
+        return None if use_batch else await _test(i)
+
+    try:
+        if selection == "first_green":
+            tasks = [asyncio.ensure_future(_candidate(i)) for i in range(n)]
+            try:
+                for fut in asyncio.as_completed(tasks):
+                    if _is_full_pass(await fut):
+                        break
+            finally:
+                for t in tasks:
+                    t.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        else:
+            await _gather_all(_candidate(i) for i in range(n))
+            if use_batch:
+                reps = _unique_stacks(diffs, groups)
+                stacks = [[diffs[i]] for i in reps]
+                started = time.monotonic()
+                unique = await atester_run_batch(client, tester_url, stacks, timeout)
+                if unique is None:
+                    unique = await _gather_all(_run(st) for st in stacks)
+                elapsed = time.monotonic() - started
+                for members, tr in zip(groups.values(), unique):
+                    for j in members:
+                        results[j] = tr
+                        timings[j]["test"] = elapsed
+                        emit("candidate_tested", index=j, result=tr.model_dump())
+    finally:
+        for t in shared.values():
+            t.cancel()
+        await asyncio.gather(*shared.values(), return_exceptions=True)
+
+    res = _best_of_n_result(diffs, results, groups, timings)
+    _winner_event(emit, results, res)
+    return res
+
+
+async def _atry_tester_run(
+    client: httpx.AsyncClient, tester_url: str, diffs: list[str], timeout: float, prior: TestRunResult | None = None,
+) -> TestRunResult | None:
+    """Асинхронная версия `_try_tester_run`."""
+    try:
+        tr = await atester_run(client, tester_url, diffs, timeout, _select_for(prior))
+    except httpx.HTTPStatusError as exc:
+        if _rejected(exc):
+            return None
+        raise
+    return _merge_impacted(tr, prior) if prior is not None else tr
+
+
+async def _aspeculative_specialists(
+    client: httpx.AsyncClient,
+    builders: BuilderPool,
+    tester_url: str,
+    prompts: list[str],
+    accepted: list[str],
+    current: TestRunResult,
+    timings: list[dict[str, float]],
+    timeout: float,
+    test_select: TestSelect = "all",
+    on_event: OnEvent | None = None,
+) -> tuple[list[str], TestRunResult]:
+    """Асинхронная версия `_speculative_specialists`."""
+    emit = _emitter(on_event)
+
+    async def _generate(k: int) -> PatchResponse:
+        emit("specialist_started", index=k)
+        return await _aimplement_on(builders, client, prompts[k], timeout)
+
+    generated = await _gather_all(_atimed(_generate(k)) for k in range(len(prompts)))
+    timings.extend({"implement": elapsed} for _, elapsed in generated)
+    raw = [r.diff for r, _ in generated]
+    patches = _distinct(raw, accepted)
+    if not patches:
+        return accepted, current
+    stacks = [accepted + [p] for p in patches]
+    prior = _prior(current, test_select)
+    started = time.monotonic()
+    try:
+        trials: list[TestRunResult | None] | None = await atester_run_batch(
+            client, tester_url, stacks, timeout, _select_for(prior),
+        )
+    except RuntimeError:
+        trials = None
+    if trials is None:
+        timed = await _gather_all(_atimed(_atry_tester_run(client, tester_url, st, timeout, prior)) for st in stacks)
+        trials = [tr for tr, _ in timed]
+        elapsed = [t for _, t in timed]
+    else:
+        trials = _merge_batch(trials, prior)
+        elapsed = [time.monotonic() - started] * len(stacks)
+    order = _settle_trials(emit, timings, raw, patches, trials, elapsed, current)
+    if not order:
+        return accepted, current
+
+    stack = accepted + [patches[i] for i in order]
+    combined = await _atry_tester_run(client, tester_url, stack, timeout)
+    done = _accept_combined(emit, raw, stack, order, patches, combined, trials[order[0]])
+    if done is not None:
+        return done
+
+    for i in order:
+        tr = await _atry_tester_run(client, tester_url, accepted + [patches[i]], timeout, _prior(current, test_select))
+        accepted, current = _accept(emit, raw.index(patches[i]), patches[i], tr, accepted, current)
+    return accepted, current
+
+
+@_atraced
+async def abridge_multi(
+    client: httpx.AsyncClient,
+    task: str,
+    plan_urls: list[str],
+    builder_urls: list[str] | BuilderPool,
+    review_urls: list[str],
+    tester_url: str,
+    specialists_per_component: int,
+    timeout: float = 60.0,
+    selection: Selection = "best",
+    candidates: int | None = None,
+    specialist_mode: SpecialistMode = "incremental",
+    test_select: TestSelect = "all",
+    on_event: OnEvent | None = None,
+) -> MultiBridgeResult:
+    """
+    Асинхронная версия `bridge_multi`. Архитектор и базовый best-of-N не зависят
+    друг от друга и выполняются одновременно; специалисты — жадно, как в sync-версии.
+    """
+    builders = _as_pool(builder_urls)
+    emit = _emitter(on_event)
+    timings: dict[str, float] = {}
+    specialist_timings: list[dict[str, float]] = []
+
+    async def _plan() -> Plan:
+        plan = await acodex_plan(client, plan_urls[0], task, timeout)
+        emit("plan", components=plan.components)
+        return plan
+
+    (plan, timings["plan"]), (base, timings["base"]) = await _gather_all([
+        _atimed(_plan()),
+        _atimed(abridge_best_of_n(
+            client, task, builders, tester_url, timeout=timeout, selection=selection, candidates=candidates,
+            on_event=on_event,
+        )),
+    ])
+    accepted = [base.candidate_diffs[base.winner_index]]
+    with stage(timings, "baseline_test"):
+        current = await atester_run(client, tester_url, accepted, timeout)
+    emit("baseline_tested", result=current.model_dump())
+
+    prompts = [_specialist_prompt(comp) for comp in plan.components for _ in range(specialists_per_component)]
+    with stage(timings, "specialists"):
+        if prompts and specialist_mode == "speculative":
+            accepted, current = await _aspeculative_specialists(
+                client, builders, tester_url, prompts, accepted, current, specialist_timings, timeout, test_select,
+                on_event,
+            )
+        else:
+            # Эквивалентный уже принятому или уже отвергнутому патч повторно не тестируется
+            tried = {diff_fingerprint(d) for d in accepted}
+            for k, prompt in enumerate(prompts):
+                t: dict[str, float] = {}
+                specialist_timings.append(t)
+                emit("specialist_started", index=k)
+                with stage(t, "implement"):
+                    patch = (await _aimplement_on(builders, client, prompt, timeout)).diff
+                if not _first_seen(patch, tried):
+                    continue
+                with stage(t, "test"):
+                    prior = _prior(current, test_select)
+                    tr = await _atry_tester_run(client, tester_url, accepted + [patch], timeout, prior)
+                accepted, current = _settle_specialist(emit, k, patch, tr, t, accepted, current)
+
+    if _is_partial(current):
+        with stage(timings, "final_test"):
+            current = await atester_run(client, tester_url, accepted, timeout)
+    emit("final_tested", result=current.model_dump())
+
+    with stage(timings, "review"):
+        review = await acodex_review(client, review_urls[0], task, accepted, timeout)
+    emit("review", score=review.score, rationale=review.rationale)
+    return MultiBridgeResult(
+        plan=plan, base=base, accepted_diffs=accepted, final_tests=current, review=review,
+        timings=timings, specialist_timings=specialist_timings,
+    )
+
+
+# --- потоки событий -------------------------------------------------------
+
+
+def iter_bridge_events(bridge: Callable[..., T], *args: Any, **kwargs: Any) -> Iterator[BridgeEvent]:
+    """
+    Запускает sync-мост (`bridge_best_of_n`, `bridge_multi`) в отдельном потоке и отдаёт
+    его события по мере появления; последнее — `done` с результатом в `result`.
+    Исключение моста пробрасывается из итератора.
+    """
+    events: queue.Queue[BridgeEvent | BaseException] = queue.Queue()
+
+    def _run() -> None:
+        try:
+            result = bridge(*args, on_event=events.put, **kwargs)
+            events.put(BridgeEvent("done", trace_id=getattr(result, "trace_id", ""), result=result))
+        except BaseException as exc:  # noqa: BLE001
+            events.put(exc)
+
+    threading.Thread(target=contextvars.copy_context().run, args=(_run,), name="aw-bridge", daemon=True).start()
+    while True:
+        item = events.get()
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+        if item.event == "done":
+            return
+
+
+async def astream_bridge(
+    bridge: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any,
+) -> AsyncIterator[BridgeEvent]:
+    """
+    Асинхронный итератор событий моста (`abridge_best_of_n`, `abridge_multi`); последнее
+    событие — `done` с результатом. Если потребитель прекращает итерацию, мост отменяется.
+    """
+    events: asyncio.Queue[BridgeEvent | None] = asyncio.Queue()
+    task = asyncio.ensure_future(bridge(*args, on_event=events.put_nowait, **kwargs))
+    task.add_done_callback(lambda _: events.put_nowait(None))
+    try:
+        while (event := await events.get()) is not None:
+            yield event
+        result = task.result()
+        yield BridgeEvent("done", trace_id=getattr(result, "trace_id", ""), result=result)
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
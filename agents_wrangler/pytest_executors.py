@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import gc
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Literal
+
+Executor = Literal["subprocess", "forkserver"]
+"""Способ запуска pytest: новый интерпретатор на каждый прогон или fork от прогретого сервера."""
+
+
+@dataclass
+class PytestRun:
+    """Итог одного запуска pytest: код возврата и захваченный вывод."""
+    returncode: int
+    stdout: str
+    stderr: str
+
+
+def run_subprocess(target: Path, sys_paths: list[str], args: list[str], timeout: float) -> PytestRun:
+    """Запускает `pytest <args>` отдельным процессом в каталоге `target`."""
+    proc = subprocess.run(
+        ["pytest", *args],
+        cwd=target,
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys_paths)},
+        timeout=timeout,
+    )
+    return PytestRun(returncode=proc.returncode, stdout=proc.stdout, stderr=proc.stderr)
+
+
+# --- fork-сервер ------------------------------------------------------------
+#
+# Сервер — отдельный процесс `python -m agents_wrangler.pytest_executors <socket>`,
+# который один раз импортирует pytest со всеми плагинами и слушает Unix-сокет.
+# На каждое подключение он делает os.fork(): дочерний процесс получает сокет,
+# сообщает свой pid, выполняет pytest.main в каталоге проекта и пишет результат
+# JSON-строкой. Код проекта в сервер не импортируется, поэтому каждый прогон
+# изолирован так же, как отдельный subprocess.
+
+
+def _preload() -> None:
+    """Импортирует pytest, его встроенные плагины и плагины из entry points `pytest11`."""
+    import importlib
+    from importlib.metadata import entry_points
+
+    from _pytest.config import default_plugins
+
+    names = ["pytest", *(f"_pytest.{name}" for name in default_plugins)]
+    names += [ep.module for ep in entry_points(group="pytest11")]
+    for name in names:
+        try:
+            importlib.import_module(name)
+        except Exception:  # noqa: BLE001
+            pass
+
+
+def _child(conn: socket.socket, request: dict) -> None:
+    """Тело дочернего процесса fork-сервера; никогда не возвращается."""
+    try:
+        import pytest
+
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        conn.sendall((json.dumps({"pid": os.getpid()}) + "\n").encode())
+        os.chdir(request["target"])
+        sys.path[:0] = request["sys_paths"]
+        with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+            # Перехватываем именно дескрипторы 1/2: pytest и тесты пишут в них напрямую
+            os.dup2(out.fileno(), 1)
+            os.dup2(err.fileno(), 2)
+            try:
+                # Предзагруженные плагины уже импортированы и не переписываются assert-rewrite
+                code = int(pytest.main(["-W", "ignore::pytest.PytestAssertRewriteWarning", *request["args"]]))
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            out.seek(0)
+            err.seek(0)
+            result = {
+                "returncode": code,
+                "stdout": out.read().decode("utf-8", "replace"),
+                "stderr": err.read().decode("utf-8", "replace"),
+            }
+        conn.sendall((json.dumps(result) + "\n").encode())
+    finally:
+        os._exit(0)
+
+
+def _exit_with_parent() -> None:
+    """Завершает сервер, когда закрывается его stdin, т. е. когда умер процесс-владелец."""
+    sys.stdin.read()
+    os._exit(0)
+
+
+def serve(socket_path: str) -> None:
+    """Главный цикл fork-сервера: предзагрузка, затем fork на каждое подключение."""
+    threading.Thread(target=_exit_with_parent, daemon=True).start()
+    _preload()
+    # Объекты сервера больше не меняются: убираем их из-под GC, чтобы fork не копировал страницы
+    gc.freeze()
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+        listener.bind(socket_path)
+        listener.listen(64)
+        sys.stdout.write("ready\n")
+        sys.stdout.flush()
+        while True:
+            conn, _ = listener.accept()
+            with conn, conn.makefile("rb") as rfile:
+                request = json.loads(rfile.readline())
+                if os.fork() == 0:
+                    listener.close()
+                    _child(conn, request)
+
+
+class ForkServerExecutor:
+    """
+    Клиент fork-сервера: поднимает его по требованию и отправляет прогоны через Unix-сокет.
+    Таймаут соблюдается так же, как у subprocess: дочерний процесс убивается и бросается
+    `subprocess.TimeoutExpired`.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._server: subprocess.Popen | None = None
+        self._socket_path = ""
+
+    def start(self) -> None:
+        """Запускает fork-сервер, если он ещё не запущен или умер, и ждёт его готовности."""
+        with self._lock:
+            if self._server is not None and self._server.poll() is None:
+                return
+            self._socket_path = os.path.join(tempfile.mkdtemp(prefix="aw_forkserver_"), "sock")
+            package_root = str(Path(__file__).resolve().parent.parent)
+            pythonpath = os.pathsep.join(p for p in [package_root, os.environ.get("PYTHONPATH", "")] if p)
+            self._server = subprocess.Popen(
+                [sys.executable, "-m", __name__, self._socket_path],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+                env={**os.environ, "PYTHONPATH": pythonpath},
+            )
+            if self._server.stdout is None or self._server.stdout.readline().strip() != "ready":
+                raise RuntimeError("pytest fork server failed to start")
+
+    def close(self) -> None:
+        """Останавливает fork-сервер."""
+        with self._lock:
+            if self._server is not None:
+                self._server.kill()
+                self._server.wait()
+                self._server = None
+
+    def run(self, target: Path, sys_paths: list[str], args: list[str], timeout: float) -> PytestRun:
+        """Выполняет pytest.main в свежем fork'е сервера."""
+        self.start()
+        deadline = time.monotonic() + timeout
+        request = {"target": str(target), "sys_paths": sys_paths, "args": args}
+        pid = None
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(self._socket_path)
+            conn.sendall((json.dumps(request) + "\n").encode())
+            with conn.makefile("rb") as rfile:
+                try:
+                    conn.settimeout(max(0.001, deadline - time.monotonic()))
+                    pid = json.loads(rfile.readline())["pid"]
+                    conn.settimeout(max(0.001, deadline - time.monotonic()))
+                    line = rfile.readline()
+                except TimeoutError:
+                    if pid is not None:
+                        try:
+                            os.kill(pid, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                    raise subprocess.TimeoutExpired(["pytest", *args], timeout)
+        if not line:
+            return PytestRun(returncode=1, stdout="", stderr="pytest worker exited without a result")
+        data = json.loads(line)
+        return PytestRun(returncode=data["returncode"], stdout=data["stdout"], stderr=data["stderr"])
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1])
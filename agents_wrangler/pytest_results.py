@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+# Плагин pytest, который tester-service подключает через `-p agents_wrangler.pytest_results`.
+# По окончании сессии он пишет JSON с исходом и длительностью каждого теста в файл
+# `--aw-results`, чтобы сервису не приходилось разбирать текстовый вывод pytest.
+# Там же — nodeid всех собранных тестов (нужны для шардирования после `--collect-only`).
+# С `--aw-progress` исход каждого теста ещё и дописывается JSON-строкой в этот файл сразу
+# по завершении теста: tester-service читает его во время прогона и стримит клиенту.
+
+OUTCOMES = ("passed", "failed", "error", "skipped", "xfailed", "xpassed")
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    parser.addoption("--aw-results", default=None, help="куда записать JSON с исходами тестов")
+    parser.addoption("--aw-progress", default=None, help="куда дописывать исходы тестов по мере завершения (JSONL)")
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    path = config.getoption("--aw-results")
+    if path:
+        progress = config.getoption("--aw-progress")
+        config.pluginmanager.register(ResultCollector(Path(path), Path(progress) if progress else None), "aw-results")
+
+
+def _outcome(report: pytest.TestReport) -> str | None:
+    """Исход теста по отчёту одной фазы; None — фаза ничего не решает (успешные setup/teardown)."""
+    xfail = hasattr(report, "wasxfail")
+    if report.when == "call":
+        if report.passed:
+            return "xpassed" if xfail else "passed"
+        if report.skipped:
+            return "xfailed" if xfail else "skipped"
+        return "failed"
+    if report.failed:
+        return "error"
+    if report.skipped:
+        return "xfailed" if xfail else "skipped"
+    return None
+
+
+class ResultCollector:
+    """Собирает исходы тестов по фазам setup/call/teardown и ошибки сбора."""
+
+    def __init__(self, path: Path, progress: Path | None = None) -> None:
+        self.path = path
+        self.tests: dict[str, dict[str, Any]] = {}
+        self.collected: list[str] = []
+        self.progress = progress.open("a", encoding="utf-8", buffering=1) if progress else None
+
+    def _report(self, item: dict[str, Any]) -> None:
+        if self.progress is not None:
+            self.progress.write(json.dumps(item) + "\n")
+
+    def pytest_runtest_logreport(self, report: pytest.TestReport) -> None:
+        item = self.tests.setdefault(report.nodeid, {"nodeid": report.nodeid, "outcome": "passed", "duration": 0.0})
+        item["duration"] += report.duration
+        outcome = _outcome(report)
+        # Ошибка в teardown перекрывает уже записанный успех, но не падение самого теста
+        if outcome is not None and not (outcome == "error" and item["outcome"] == "failed"):
+            item["outcome"] = outcome
+        if report.when == "teardown":
+            self._report(item)
+
+    def pytest_collectreport(self, report: pytest.CollectReport) -> None:
+        if report.failed:
+            self.tests[report.nodeid] = {"nodeid": report.nodeid, "outcome": "error", "duration": 0.0}
+            self._report(self.tests[report.nodeid])
+
+    def pytest_collection_finish(self, session: pytest.Session) -> None:
+        self.collected = [item.nodeid for item in session.items]
+
+    def pytest_sessionfinish(self, session: pytest.Session) -> None:
+        data = {"tests": list(self.tests.values()), "collected": self.collected}
+        self.path.write_text(json.dumps(data), encoding="utf-8")
+        if self.progress is not None:
+            self.progress.close()
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import heapq
+import threading
+from collections import OrderedDict
+from typing import Iterable
+
+# Шардирование прогона pytest: собранные тесты раскладываются по N процессам так,
+# чтобы суммарные длительности шардов были близки. Длительности берутся из прошлых
+# прогонов (`DurationHistory`); для неизвестных тестов — среднее по известным.
+
+
+class DurationHistory:
+    """
+    Потокобезопасная история длительностей тестов по nodeid: экспоненциальное
+    сглаживание по прогонам и LRU-вытеснение сверх `max_entries`.
+    """
+
+    def __init__(self, max_entries: int, alpha: float = 0.5) -> None:
+        self.max_entries = max_entries
+        self.alpha = alpha
+        self._entries: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def update(self, durations: Iterable[tuple[str, float]]) -> None:
+        """Учитывает длительности одного прогона."""
+        with self._lock:
+            for nodeid, seconds in durations:
+                old = self._entries.pop(nodeid, None)
+                self._entries[nodeid] = seconds if old is None else old + self.alpha * (seconds - old)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def estimate(self, nodeids: list[str]) -> list[float]:
+        """Оценки длительностей в порядке `nodeids`; неизвестным достаётся среднее известных (или 1 с)."""
+        with self._lock:
+            known = [self._entries.get(n) for n in nodeids]
+        values = [v for v in known if v is not None]
+        default = sum(values) / len(values) if values else 1.0
+        return [default if v is None else v for v in known]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+def plan_shards(nodeids: list[str], durations: list[float], shards: int) -> list[list[str]]:
+    """
+    Жадное разбиение (LPT): самые долгие тесты по очереди уходят в наименее загруженный
+    шард. Внутри шарда сохраняется порядок сбора, чтобы фикстуры модулей не пересоздавались.
+    Пустые шарды не возвращаются.
+    """
+    shards = max(1, min(shards, len(nodeids)))
+    heap = [(0.0, i) for i in range(shards)]
+    owner: dict[int, int] = {}
+    for pos in sorted(range(len(nodeids)), key=lambda p: (-durations[p], p)):
+        load, shard = heapq.heappop(heap)
+        owner[pos] = shard
+        heapq.heappush(heap, (load + durations[pos], shard))
+    out: list[list[str]] = [[] for _ in range(shards)]
+    for pos, nodeid in enumerate(nodeids):
+        out[owner[pos]].append(nodeid)
+    return [s for s in out if s]
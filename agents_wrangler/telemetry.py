@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+
+# Трассировка: оркестратор выдаёт мосту trace ID и передаёт его во все запросы
+# заголовком `X-AW-Trace-Id`; сервисы принимают его (или создают свой) и возвращают
+# в ответе, так что один мост можно проследить по логам всех сервисов.
+
+TRACE_HEADER = "X-AW-Trace-Id"
+_TRACE_ID: ContextVar[str | None] = ContextVar("aw_trace_id", default=None)
+
+# Границы бакетов гистограмм в секундах: от быстрых git-операций до долгих `codex exec`
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def current_trace_id() -> str | None:
+    """Trace ID текущего моста или запроса, если он задан."""
+    return _TRACE_ID.get()
+
+
+@contextmanager
+def trace(trace_id: str | None = None) -> Iterator[str]:
+    """
+    Задаёт trace ID на время блока: переданный, уже действующий (вложенный мост
+    продолжает трассу внешнего) или новый.
+    """
+    value = trace_id or _TRACE_ID.get() or uuid.uuid4().hex[:16]
+    token = _TRACE_ID.set(value)
+    try:
+        yield value
+    finally:
+        _TRACE_ID.reset(token)
+
+
+def trace_headers() -> dict[str, str]:
+    """Заголовки для исходящего запроса с текущим trace ID."""
+    trace_id = _TRACE_ID.get()
+    return {TRACE_HEADER: trace_id} if trace_id else {}
+
+
+@contextmanager
+def stage(timings: dict[str, float], name: str) -> Iterator[None]:
+    """Добавляет длительность блока к `timings[name]` (секунды)."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.monotonic() - started
+
+
+class Histogram:
+    """Гистограмма Prometheus с метками; значения в секундах."""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # По набору значений меток: счётчики бакетов (последний — +Inf), сумма и число наблюдений
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> float:
+        """Учитывает наблюдение и возвращает его, чтобы значение можно было сразу записать в тайминги."""
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect_left(self.buckets, value)] += 1
+            total[0] += value
+        return value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Наблюдает длительность блока `with`."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def render(self) -> list[str]:
+        """Строки текстового формата Prometheus для этой гистограммы."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total[0]) for key, (counts, total) in self._series.items()}
+        for key, (counts, total) in sorted(series.items()):
+            pairs = [f'{name}="{value}"' for name, value in zip(self.labels, key)]
+            cumulative = 0
+            for bound, count in zip([*map(_fmt, self.buckets), "+Inf"], counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{{{','.join([*pairs, le])}}} {cumulative}")
+            suffix = f"{{{','.join(pairs)}}}" if pairs else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+def _fmt(bound: float) -> str:
+    return repr(float(bound))
+
+
+class Registry:
+    """Набор метрик одного сервиса, отдаваемый эндпоинтом `/metrics`."""
+
+    def __init__(self) -> None:
+        self._metrics: list[Histogram] = []
+
+    def histogram(
+        self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+class TraceRequests:
+    """
+    ASGI-middleware: trace ID запроса (`X-AW-Trace-Id` в запросе и ответе) и длительность
+    обработки в гистограмме. Чистый ASGI, а не `@app.middleware("http")`: под
+    `BaseHTTPMiddleware` эндпоинты не видят отключения клиента и не могут прервать `codex exec`.
+    """
+
+    def __init__(self, app: Any, requests: Histogram) -> None:
+        self.app = app
+        self.requests = requests
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.monotonic()
+        incoming = dict(scope.get("headers") or []).get(TRACE_HEADER.lower().encode())
+        status = 500
+        with trace(incoming.decode("latin-1") if incoming else None) as trace_id:
+
+            async def _send(message: dict) -> None:
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    headers = [*message.get("headers", []), (TRACE_HEADER.lower().encode(), trace_id.encode())]
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, _send)
+            finally:
+                # Шаблон маршрута, а не сам путь: иначе у метрики будет неограниченное число серий
+                route = getattr(scope.get("route"), "path", "unmatched")
+                self.requests.observe(
+                    time.monotonic() - started, method=scope["method"], route=route, status=str(status),
+                )
+
+
+def instrument(app: FastAPI, registry: Registry, service: str) -> None:
+    """
+    Подключает к сервису трассировку (`X-AW-Trace-Id` в запросе и ответе), гистограмму
+    длительности HTTP-запросов и эндпоинт `GET /metrics` в текстовом формате Prometheus.
+    """
+    requests = registry.histogram(
+        f"aw_{service}_http_request_seconds", "Длительность обработки HTTP-запроса", ("method", "route", "status"),
+    )
+
+    app.add_middleware(TraceRequests, requests=requests)
+
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    def metrics() -> PlainTextResponse:
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
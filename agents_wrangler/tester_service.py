@@ -1,18 +1,126 @@
 from __future__ import annotations
 
+import asyncio
+import json
 import os
-import shutil
 import subprocess
 import tempfile
-from pathlib import Path
-from typing import Any
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path, PurePosixPath
+from typing import Any, AsyncIterator, Callable, Iterator, Literal
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, field_validator
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, field_validator
 
-app = FastAPI(title="agents-wrangler tester-service", version="0.2.0")
+from agents_wrangler.cache import DiskCache, MemoryCache, TieredCache, content_key
+from agents_wrangler.diff_store import DiffStore, MissingDiffs, install
+from agents_wrangler.diffs import PatchError, apply_patch
+from agents_wrangler.impact import ImportGraph, changed_files
+from agents_wrangler.pytest_executors import Executor, ForkServerExecutor, PytestRun, run_subprocess
+from agents_wrangler.sharding import DurationHistory, plan_shards
+from agents_wrangler.telemetry import Registry, instrument, stage
+from agents_wrangler.workspaces import BaselineRepo, PrefixCache, Workspace, WorkspacePool, git
 
 DEMO_APP_DIR = Path(__file__).resolve().parent.parent / "demo_app"
+# Сколько чистых рабочих копий держать наготове
+POOL_SIZE = int(os.environ.get("TESTER_POOL_SIZE", "4"))
+
+# Бюджет кэша снапшотов префиксов стека диффов
+PREFIX_CACHE_ENTRIES = int(os.environ.get("TESTER_PREFIX_CACHE_ENTRIES", "256"))
+PREFIX_CACHE_MB = int(os.environ.get("TESTER_PREFIX_CACHE_MB", "64"))
+
+# Кэш результатов: память с TTL и опциональный каталог на диске
+RESULT_CACHE_ENTRIES = int(os.environ.get("TESTER_RESULT_CACHE_ENTRIES", "512"))
+RESULT_CACHE_TTL = float(os.environ.get("TESTER_RESULT_CACHE_TTL", "3600"))
+RESULT_CACHE_DIR = os.environ.get("TESTER_RESULT_CACHE_DIR")
+RESULT_CACHE_DISK_ENTRIES = int(os.environ.get("TESTER_RESULT_CACHE_DISK_ENTRIES", "10000"))
+
+# Бюджет хранилища диффов, на которые клиенты ссылаются по SHA-256 (см. agents_wrangler.diff_store)
+DIFF_STORE_MB = int(os.environ.get("TESTER_DIFF_STORE_MB", "64"))
+
+PYTEST_ARGS = ["pytest", "-q"]
+PYTEST_TIMEOUT = 60
+# Плагин, через который pytest отдаёт исходы тестов в JSON (см. agents_wrangler.pytest_results)
+RESULTS_PLUGIN = "agents_wrangler.pytest_results"
+PACKAGE_ROOT = Path(__file__).resolve().parent.parent
+# Сколько последних символов stdout/stderr оставлять в режиме output="truncated"
+OUTPUT_TAIL_CHARS = int(os.environ.get("TESTER_OUTPUT_TAIL_CHARS", "4000"))
+# Чем применять диффы: "python" — встроенный движок с откатом на git при неудаче, "git" — только git apply/patch
+PATCH_ENGINE = os.environ.get("TESTER_PATCH_ENGINE", "python")
+# Сколько строк контекста с краёв ханка встроенный движок может отбросить при поиске места
+PATCH_FUZZ = int(os.environ.get("TESTER_PATCH_FUZZ", "2"))
+# Исполнитель pytest по умолчанию: "subprocess" или "forkserver"
+EXECUTOR: Executor = os.environ.get("TESTER_EXECUTOR", "subprocess")  # type: ignore[assignment]
+
+# Сколько стеков из /testrun/batch тестируется одновременно (по умолчанию — по числу ядер).
+# Каждый прогон — это отдельный процесс pytest, поэтому потоки здесь лишь ограничивают
+# число одновременно живущих процессов и делят между собой пул workspace и кэши.
+BATCH_WORKERS = int(os.environ.get("TESTER_BATCH_WORKERS", str(os.cpu_count() or 1)))
+
+# Шардирование одного прогона: на сколько процессов pytest делить тесты по умолчанию
+# и верхняя граница для параметра `shards` запроса. Шарды всех прогонов делят общий
+# пул из TESTER_MAX_SHARDS потоков, так что процессов шардов не больше этого числа.
+SHARDS = int(os.environ.get("TESTER_SHARDS", "1"))
+MAX_SHARDS = int(os.environ.get("TESTER_MAX_SHARDS", str(os.cpu_count() or 1)))
+# Сколько тестов помнить в истории длительностей для балансировки шардов
+DURATION_HISTORY_ENTRIES = int(os.environ.get("TESTER_DURATION_HISTORY_ENTRIES", "100000"))
+
+POOL = WorkspacePool(DEMO_APP_DIR, POOL_SIZE)
+PREFIXES = PrefixCache(PREFIX_CACHE_ENTRIES, PREFIX_CACHE_MB * 1024 * 1024)
+RESULTS = TieredCache(
+    MemoryCache(RESULT_CACHE_ENTRIES, RESULT_CACHE_TTL),
+    DiskCache(Path(RESULT_CACHE_DIR), RESULT_CACHE_DISK_ENTRIES, RESULT_CACHE_TTL) if RESULT_CACHE_DIR else None,
+)
+DIFFS = DiffStore(DIFF_STORE_MB * 1024 * 1024)
+BATCH_POOL = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="aw-batch")
+SHARD_POOL = ThreadPoolExecutor(max_workers=max(1, MAX_SHARDS), thread_name_prefix="aw-shard")
+DURATIONS = DurationHistory(DURATION_HISTORY_ENTRIES)
+FORKSERVER = ForkServerExecutor()
+# Графы импортов для выбора затронутых тестов, по хешу дерева baseline
+_GRAPHS: dict[str, ImportGraph] = {}
+_GRAPHS_LOCK = threading.Lock()
+
+METRICS = Registry()
+QUEUE_WAIT_SECONDS = METRICS.histogram("aw_tester_queue_wait_seconds", "Ожидание свободного воркера пакета")
+WORKSPACE_SECONDS = METRICS.histogram("aw_tester_workspace_seconds", "Получение рабочей копии из пула")
+APPLY_SECONDS = METRICS.histogram("aw_tester_apply_seconds", "Применение стека диффов (git apply)")
+PYTEST_SECONDS = METRICS.histogram("aw_tester_pytest_seconds", "Прогон pytest", ("executor",))
+
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Прогревает пул рабочих копий при старте сервиса и убирает его при остановке."""
+    POOL.start()
+    if EXECUTOR == "forkserver":
+        FORKSERVER.start()
+    yield
+    POOL.close()
+    FORKSERVER.close()
+
+
+app = FastAPI(title="agents-wrangler tester-service", version="0.2.0", lifespan=_lifespan)
+instrument(app, METRICS, "tester")
+install(app, DIFFS)
+
+OutputMode = Literal["full", "truncated", "none"]
+"""Сколько сырого вывода pytest возвращать: весь, только хвост или ничего."""
+
+TestSelect = Literal["all", "impacted"]
+"""
+Какие тесты запускать: весь набор или только затронутые последним диффом стека
+(см. `agents_wrangler.impact`); остальные тесты сохраняют исход стека без него.
+"""
+
+OnEvent = Callable[[dict[str, Any]], None]
+"""
+Получатель событий прогона (строк NDJSON `/testrun?stream=true`):
+`{"event": "stage", "stage", "seconds"}` по завершении этапа и
+`{"event": "test", "nodeid", "outcome", "duration"}` по завершении каждого теста.
+"""
 
 
 class TestRunRequest(BaseModel):
@@ -20,33 +128,103 @@ class TestRunRequest(BaseModel):
     Запрос на тестовый прогон.
 
     Можно передать либо один unified diff через поле `diff`,
-    либо список диффов `diffs` для последовательного применения.
+    либо список диффов `diffs` для последовательного применения,
+    либо ссылки `diff_refs` на диффы, загруженные через `PUT /diffs`.
     """
     diff: str | None = None
     diffs: list[str] | None = None
+    diff_refs: list[str] | None = None
+    executor: Executor | None = None
+    output: OutputMode = "full"
+    select: TestSelect = "all"
+    shards: int | None = Field(default=None, ge=1)
 
     @field_validator("diffs")
     @classmethod
     def at_least_one(cls, v: list[str] | None, info) -> list[str] | None:
         return v
 
-    def normalized_diffs(self) -> list[str]:
-        """Возвращает список диффов вне зависимости от того, что прислал клиент."""
+    def normalized_diffs(self, store: DiffStore | None = None) -> list[str]:
+        """
+        Возвращает список диффов вне зависимости от того, что прислал клиент; ссылки
+        разрешаются через `store` (неизвестные — `MissingDiffs`).
+        """
+        if self.diff_refs and store is not None:
+            return store.resolve(self.diff_refs)
         if self.diffs and len(self.diffs) > 0:
             return self.diffs
         if self.diff:
             return [self.diff]
-        raise ValueError("either `diff` or `diffs` must be provided")
+        raise ValueError("either `diff`, `diffs` or `diff_refs` must be provided")
+
+
+class TestBatchRequest(BaseModel):
+    """
+    Пакет независимых стеков диффов; каждый стек тестируется отдельно от остальных.
+    Стеки передаются текстами (`stacks`) или ссылками на хранилище (`stack_refs`).
+    """
+    stacks: list[list[str]] = []
+    stack_refs: list[list[str]] | None = None
+    executor: Executor | None = None
+    output: OutputMode = "full"
+    select: TestSelect = "all"
+    shards: int | None = Field(default=None, ge=1)
+
+
+class TestOutcome(BaseModel):
+    """Исход одного теста: passed/failed/error/skipped/xfailed/xpassed и суммарная длительность фаз."""
+    nodeid: str
+    outcome: str
+    duration: float = 0.0
+
+
+class TestSelection(BaseModel):
+    """
+    Какие тесты запускались: `mode` — фактический режим (запрос `impacted` откатывается
+    на `all`, если выбор невозможен, причина — в `reason`), `test_files` — выбранные
+    тестовые файлы относительно проекта, `tests_skipped` — оценка числа незапущенных тестов.
+    """
+    mode: TestSelect = "all"
+    reason: str = ""
+    test_files: list[str] = []
+    tests_skipped: int = 0
 
 
 class TestRunResult(BaseModel):
-    """Результат прогонов pytest: агрегированные метрики и логи."""
+    """
+    Результат прогонов pytest: агрегированные метрики, исходы тестов и логи.
+    `tests_total` — число тестов с вердиктом (passed + failed + errors); пропущенные
+    и xfail считаются отдельно.
+    """
     tests_total: int
     tests_passed: int
     tests_failed: int
     return_code: int
     stdout: str
     stderr: str
+    cached: bool = False
+    tests_errors: int = 0
+    tests_skipped: int = 0
+    tests_xfailed: int = 0
+    tests: list[TestOutcome] = []
+    # Длительности этапов прогона в секундах: workspace, apply, select, pytest
+    # (включая collect при шардировании); у ответа из кэша — пусто
+    timings: dict[str, float] = {}
+    selection: TestSelection = TestSelection()
+    # Сколько процессов pytest выполняли прогон
+    shards: int = 1
+
+
+class TestBatchItem(BaseModel):
+    """Итог одного стека из пакета: результат либо текст ошибки (например, патч не применился)."""
+    index: int
+    result: TestRunResult | None = None
+    error: str | None = None
+
+
+class TestBatchResult(BaseModel):
+    """Результаты пакета в порядке входных стеков."""
+    results: list[TestBatchItem]
 
 
 def _parse_pytest_summary(stdout: str) -> tuple[int, int, int]:
@@ -67,56 +245,445 @@ def _parse_pytest_summary(stdout: str) -> tuple[int, int, int]:
     return total, passed, failed
 
 
-def run_tests_on_diffs(diffs: list[str]) -> TestRunResult:
+def _result_from_outcomes(proc: PytestRun, tests: list[TestOutcome]) -> TestRunResult:
+    """Собирает `TestRunResult` из исходов, которые записал плагин."""
+    counts = {outcome: 0 for outcome in ("passed", "failed", "error", "skipped", "xfailed", "xpassed")}
+    for t in tests:
+        counts[t.outcome] = counts.get(t.outcome, 0) + 1
+    passed = counts["passed"] + counts["xpassed"]
+    return TestRunResult(
+        tests_total=passed + counts["failed"] + counts["error"],
+        tests_passed=passed,
+        tests_failed=counts["failed"],
+        tests_errors=counts["error"],
+        tests_skipped=counts["skipped"],
+        tests_xfailed=counts["xfailed"],
+        tests=tests,
+        return_code=proc.returncode,
+        stdout=proc.stdout,
+        stderr=proc.stderr,
+    )
+
+
+def _trim_output(result: TestRunResult, output: OutputMode) -> TestRunResult:
+    """Урезает сырой вывод pytest согласно режиму `output`; кэш хранит полный вывод."""
+    if output == "full":
+        return result
+    if output == "none":
+        return result.model_copy(update={"stdout": "", "stderr": ""})
+    return result.model_copy(
+        update={"stdout": result.stdout[-OUTPUT_TAIL_CHARS:], "stderr": result.stderr[-OUTPUT_TAIL_CHARS:]}
+    )
+
+
+def _git_apply(ws: Workspace, diff: str) -> str | None:
     """
-    Копирует demo_app во временную директорию, последовательно применяет все диффы
-    (через git apply с fallback на patch), затем запускает pytest и возвращает метрики.
+    Применяет дифф через `git apply` с fallback на `patch -p0`. Возвращает None при успехе,
+    иначе — вывод обоих инструментов как причину отказа.
     """
-    work = Path(tempfile.mkdtemp(prefix="aw_demo_"))
+    proc = subprocess.run(["git", "apply", "-"], cwd=ws.root, input=diff, capture_output=True, text=True)
+    if proc.returncode == 0:
+        return None
+    fallback = subprocess.run(["patch", "-p0"], cwd=ws.root, input=diff, capture_output=True, text=True)
+    if fallback.returncode == 0:
+        return None
+    return f"git apply: {proc.stderr.strip()}; patch: {(fallback.stdout + fallback.stderr).strip()}"
+
+
+def _apply_diffs(ws: Workspace, diffs: list[str]) -> None:
+    """
+    Последовательно применяет диффы встроенным движком (`diffs.apply_patch`), откатываясь
+    на git apply/patch для патча, который движок не смог применить, и фиксируя каждый шаг.
+    Работа начинается с самого длинного закэшированного префикса стека, а снапшот
+    каждого нового префикса сохраняется в `PREFIXES`.
+    """
+    baseline = POOL.baseline
+    assert baseline is not None
+    keys = PrefixCache.keys(baseline, diffs)
+    start, sha = PREFIXES.longest(keys)
+    if sha is not None:
+        baseline.checkout(ws, sha)
+    size = sum(len(d) for d in diffs[:start])
+    for i in range(start, len(diffs)):
+        error: PatchError | None = None
+        applied = False
+        if PATCH_ENGINE == "python":
+            try:
+                apply_patch(ws.root, diffs[i], PATCH_FUZZ)
+                applied = True
+            except PatchError as exc:
+                error = exc
+        if not applied:
+            reason = _git_apply(ws, diffs[i])
+            if reason is not None:
+                raise RuntimeError(f"unable to apply patch #{i}: " + (f"{error}; " if error else "") + reason)
+        # Фиксируем состояние, чтобы стеки с общим более коротким префиксом тоже его переиспользовали
+        git(["add", "-A"], ws.root)
+        git(["commit", "-q", "--allow-empty", "-m", f"apply patch {i}"], ws.root)
+        size += len(diffs[i])
+        PREFIXES.store(baseline, keys[i], git(["rev-parse", "HEAD"], ws.root).stdout.strip(), size)
+
+
+def _import_graph(baseline: BaselineRepo) -> ImportGraph:
+    """Граф импортов baseline; строится при первом запросе и переиспользуется."""
+    with _GRAPHS_LOCK:
+        graph = _GRAPHS.get(baseline.tree)
+        if graph is None:
+            graph = _GRAPHS[baseline.tree] = ImportGraph.build(baseline.base, baseline.name)
+        return graph
+
+
+def _select_tests(ws: Workspace, diffs: list[str]) -> TestSelection:
+    """
+    Выбирает тесты, затронутые последним диффом стека. Граф baseline дополняется файлами,
+    которые меняет весь стек, прочитанными из рабочей копии после применения.
+    """
+    baseline = POOL.baseline
+    assert baseline is not None
+    last = changed_files(diffs[-1])
+    if last.full_reason:
+        return TestSelection(mode="all", reason=last.full_reason)
+    stack = set().union(*(changed_files(d).paths for d in diffs))
+    graph = _import_graph(baseline).updated(ws.root, stack)
+    selected = graph.impacted(last.paths)
+    project = PurePosixPath(baseline.name)
+    return TestSelection(
+        mode="impacted",
+        test_files=sorted(str(PurePosixPath(p).relative_to(project)) for p in selected),
+        tests_skipped=sum(n for p, n in graph.tests.items() if p not in selected),
+    )
+
+
+def _exec_pytest(ws: Workspace, executor: Executor, args: list[str]) -> PytestRun:
+    """Запускает `pytest <args>` в каталоге проекта рабочей копии выбранным исполнителем."""
+    # Корень пакета — последним, чтобы demo_app из рабочей копии не перекрывался исходным
+    sys_paths = [str(ws.root), str(ws.target), str(PACKAGE_ROOT)]
+    if executor == "forkserver":
+        return FORKSERVER.run(ws.target, sys_paths, args, PYTEST_TIMEOUT)
+    return run_subprocess(ws.target, sys_paths, args, PYTEST_TIMEOUT)
+
+
+def _read_results(path: Path) -> dict[str, Any] | None:
+    """JSON, который записал плагин результатов, или None, если pytest его не оставил."""
     try:
-        target = work / "demo_app"
-        shutil.copytree(DEMO_APP_DIR, target)
-        subprocess.run(["git", "init"], cwd=work, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        subprocess.run(["git", "add", "."], cwd=work, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        subprocess.run(["git", "commit", "-m", "baseline"], cwd=work, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-        for i, diff in enumerate(diffs):
-            patch_path = work / f"patch_{i}.diff"
-            patch_path.write_text(diff, encoding="utf-8")
-            rc = subprocess.run(["git", "apply", str(patch_path)], cwd=work).returncode
-            if rc != 0:
-                rc = subprocess.run(["patch", "-p0", "-i", str(patch_path)], cwd=work).returncode
-            if rc != 0:
-                raise RuntimeError(f"unable to apply patch #{i}")
-            # Фиксируем состояние, чтобы контекст следующих патчей был актуален
-            subprocess.run(["git", "add", "-A"], cwd=work, check=True)
-            subprocess.run(["git", "commit", "-m", f"apply patch {i}"], cwd=work, check=True)
-
-        proc = subprocess.run(
-            ["pytest", "-q"],
-            cwd=target,
-            capture_output=True,
-            text=True,
-            env={**os.environ, "PYTHONPATH": str(target)},
-            timeout=60,
-        )
-        total, passed, failed = _parse_pytest_summary(proc.stdout)
-        return TestRunResult(
-            tests_total=total,
-            tests_passed=passed,
-            tests_failed=failed,
-            return_code=proc.returncode,
-            stdout=proc.stdout,
-            stderr=proc.stderr,
-        )
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def _tail_progress(path: Path, on_event: OnEvent, poll: float = 0.1) -> Iterator[None]:
+    """
+    Пока идёт блок, читает в фоне строки, которые плагин дописывает в `path`, и отдаёт их
+    событиями `test`; после блока дочитывает файл до конца.
+    """
+    stop = threading.Event()
+
+    def _loop() -> None:
+        pos = 0
+        while True:
+            last = stop.is_set()
+            try:
+                with path.open("rb") as f:
+                    f.seek(pos)
+                    chunk = f.read()
+            except FileNotFoundError:
+                chunk = b""
+            # Недописанную строку оставляем до следующего чтения
+            complete = chunk[:chunk.rfind(b"\n") + 1]
+            pos += len(complete)
+            for line in complete.splitlines():
+                on_event({"event": "test", **json.loads(line)})
+            if last:
+                return
+            stop.wait(poll)
+
+    thread = threading.Thread(target=_loop, name="aw-progress", daemon=True)
+    thread.start()
+    try:
+        yield
     finally:
-        shutil.rmtree(work, ignore_errors=True)
+        stop.set()
+        thread.join()
+
+
+def _pytest_once(
+    ws: Workspace, executor: Executor, extra: list[str], results: Path, on_event: OnEvent | None = None,
+) -> TestRunResult:
+    """
+    Один процесс pytest с плагином результатов; `extra` — пути или nodeid тестов.
+    Если плагин не оставил файл (pytest упал до конца сессии), метрики берутся из stdout.
+    С `on_event` исходы тестов отдаются событиями по мере завершения.
+    """
+    args = [*PYTEST_ARGS[1:], "-p", RESULTS_PLUGIN, f"--aw-results={results}", *extra]
+    if on_event is None:
+        proc = _exec_pytest(ws, executor, args)
+    else:
+        progress = results.with_suffix(".progress")
+        with _tail_progress(progress, on_event):
+            proc = _exec_pytest(ws, executor, [*args, f"--aw-progress={progress}"])
+    data = _read_results(results)
+    if data is not None and "tests" in data:
+        return _result_from_outcomes(proc, [TestOutcome.model_validate(t) for t in data["tests"]])
+    total, passed, failed = _parse_pytest_summary(proc.stdout)
+    return TestRunResult(
+        tests_total=total,
+        tests_passed=passed,
+        tests_failed=failed,
+        return_code=proc.returncode,
+        stdout=proc.stdout,
+        stderr=proc.stderr,
+    )
+
+
+def _collect(ws: Workspace, executor: Executor, paths: list[str], results: Path) -> list[str] | None:
+    """nodeid собранных тестов; None, если сбор не удался (тогда прогон идёт одним процессом)."""
+    _exec_pytest(ws, executor, ["--collect-only", "-q", "-p", RESULTS_PLUGIN, f"--aw-results={results}", *paths])
+    data = _read_results(results)
+    if data is None or any(t.get("outcome") == "error" for t in data.get("tests", [])):
+        return None
+    return data.get("collected")
+
+
+def _merge_shards(parts: list[TestRunResult]) -> TestRunResult:
+    """Сводит результаты шардов в один: суммы счётчиков, все исходы и вывод с заголовками шардов."""
+    n = len(parts)
+    return TestRunResult(
+        tests_total=sum(r.tests_total for r in parts),
+        tests_passed=sum(r.tests_passed for r in parts),
+        tests_failed=sum(r.tests_failed for r in parts),
+        tests_errors=sum(r.tests_errors for r in parts),
+        tests_skipped=sum(r.tests_skipped for r in parts),
+        tests_xfailed=sum(r.tests_xfailed for r in parts),
+        tests=[t for r in parts for t in r.tests],
+        return_code=max(r.return_code for r in parts),
+        stdout="".join(f"===== shard {i + 1}/{n} =====\n{r.stdout}" for i, r in enumerate(parts)),
+        stderr="".join(f"===== shard {i + 1}/{n} =====\n{r.stderr}" for i, r in enumerate(parts) if r.stderr),
+        shards=n,
+    )
+
+
+def _run_pytest(
+    ws: Workspace, executor: Executor, paths: list[str] | None = None, shards: int = 1,
+    timings: dict[str, float] | None = None, on_event: OnEvent | None = None,
+) -> TestRunResult:
+    """
+    Запускает pytest в рабочей копии и собирает исходы через плагин; `paths` ограничивает
+    прогон этими файлами (относительно проекта).
+
+    При `shards > 1` тесты сначала собираются (`--collect-only`), раскладываются по шардам
+    с учётом прошлых длительностей и выполняются параллельными процессами pytest в той же
+    рабочей копии; у каждого шарда свой таймаут `PYTEST_TIMEOUT`.
+    """
+    paths = paths or []
+    timings = {} if timings is None else timings
+    with tempfile.TemporaryDirectory(prefix="aw_results_") as tmp:
+        tmpdir = Path(tmp)
+        nodeids = None
+        if shards > 1:
+            with stage(timings, "collect"):
+                nodeids = _collect(ws, executor, paths, tmpdir / "collected.json")
+        if not nodeids or len(nodeids) < 2:
+            result = _pytest_once(ws, executor, paths, tmpdir / "results.json", on_event)
+        else:
+            futures = []
+            for i, shard in enumerate(plan_shards(nodeids, DURATIONS.estimate(nodeids), shards)):
+                # nodeid передаются файлом `@args`: их может быть больше, чем влезет в командную строку
+                args = tmpdir / f"shard_{i}.args"
+                args.write_text("\n".join(shard) + "\n", encoding="utf-8")
+                # Шарды делят каталог проекта: кэш pytest между ними не пишется
+                extra = ["-p", "no:cacheprovider", f"@{args}"]
+                futures.append(SHARD_POOL.submit(_pytest_once, ws, executor, extra, tmpdir / f"shard_{i}.json", on_event))
+            result = _merge_shards([f.result() for f in futures])
+    DURATIONS.update((t.nodeid, t.duration) for t in result.tests if t.duration > 0)
+    return result
+
+
+def run_tests_on_diffs(
+    diffs: list[str],
+    executor: Executor | None = None,
+    output: OutputMode = "full",
+    select: TestSelect = "all",
+    shards: int | None = None,
+    on_event: OnEvent | None = None,
+) -> TestRunResult:
+    """
+    Берёт чистую рабочую копию demo_app из пула, последовательно применяет все диффы
+    (через git apply с fallback на patch), затем запускает pytest и возвращает метрики.
+
+    Результат кэшируется по хешу дерева baseline, упорядоченного списка диффов и
+    команды pytest; повторный запрос того же набора возвращается с `cached=True`.
+    `executor` выбирает способ запуска pytest (по умолчанию — `TESTER_EXECUTOR`),
+    `output` — сколько сырого stdout/stderr вернуть. Длительности этапов возвращаются
+    в `timings` и наблюдаются гистограммами `/metrics`.
+
+    `select="impacted"` запускает только тесты, затронутые последним диффом (для
+    промежуточных проб); если выбор невозможен или полный результат уже в кэше,
+    возвращается полный прогон. Что именно запускалось, сообщает `selection`.
+    `shards` делит pytest на параллельные процессы (по умолчанию `TESTER_SHARDS`,
+    не больше `TESTER_MAX_SHARDS`). `on_event` получает события этапов и тестов по ходу
+    прогона (см. `OnEvent`); у ответа из кэша событий нет.
+    """
+    POOL.start()
+    assert POOL.baseline is not None
+    # Движок и fuzz решают, применятся ли диффы и как, поэтому входят в ключ наравне с командой pytest
+    settings = [*PYTEST_ARGS, RESULTS_PLUGIN, f"patch_engine={PATCH_ENGINE}", f"patch_fuzz={PATCH_FUZZ}"]
+    keys = {"all": content_key(POOL.baseline.tree, diffs, settings)}
+    if select == "impacted" and diffs:
+        keys["impacted"] = content_key(POOL.baseline.tree, diffs, [*settings, "select=impacted"])
+    for key in keys.values():
+        hit = RESULTS.get(key)
+        if hit is not None:
+            return _trim_output(TestRunResult.model_validate({**hit, "cached": True, "timings": {}}), output)
+
+    executor = executor or EXECUTOR
+    timings: dict[str, float] = {}
+
+    def _stage_done(name: str) -> None:
+        if on_event is not None:
+            on_event({"event": "stage", "stage": name, "seconds": timings[name]})
+
+    started = time.monotonic()
+    with POOL.acquire() as ws:
+        timings["workspace"] = WORKSPACE_SECONDS.observe(time.monotonic() - started)
+        _stage_done("workspace")
+        started = time.monotonic()
+        _apply_diffs(ws, diffs)
+        timings["apply"] = APPLY_SECONDS.observe(time.monotonic() - started)
+        _stage_done("apply")
+        selection = TestSelection()
+        if "impacted" in keys:
+            with stage(timings, "select"):
+                selection = _select_tests(ws, diffs)
+            _stage_done("select")
+        if selection.mode == "impacted" and not selection.test_files:
+            # Последний дифф не затрагивает ни одного теста: pytest не нужен
+            result = TestRunResult(tests_total=0, tests_passed=0, tests_failed=0, return_code=0, stdout="", stderr="")
+        else:
+            started = time.monotonic()
+            n = min(shards or SHARDS, MAX_SHARDS)
+            result = _run_pytest(ws, executor, selection.test_files, n, timings, on_event)
+            timings["pytest"] = PYTEST_SECONDS.observe(time.monotonic() - started, executor=executor)
+            _stage_done("pytest")
+    result.timings = timings
+    result.selection = selection
+    RESULTS.set(keys[selection.mode], result.model_dump())
+    return _trim_output(result, output)
+
+
+@app.get("/pool")
+def pool_stats() -> dict[str, int]:
+    """Состояние пула рабочих копий: размер, готовые/занятые копии, hits/misses."""
+    return POOL.stats()
+
+
+@app.get("/prefixes")
+def prefix_stats() -> dict[str, int]:
+    """Состояние кэша снапшотов префиксов: записи, бюджет, hits/misses."""
+    return PREFIXES.stats()
+
+
+@app.get("/cache")
+def cache_stats() -> dict[str, int]:
+    """Состояние кэша результатов: записи, hits/misses."""
+    return RESULTS.stats()
+
+
+async def _testrun_events(req: TestRunRequest, diffs: list[str]) -> AsyncIterator[str]:
+    """
+    NDJSON-поток прогона: события этапов и тестов по мере появления, затем строка
+    `{"event": "result", "result": ...}` или `{"event": "error", "detail": ...}`.
+    """
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue()
+
+    def _emit(event: dict[str, Any] | None) -> None:
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def _job() -> None:
+        try:
+            result = run_tests_on_diffs(diffs, req.executor, req.output, req.select, req.shards, _emit)
+            _emit({"event": "result", "result": result.model_dump()})
+        except Exception as exc:  # noqa: BLE001
+            _emit({"event": "error", "detail": str(exc) or type(exc).__name__})
+        finally:
+            _emit(None)
+
+    job = loop.run_in_executor(None, _job)
+    while (event := await events.get()) is not None:
+        yield json.dumps(event, ensure_ascii=False) + "\n"
+    await job
 
 
 @app.post("/testrun", response_model=TestRunResult)
-def testrun(req: TestRunRequest) -> TestRunResult:
-    """HTTP‑обёртка поверх `run_tests_on_diffs`."""
+def testrun(req: TestRunRequest, response: Response, stream: bool = False):
+    """
+    HTTP‑обёртка поверх `run_tests_on_diffs`; заголовок `X-AW-Cache` сообщает hit/miss.
+    Присланные тексты диффов запоминаются в хранилище, чтобы дальше на них можно было ссылаться.
+    С `?stream=true` отдаёт NDJSON: этапы и исходы тестов по мере прогона, затем результат.
+    """
     try:
-        return run_tests_on_diffs(req.normalized_diffs())
+        diffs = req.normalized_diffs(DIFFS)
+        if not req.diff_refs:
+            DIFFS.put(diffs)
+        if stream:
+            return StreamingResponse(_testrun_events(req, diffs), media_type="application/x-ndjson")
+        result = run_tests_on_diffs(diffs, req.executor, req.output, req.select, req.shards)
+    except MissingDiffs:
+        raise
     except Exception as exc:  # noqa: BLE001
         raise HTTPException(status_code=400, detail=str(exc))
+    response.headers["X-AW-Cache"] = "hit" if result.cached else "miss"
+    return result
+
+
+async def _run_batch_item(
+    index: int,
+    diffs: list[str],
+    executor: Executor | None,
+    output: OutputMode,
+    select: TestSelect,
+    shards: int | None,
+) -> TestBatchItem:
+    """Прогоняет один стек пакета в `BATCH_POOL`, превращая ошибку в поле `error`."""
+    submitted = time.monotonic()
+
+    def _job() -> TestRunResult:
+        QUEUE_WAIT_SECONDS.observe(time.monotonic() - submitted)
+        return run_tests_on_diffs(diffs, executor, output, select, shards)
+
+    try:
+        result = await asyncio.wrap_future(BATCH_POOL.submit(_job))
+        return TestBatchItem(index=index, result=result)
+    except Exception as exc:  # noqa: BLE001
+        return TestBatchItem(index=index, error=str(exc) or type(exc).__name__)
+
+
+@app.post("/testrun/batch", response_model=TestBatchResult)
+async def testrun_batch(req: TestBatchRequest, stream: bool = False):
+    """
+    Тестирует пакет независимых стеков параллельно на ограниченном пуле воркеров.
+    Без `stream` возвращает результаты в порядке входа; с `?stream=true` отдаёт NDJSON,
+    по строке `TestBatchItem` на стек в порядке завершения.
+    """
+    stacks = req.stacks
+    if req.stack_refs:
+        found = iter(DIFFS.resolve([ref for stack in req.stack_refs for ref in stack]))
+        stacks = [[next(found) for _ in stack] for stack in req.stack_refs]
+    else:
+        DIFFS.put(diff for stack in stacks for diff in stack)
+    if not stacks or any(not stack for stack in stacks):
+        raise HTTPException(status_code=400, detail="every stack must contain at least one diff")
+    tasks = [
+        asyncio.ensure_future(_run_batch_item(i, stack, req.executor, req.output, req.select, req.shards))
+        for i, stack in enumerate(stacks)
+    ]
+    if not stream:
+        return TestBatchResult(results=await asyncio.gather(*tasks))
+
+    async def _lines() -> AsyncIterator[str]:
+        for fut in asyncio.as_completed(tasks):
+            item = await fut
+            yield json.dumps(item.model_dump(), ensure_ascii=False) + "\n"
+
+    return StreamingResponse(_lines(), media_type="application/x-ndjson")
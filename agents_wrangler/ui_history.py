@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import dataclasses
+import json
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Literal
+
+from pydantic import TypeAdapter
+
+from agents_wrangler.cache import DiskCache, content_key
+from agents_wrangler.orchestrator import BestOfNResult, MultiBridgeResult
+
+# Состояние Streamlit-UI без самого Streamlit: история запусков сессии (Streamlit
+# перезапускает скрипт при каждом действии, и без неё результат пропадал бы),
+# дисковый кэш результатов по задаче, URL и параметрам и усечённые превью диффов,
+# чтобы страница с десятками многомегабайтных диффов оставалась отзывчивой.
+
+# Сколько последних запусков держит история одной сессии
+UI_HISTORY = int(os.environ.get("AW_UI_HISTORY", "10"))
+UI_CACHE_DIR = Path(os.environ.get("AW_UI_CACHE_DIR", Path.home() / ".agents_wrangler" / "ui_cache"))
+UI_CACHE_TTL = float(os.environ.get("AW_UI_CACHE_TTL", str(7 * 24 * 3600)))
+UI_CACHE_MAX = int(os.environ.get("AW_UI_CACHE_MAX", "200"))
+# Символов диффа в превью; целиком дифф доступен через кнопку скачивания
+DIFF_PREVIEW_CHARS = int(os.environ.get("AW_UI_DIFF_PREVIEW", "20000"))
+
+RunKind = Literal["bridge", "multi"]
+"""Какой мост запускался: best-of-N или мультиагентный конвейер."""
+
+_RESULT_TYPES: dict[str, Any] = {"bridge": BestOfNResult, "multi": MultiBridgeResult}
+
+
+@dataclass
+class HistoryEntry:
+    """Запуск в истории сессии: ключ параметров, подпись для выбора и результат моста."""
+    key: str
+    kind: RunKind
+    label: str
+    result: Any
+    cached: bool = False
+    created: float = dataclasses.field(default_factory=time.time)
+
+
+def run_key(kind: RunKind, params: dict[str, Any]) -> str:
+    """Ключ запуска: вид моста и все его параметры (задача, URL, числа и флаги)."""
+    return content_key(kind, json.dumps(params, sort_keys=True, ensure_ascii=False))
+
+
+def remember(history: list[HistoryEntry], entry: HistoryEntry, limit: int = UI_HISTORY) -> None:
+    """Ставит запуск в начало истории, убирая прежний с тем же ключом и лишние сверх `limit`."""
+    history[:] = [entry] + [e for e in history if e.key != entry.key][: max(0, limit - 1)]
+
+
+def result_cache(root: Path = UI_CACHE_DIR) -> DiskCache:
+    """Дисковый кэш результатов UI."""
+    return DiskCache(root, UI_CACHE_MAX, UI_CACHE_TTL)
+
+
+def dump_run(entry: HistoryEntry) -> dict[str, Any]:
+    """Запуск в JSON-совместимый словарь для `DiskCache`."""
+    return {
+        "kind": entry.kind,
+        "label": entry.label,
+        "created": entry.created,
+        "result": TypeAdapter(_RESULT_TYPES[entry.kind]).dump_python(entry.result, mode="json"),
+    }
+
+
+def load_run(key: str, value: dict[str, Any]) -> HistoryEntry:
+    """Запуск из словаря `dump_run`; помечается как взятый из кэша."""
+    result = TypeAdapter(_RESULT_TYPES[value["kind"]]).validate_python(value["result"])
+    return HistoryEntry(key, value["kind"], value["label"], result, cached=True, created=value["created"])
+
+
+def diff_preview(diff: str, limit: int = DIFF_PREVIEW_CHARS) -> tuple[str, bool]:
+    """Начало диффа не длиннее `limit` символов (по границе строки) и признак усечения."""
+    if len(diff) <= limit:
+        return diff, False
+    cut = diff.rfind("\n", 0, limit)
+    return diff[: cut + 1 if cut > 0 else limit], True
+
+
+def diff_summary(diff: str) -> str:
+    """Размер диффа для заголовков: строки и килобайты."""
+    lines = diff.count("\n")
+    return f"{lines} lines, {len(diff.encode('utf-8', 'surrogateescape')) / 1024:.1f} KB"
@@ -2,19 +2,38 @@ from __future__ import annotations
 
 import json
 import textwrap
-from typing import Iterable
+import time
+from typing import Any, Callable, Iterable
 
 import httpx
 import streamlit as st
 
+from agents_wrangler.builder_pool import BuilderPool
 from agents_wrangler.orchestrator import (
+    BestOfNResult,
+    BridgeEvent,
+    MultiBridgeResult,
+    TestRunResult,
     bridge_best_of_n,
     bridge_multi,
     codex_plan,
     codex_review,
     codex_implement,
+    iter_bridge_events,
     tester_run,
 )
+from agents_wrangler.ui_history import (
+    UI_CACHE_DIR,
+    HistoryEntry,
+    RunKind,
+    diff_preview,
+    diff_summary,
+    dump_run,
+    load_run,
+    remember,
+    result_cache,
+    run_key,
+)
 
 
 def _parse_urls(s: str) -> list[str]:
@@ -22,10 +41,205 @@ def _parse_urls(s: str) -> list[str]:
     return [u.strip() for u in s.splitlines() if u.strip()]
 
 
-def _show_diff(title: str, diff: str) -> None:
-    """Показывает unified diff в виде кода."""
-    st.markdown(f"**{title}**")
-    st.code(diff, language="diff")
+@st.cache_resource
+def _builder_pool(urls: tuple[str, ...]) -> BuilderPool:
+    """Пул билдеров живёт между запусками, чтобы накопленная статистика задержек и сбоев не терялась."""
+    return BuilderPool(list(urls))
+
+
+def _show_diff(title: str, diff: str, key: str, expanded: bool = False) -> None:
+    """
+    Unified diff в свёрнутом блоке: на страницу уходит только превью ограниченного
+    размера, целиком дифф отдаётся кнопкой скачивания.
+    """
+    with st.expander(f"{title} — {diff_summary(diff)}", expanded=expanded):
+        preview, truncated = diff_preview(diff)
+        st.code(preview, language="diff")
+        if truncated:
+            st.caption(f"Preview: first {len(preview)} of {len(diff)} characters — download for the full diff.")
+        st.download_button("Download diff", diff, file_name=f"{key}.diff", mime="text/x-diff", key=f"{key}-download")
+
+
+def _show_timings(title: str, rows: list[dict[str, float]]) -> None:
+    """Таблица длительностей этапов (секунды) в свёрнутом блоке."""
+    with st.expander(title):
+        st.dataframe([{k: round(v, 3) for k, v in row.items()} for row in rows], use_container_width=True)
+
+
+def _show_request_stats(stats: dict[str, float]) -> None:
+    """Повторы, хеджи и лишняя работа запросов к билдерам одной строкой."""
+    if stats:
+        st.caption("Builder requests — " + ", ".join(f"{k}: {round(v, 3)}" for k, v in stats.items()))
+
+
+def _counts(tr: TestRunResult) -> str:
+    return f"passed: {tr.tests_passed}, failed: {tr.tests_failed}, errors: {tr.tests_errors}"
+
+
+class _LiveView:
+    """
+    Ход моста по событиям `BridgeEvent`: карточка на каждого базового кандидата
+    (обновляется, как только дифф получен и протестирован) и журнал этапов конвейера.
+    """
+
+    def __init__(self, candidates: int) -> None:
+        self.log = st.empty()
+        self.lines: list[str] = []
+        self.slots = [st.empty() for _ in range(candidates)]
+        self.diffs: dict[int, str] = {}
+
+    def _note(self, line: str) -> None:
+        self.lines.append(line)
+        self.log.markdown("\n".join(f"- {line}" for line in self.lines))
+
+    def _card(self, i: int, header: str) -> None:
+        with self.slots[i].container():
+            st.markdown(header)
+            with st.expander(diff_summary(self.diffs[i])):
+                st.code(diff_preview(self.diffs[i])[0], language="diff")
+
+    def update(self, event: BridgeEvent) -> None:
+        d = event.data
+        if event.event == "candidate_started":
+            self.slots[d["index"]].info(f"Candidate #{d['index']}: generating…")
+        elif event.event == "diff_received":
+            self.diffs[d["index"]] = d["diff"]
+            self._card(d["index"], f"⏳ **Candidate #{d['index']}** — testing…")
+        elif event.event == "candidate_tested":
+            tr = TestRunResult.model_validate(d["result"])
+            mark = "✅" if tr.failures == 0 else "❌"
+            self._card(d["index"], f"{mark} **Candidate #{d['index']}** — {_counts(tr)}")
+        elif event.event == "winner":
+            self._note(f"Winner: Candidate #{d['index']}")
+        elif event.event == "plan":
+            self._note(f"Plan: {len(d['components'])} component(s)")
+        elif event.event in ("baseline_tested", "final_tested"):
+            title = "Baseline" if event.event == "baseline_tested" else "Final stack"
+            self._note(f"{title} tests — {_counts(TestRunResult.model_validate(d['result']))}")
+        elif event.event == "specialist_started":
+            self._note(f"Specialist #{d['index']}: generating…")
+        elif event.event == "specialist_tested":
+            outcome = "does not apply on top of accepted diffs" if d["result"] is None else (
+                f"tested — {_counts(TestRunResult.model_validate(d['result']))}"
+            )
+            self._note(f"Specialist #{d['index']}: {outcome}")
+        elif event.event == "specialist_accepted":
+            self._note(f"Specialist #{d['index']}: accepted")
+        elif event.event == "review":
+            self._note(f"Review score: {d['score']}")
+
+    def clear(self) -> None:
+        for slot in [self.log, *self.slots]:
+            slot.empty()
+
+
+def _run_live(view: _LiveView, bridge, *args, **kwargs):  # type: ignore[no-untyped-def]
+    """Выполняет мост, обновляя `view` по его событиям; возвращает результат моста."""
+    for event in iter_bridge_events(bridge, *args, **kwargs):
+        if event.event == "done":
+            view.clear()
+            return event.result
+        view.update(event)
+
+
+def _execute(
+    history: list[HistoryEntry],
+    kind: RunKind,
+    params: dict[str, Any],
+    use_cache: bool,
+    run: Callable[[httpx.Client, _LiveView], Any],
+) -> None:
+    """
+    Запускает мост (или берёт результат из дискового кэша по тем же параметрам),
+    кладёт его в историю сессии и делает выбранным.
+    """
+    key = run_key(kind, params)
+    cache = result_cache() if use_cache else None
+    value = cache.get(key) if cache is not None else None
+    if value is not None:
+        entry = load_run(key, value)
+    else:
+        with httpx.Client() as client:
+            result = run(client, _LiveView(params["builders"]))
+        title = "Best-of-N" if kind == "bridge" else "Multi-agent"
+        entry = HistoryEntry(key, kind, f"{title} · {params['task'][:40]} · {time.strftime('%H:%M:%S')}", result)
+        if cache is not None:
+            cache.set(key, dump_run(entry))
+    remember(history, entry)
+    st.session_state["aw_selected"] = key
+
+
+def _show_candidates(res: BestOfNResult, prefix: str) -> None:
+    """
+    Сводная таблица кандидатов и дифф одного выбранного: при 32 кандидатах
+    на страницу не уходят все диффы сразу.
+    """
+    rows = []
+    for i, (d, tr) in enumerate(zip(res.candidate_diffs, res.candidate_tests)):
+        mark = "✅" if i == res.winner_index and tr.failures == 0 else ("⚠️" if tr.failures == 0 else "❌")
+        rows.append({
+            "candidate": i, "status": mark, "passed": tr.tests_passed, "failed": tr.tests_failed,
+            "errors": tr.tests_errors, "diff": diff_summary(d),
+        })
+    if not rows:
+        return
+    st.dataframe(rows, use_container_width=True, hide_index=True)
+    i = st.selectbox(
+        "Candidate diff", range(len(rows)), index=res.winner_index,
+        format_func=lambda i: f"Candidate #{i}", key=f"{prefix}-candidate",
+    )
+    _show_diff(f"Candidate #{i} diff", res.candidate_diffs[i], key=f"{prefix}-candidate-{i}", expanded=True)
+
+
+def _show_best_of_n(res: BestOfNResult, prefix: str) -> None:
+    st.subheader("Best‑of‑N Result")
+    _show_candidates(res, prefix)
+    st.success(f"Winner: Candidate #{res.winner_index}")
+    if res.duplicate_groups:
+        st.caption(f"Equivalent candidates (tested once): {res.duplicate_groups}")
+    st.caption(f"Trace ID: {res.trace_id}")
+    _show_request_stats(res.request_stats)
+    _show_timings("Candidate timings", res.candidate_timings)
+
+
+def _show_multi(res: MultiBridgeResult, prefix: str) -> None:
+    st.subheader("Plan")
+    st.json(res.plan.model_dump())
+
+    st.subheader("Base Best‑of‑N")
+    _show_candidates(res.base, prefix)
+    st.success(f"Base winner: Candidate #{res.base.winner_index}")
+
+    st.subheader("Accepted Diffs (after specialists)")
+    for i, d in enumerate(res.accepted_diffs):
+        _show_diff(f"Accepted #{i}", d, key=f"{prefix}-accepted-{i}")
+
+    st.subheader("Final Tests")
+    st.json(res.final_tests.model_dump())
+
+    st.subheader("Final Review")
+    st.json(res.review.model_dump())
+
+    st.caption(f"Trace ID: {res.trace_id}")
+    _show_request_stats(res.request_stats)
+    _show_timings("Bridge timings", [res.timings])
+    _show_timings("Candidate timings", res.base.candidate_timings)
+    if res.specialist_timings:
+        _show_timings("Specialist timings", res.specialist_timings)
+
+
+def _show_history(history: list[HistoryEntry]) -> None:
+    """Выбор запуска из истории сессии и его результат; переключение не перезапускает мост."""
+    labels = {e.key: e.label + (" (cached)" if e.cached else "") for e in history}
+    if st.session_state.get("aw_selected") not in labels:
+        st.session_state["aw_selected"] = history[0].key
+    key = st.selectbox("Run history", list(labels), format_func=labels.__getitem__, key="aw_selected")
+    entry = next(e for e in history if e.key == key)
+    prefix = key[:12]
+    if entry.kind == "bridge":
+        _show_best_of_n(entry.result, prefix)
+    else:
+        _show_multi(entry.result, prefix)
 
 
 def main() -> None:
@@ -55,56 +269,64 @@ def main() -> None:
         task = st.text_area("Task", value="Fix add() to return a + b", height=100)
         builders = st.number_input("Builders (for base best-of-N)", min_value=1, max_value=32, value=min(3, max(1, len(builder_urls))))
         specialists = st.number_input("Specialists per component", min_value=0, max_value=8, value=2)
+        speculative = st.checkbox("Run specialists in parallel (speculative)", value=False)
+        impacted = st.checkbox("Specialist trials run only impacted tests", value=False)
+
+        st.header("Results")
+        use_cache = st.checkbox(
+            "Reuse cached results", value=False,
+            help=f"Runs with the same task, URLs and parameters are loaded from {UI_CACHE_DIR}.",
+        )
+
+        if builder_urls:
+            with st.expander("Builder pool"):
+                st.dataframe(_builder_pool(tuple(builder_urls)).stats(), use_container_width=True)
 
+    history: list[HistoryEntry] = st.session_state.setdefault("aw_history", [])
     col1, col2 = st.columns(2)
 
     if col1.button("Run best-of‑N (Builders only)", use_container_width=True):
-        with st.spinner("Running best-of‑N..."):
-            with httpx.Client() as client:
-                chosen_urls = builder_urls[: int(builders)] if builder_urls else []
-                result = bridge_best_of_n(client, task, chosen_urls, tester_url)
-        st.subheader("Best‑of‑N Result")
-        for i, (d, tr) in enumerate(zip(result.candidate_diffs, result.candidate_tests)):
-            mark = "✅" if i == result.winner_index and tr.tests_failed == 0 else ("⚠️" if tr.tests_failed == 0 else "❌")
-            st.markdown(f"{mark} **Candidate #{i}** — passed: {tr.tests_passed}, failed: {tr.tests_failed}")
-            _show_diff(f"Candidate #{i} diff", d)
-        st.success(f"Winner: Candidate #{result.winner_index}")
+        if not builder_urls:
+            st.error("Provide at least one builder URL.")
+            return
+        params = {"task": task, "builder_urls": builder_urls, "tester_url": tester_url, "builders": int(builders)}
+        _execute(history, "bridge", params, use_cache, lambda client, view: _run_live(
+            view, bridge_best_of_n, client, task, _builder_pool(tuple(builder_urls)), tester_url,
+            candidates=int(builders),
+        ))
 
     if col2.button("Run Multi‑Agent Pipeline", type="primary", use_container_width=True):
         if not plan_urls or not builder_urls or not review_urls:
             st.error("Provide at least one URL for each role (architect, builders, reviewer).")
         else:
-            with st.spinner("Running multi‑agent pipeline..."):
-                with httpx.Client() as client:
-                    res = bridge_multi(
-                        client=client,
-                        task=task,
-                        plan_urls=plan_urls,
-                        builder_urls=builder_urls[: int(builders)] if builder_urls else [],
-                        review_urls=review_urls,
-                        tester_url=tester_url,
-                        specialists_per_component=int(specialists),
-                    )
-            st.subheader("Plan")
-            st.json(res.plan.model_dump())
-
-            st.subheader("Base Best‑of‑N")
-            for i, (d, tr) in enumerate(zip(res.base.candidate_diffs, res.base.candidate_tests)):
-                mark = "✅" if i == res.base.winner_index and tr.tests_failed == 0 else ("⚠️" if tr.tests_failed == 0 else "❌")
-                st.markdown(f"{mark} **Candidate #{i}** — passed: {tr.tests_passed}, failed: {tr.tests_failed}")
-                _show_diff(f"Candidate #{i} diff", d)
-            st.success(f"Base winner: Candidate #{res.base.winner_index}")
-
-            st.subheader("Accepted Diffs (after specialists)")
-            for i, d in enumerate(res.accepted_diffs):
-                _show_diff(f"Accepted #{i}", d)
-
-            st.subheader("Final Tests")
-            st.json(res.final_tests.model_dump())
-
-            st.subheader("Final Review")
-            st.json(res.review.model_dump())
+            params = {
+                "task": task,
+                "plan_urls": plan_urls,
+                "builder_urls": builder_urls,
+                "review_urls": review_urls,
+                "tester_url": tester_url,
+                "builders": int(builders),
+                "specialists": int(specialists),
+                "speculative": speculative,
+                "impacted": impacted,
+            }
+            _execute(history, "multi", params, use_cache, lambda client, view: _run_live(
+                view,
+                bridge_multi,
+                client=client,
+                task=task,
+                plan_urls=plan_urls,
+                builder_urls=_builder_pool(tuple(builder_urls)),
+                candidates=int(builders),
+                specialist_mode="speculative" if speculative else "incremental",
+                test_select="impacted" if impacted else "all",
+                review_urls=review_urls,
+                tester_url=tester_url,
+                specialists_per_component=int(specialists),
+            ))
 
+    if history:
+        _show_history(history)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import hashlib
+import itertools
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+# Коммиты делаются от служебного имени: в контейнерах git identity обычно не настроен
+GIT_ENV = {
+    **os.environ,
+    "GIT_AUTHOR_NAME": "agents-wrangler",
+    "GIT_AUTHOR_EMAIL": "agents-wrangler@localhost",
+    "GIT_COMMITTER_NAME": "agents-wrangler",
+    "GIT_COMMITTER_EMAIL": "agents-wrangler@localhost",
+}
+
+
+def git(args: list[str], cwd: Path, input: str | None = None) -> subprocess.CompletedProcess:
+    """Запускает git с тихим выводом и служебной identity; бросает исключение при ошибке."""
+    return subprocess.run(
+        ["git", *args], cwd=cwd, input=input, capture_output=True, text=True, check=True, env=GIT_ENV,
+    )
+
+
+def set_readonly(path: Path, readonly: bool) -> None:
+    """Снимает (или возвращает) права записи со всех файлов и каталогов дерева `path`."""
+    for p in [path, *path.rglob("*")]:
+        if p.is_symlink():
+            continue
+        mode = p.stat().st_mode
+        p.chmod(mode & ~0o222 if readonly else mode | 0o200)
+
+
+@dataclass
+class Workspace:
+    """Рабочая копия baseline: `root` — корень git worktree, `target` — каталог проекта внутри."""
+    root: Path
+    target: Path
+
+
+class BaselineRepo:
+    """
+    Git-репозиторий с baseline-коммитом проекта, который строится один раз.
+    Рабочие копии создаются через `git worktree` и разделяют с ним хранилище объектов.
+    """
+
+    def __init__(self, source: Path, root: Path, name: str | None = None) -> None:
+        self.source = source
+        self.root = root
+        self.name = name or source.name
+        self.base = root / "base"
+        self.sha = ""
+        self.tree = ""
+        self._seq = itertools.count()
+
+    def build(self) -> None:
+        """Копирует проект в `base/` и фиксирует baseline-коммит."""
+        shutil.copytree(self.source, self.base / self.name)
+        git(["init", "-q"], self.base)
+        git(["add", "."], self.base)
+        git(["commit", "-q", "-m", "baseline"], self.base)
+        self.sha = git(["rev-parse", "HEAD"], self.base).stdout.strip()
+        # Хеш дерева зависит только от содержимого и одинаков между рестартами
+        self.tree = git(["rev-parse", "HEAD^{tree}"], self.base).stdout.strip()
+
+    def add_worktree(self) -> Workspace:
+        """Создаёт новую рабочую копию на baseline-коммите."""
+        path = self.root / f"ws_{next(self._seq)}"
+        git(["worktree", "add", "-q", "--detach", str(path), self.sha], self.base)
+        return Workspace(root=path, target=path / self.name)
+
+    def reset(self, ws: Workspace, sha: str | None = None) -> None:
+        """Возвращает рабочую копию к baseline (или к `sha`) и удаляет всё неотслеживаемое."""
+        git(["reset", "-q", "--hard", sha or self.sha], ws.root)
+        git(["clean", "-qfdx"], ws.root)
+
+    def checkout(self, ws: Workspace, sha: str) -> None:
+        """Переводит чистую рабочую копию на коммит `sha` (например, снапшот префикса)."""
+        git(["reset", "-q", "--hard", sha], ws.root)
+
+    def remove_worktree(self, ws: Workspace) -> None:
+        """Удаляет рабочую копию вместе с её записью в репозитории."""
+        try:
+            git(["worktree", "remove", "--force", str(ws.root)], self.base)
+        except subprocess.CalledProcessError:
+            shutil.rmtree(ws.root, ignore_errors=True)
+            git(["worktree", "prune"], self.base)
+
+
+class WorkspacePool:
+    """
+    Пул заранее подготовленных чистых рабочих копий baseline.
+
+    `acquire()` выдаёт готовую копию (hit) или создаёт новую на месте (miss);
+    после использования копия сбрасывается в фоне и возвращается в пул.
+    """
+
+    def __init__(self, source: Path, size: int, root: Path | None = None) -> None:
+        self.size = size
+        self._root = root
+        self._source = source
+        self.baseline: BaselineRepo | None = None
+        self._ready: deque[Workspace] = deque()
+        self._lock = threading.Lock()
+        self._resetter = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aw-ws-reset")
+        self.hits = 0
+        self.misses = 0
+        self.in_use = 0
+
+    def start(self) -> None:
+        """Строит baseline и заполняет пул; повторный вызов ничего не делает."""
+        with self._lock:
+            if self.baseline is not None:
+                return
+            root = self._root or Path(tempfile.mkdtemp(prefix="aw_pool_"))
+            root.mkdir(parents=True, exist_ok=True)
+            baseline = BaselineRepo(self._source, root)
+            baseline.build()
+            for _ in range(self.size):
+                self._ready.append(baseline.add_worktree())
+            self.baseline = baseline
+
+    def close(self) -> None:
+        """Останавливает фоновый сброс и удаляет все каталоги пула."""
+        self._resetter.shutdown(wait=True)
+        if self.baseline is not None:
+            shutil.rmtree(self.baseline.root, ignore_errors=True)
+
+    @contextmanager
+    def acquire(self) -> Iterator[Workspace]:
+        """Выдаёт чистую рабочую копию на время блока `with`."""
+        self.start()
+        assert self.baseline is not None
+        with self._lock:
+            ws = self._ready.popleft() if self._ready else None
+            if ws is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.in_use += 1
+        if ws is None:
+            ws = self.baseline.add_worktree()
+        try:
+            yield ws
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._resetter.submit(self._release, ws)
+
+    def _release(self, ws: Workspace) -> None:
+        """Сбрасывает копию и возвращает её в пул либо удаляет, если пул полон или копия испорчена."""
+        assert self.baseline is not None
+        try:
+            self.baseline.reset(ws)
+        except subprocess.CalledProcessError:
+            self.baseline.remove_worktree(ws)
+            return
+        with self._lock:
+            if len(self._ready) < self.size:
+                self._ready.append(ws)
+                return
+        self.baseline.remove_worktree(ws)
+
+    def stats(self) -> dict[str, int]:
+        """Размер пула, число готовых и занятых копий, счётчики попаданий и промахов."""
+        with self._lock:
+            return {
+                "size": self.size,
+                "ready": len(self._ready),
+                "in_use": self.in_use,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+@dataclass
+class _Snapshot:
+    """Снапшот применённого префикса диффов: коммит и оценка занимаемого места."""
+    sha: str
+    size: int
+
+
+class PrefixCache:
+    """
+    LRU-кэш снапшотов для стеков диффов: хеш содержимого префикса → коммит в baseline-репозитории.
+
+    Каждый снапшот удерживается ссылкой `refs/aw/prefix/<key>`, чтобы git gc его не удалил.
+    Бюджет задаётся числом записей и суммарным объёмом диффов в префиксах (верхняя оценка
+    новых объектов на диске); при превышении самые старые ссылки удаляются.
+    """
+
+    REF_PREFIX = "refs/aw/prefix/"
+
+    def __init__(self, max_entries: int, max_bytes: int) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, _Snapshot] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.patches_skipped = 0
+
+    @staticmethod
+    def keys(repo: BaselineRepo, diffs: list[str]) -> list[str]:
+        """Цепочка ключей: i-й ключ однозначно описывает baseline-репозиторий и первые i+1 диффов."""
+        keys: list[str] = []
+        h = hashlib.sha256(f"{repo.base}:{repo.sha}".encode()).hexdigest()
+        for diff in diffs:
+            h = hashlib.sha256((h + hashlib.sha256(diff.encode()).hexdigest()).encode()).hexdigest()
+            keys.append(h)
+        return keys
+
+    def longest(self, keys: list[str]) -> tuple[int, str | None]:
+        """Возвращает длину самого длинного закэшированного префикса и его коммит."""
+        with self._lock:
+            for n in range(len(keys), 0, -1):
+                snap = self._entries.get(keys[n - 1])
+                if snap is not None:
+                    self._entries.move_to_end(keys[n - 1])
+                    self.hits += 1
+                    self.patches_skipped += n
+                    return n, snap.sha
+            if keys:
+                self.misses += 1
+            return 0, None
+
+    def store(self, repo: BaselineRepo, key: str, sha: str, size: int) -> None:
+        """Запоминает снапшот префикса и вытесняет старые записи сверх бюджета."""
+        git(["update-ref", self.REF_PREFIX + key, sha], repo.base)
+        evicted: list[str] = []
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = _Snapshot(sha=sha, size=size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                k, snap = self._entries.popitem(last=False)
+                self._bytes -= snap.size
+                evicted.append(k)
+        for k in evicted:
+            git(["update-ref", "-d", self.REF_PREFIX + k], repo.base)
+
+    def stats(self) -> dict[str, int]:
+        """Число снапшотов, занятый бюджет и счётчики попаданий."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "patches_skipped": self.patches_skipped,
+            }
@@ -0,0 +1 @@
+"""Сквозные бенчмарки мостов agents-wrangler (см. benchmarks/run.py)."""
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Поддельный `codex` для бенчмарков: вызывается codex-runner'ом как
+`fake_codex.py --oss -m <model> exec <prompt>` в каталоге проекта.
+
+Поведение задаётся переменными окружения:
+- FAKE_CODEX_DELAY — фиксированная задержка, с (по умолчанию 0.5);
+- FAKE_CODEX_JITTER — случайная добавка к задержке от 0 до значения, с (0);
+- FAKE_CODEX_BREAK_RATE — доля патчей, ломающих add() (0.3);
+- FAKE_CODEX_COMPONENTS — число компонентов в плане архитектора (2);
+- FAKE_CODEX_SEED — зерно генератора; без него кандидаты различаются между вызовами.
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+
+def _implement(rng: random.Random, cwd: Path, prompt: str) -> None:
+    """
+    Базовый билдер правит app.py: дописывает уникальную строку и с заданной вероятностью
+    ломает add(). Специалист компонента добавляет новый модуль, чтобы патчи разных
+    специалистов складывались в стек без конфликтов.
+    """
+    m = re.search(r"component '([^']+)'", prompt)
+    if m:
+        name = re.sub(r"\W", "_", m.group(1))
+        (cwd / f"{name}_{rng.getrandbits(32):08x}.py").write_text(f"NAME = {name!r}\n", encoding="utf-8")
+        return
+    app = cwd / "app.py"
+    text = app.read_text(encoding="utf-8")
+    if rng.random() < float(os.environ.get("FAKE_CODEX_BREAK_RATE", "0.3")):
+        text = text.replace("return a + b", "return a - b")
+    app.write_text(text + f"# fake codex {rng.getrandbits(32):08x}\n", encoding="utf-8")
+
+
+def main(argv: list[str]) -> int:
+    prompt = argv[-1] if argv else ""
+    seed = os.environ.get("FAKE_CODEX_SEED")
+    rng = random.Random(seed)
+    delay = float(os.environ.get("FAKE_CODEX_DELAY", "0.5"))
+    delay += rng.uniform(0, float(os.environ.get("FAKE_CODEX_JITTER", "0")))
+    time.sleep(delay)
+    if "ROLE: Software Architect" in prompt:
+        n = int(os.environ.get("FAKE_CODEX_COMPONENTS", "2"))
+        components = [{"name": f"component_{i}", "target_files": ["demo_app/app.py"]} for i in range(n)]
+        print(json.dumps({"components": components}))
+    elif "ROLE: Senior Reviewer" in prompt:
+        print(json.dumps({"score": 0.9, "rationale": "fake review"}))
+    else:
+        _implement(rng, Path.cwd(), prompt)
+        print("edited app.py")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
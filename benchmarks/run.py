@@ -0,0 +1,237 @@
+"""
+Сквозной бенчмарк мостов: поднимает настоящие tester-service и codex-runner'ы
+(uvicorn-процессами на свободных портах), подменяет `CODEX_BIN` на
+`benchmarks/fake_codex.py` и прогоняет `bridge_best_of_n` / `bridge_multi` по сетке
+параметров. Для каждого случая в JSON пишутся p50/p95 задержки моста, число мостов
+в минуту и p50/p95 по этапам (из таймингов результата моста).
+
+    python -m benchmarks.run --builders 1,3 --specialists 0,1 --concurrency 1,4 --runs 10 \\
+        --output bench.json --compare bench-main.json
+
+Поведение поддельного Codex настраивается переменными `FAKE_CODEX_*` (см. fake_codex.py).
+"""
+from __future__ import annotations
+
+import itertools
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+import httpx
+import typer
+
+from agents_wrangler.orchestrator import BestOfNResult, MultiBridgeResult, bridge_best_of_n, bridge_multi
+
+ROOT = Path(__file__).resolve().parent.parent
+FAKE_CODEX = Path(__file__).resolve().parent / "fake_codex.py"
+STARTUP_TIMEOUT = 30.0
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def _service(module: str, health: str, env: dict[str, str]) -> Iterator[str]:
+    """Запускает `uvicorn <module>:app` на свободном порту и ждёт ответа `health`; возвращает базовый URL."""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{module}:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env={**os.environ, **env, "PYTHONPATH": os.pathsep.join(p for p in [str(ROOT), os.environ.get("PYTHONPATH", "")] if p)},
+    )
+    try:
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{module} exited with code {proc.returncode}")
+            try:
+                if httpx.get(f"{url}{health}", timeout=1.0).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{module} did not start in {STARTUP_TIMEOUT}s")
+            time.sleep(0.1)
+        yield url
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+@contextmanager
+def _stack(builders: int, runner_env: dict[str, str], tester_env: dict[str, str]) -> Iterator[dict[str, Any]]:
+    """Поднимает tester и `builders` codex-runner'ов; архитектор и ревьюер — первый runner."""
+    with tempfile.TemporaryDirectory(prefix="aw_bench_") as tmp, ExitStack() as stack:
+        # Обёртка с текущим интерпретатором: shebang fake_codex.py может указывать на другой python
+        launcher = Path(tmp) / "codex"
+        launcher.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_CODEX}" "$@"\n', encoding="utf-8")
+        launcher.chmod(0o755)
+        env = {"CODEX_BIN": str(launcher), **runner_env}
+        tester = stack.enter_context(_service("agents_wrangler.tester_service", "/pool", tester_env))
+        runners = [
+            stack.enter_context(_service("agents_wrangler.codex_runner_service", "/codex/status", env))
+            for _ in range(builders)
+        ]
+        yield {"tester": tester, "builders": runners, "plan": runners[:1], "review": runners[:1]}
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Перцентиль `q` (0–100) с линейной интерполяцией; для пустого списка — 0."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    lo, hi = math.floor(pos), math.ceil(pos)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def _stages(result: BestOfNResult | MultiBridgeResult) -> dict[str, float]:
+    """Этапы одного моста: у best-of-N — среднее по кандидатам, у мультимоста — этапы моста."""
+    if isinstance(result, MultiBridgeResult):
+        return dict(result.timings)
+    totals: dict[str, list[float]] = {}
+    for timings in result.candidate_timings:
+        for name, value in timings.items():
+            totals.setdefault(name, []).append(value)
+    return {name: sum(v) / len(v) for name, v in totals.items()}
+
+
+def summarize(latencies: list[float], stages: list[dict[str, float]], wall: float) -> dict[str, Any]:
+    """Сводка случая: p50/p95 задержки, мостов в минуту и p50/p95 по каждому этапу."""
+    names = sorted({name for row in stages for name in row})
+    return {
+        "runs": len(latencies),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "runs_per_minute": len(latencies) / wall * 60 if wall > 0 else 0.0,
+        "stages": {
+            name: {
+                "p50": percentile([row[name] for row in stages if name in row], 50),
+                "p95": percentile([row[name] for row in stages if name in row], 95),
+            }
+            for name in names
+        },
+    }
+
+
+def run_case(
+    urls: dict[str, Any], bridge: str, builders: int, specialists: int, concurrency: int, runs: int,
+) -> dict[str, Any]:
+    """Прогоняет `runs` мостов, не более `concurrency` одновременно, и возвращает сводку."""
+    task = "Fix add() to return a + b"
+    builder_urls = urls["builders"][:builders]
+
+    def _one(client: httpx.Client) -> tuple[float, dict[str, float]]:
+        started = time.monotonic()
+        if bridge == "multi":
+            result: BestOfNResult | MultiBridgeResult = bridge_multi(
+                client, task, urls["plan"], builder_urls, urls["review"], urls["tester"], specialists,
+            )
+        else:
+            result = bridge_best_of_n(client, task, builder_urls, urls["tester"])
+        return time.monotonic() - started, _stages(result)
+
+    with httpx.Client(timeout=300.0) as client, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.monotonic()
+        outcomes = list(pool.map(lambda _: _one(client), range(runs)))
+        wall = time.monotonic() - started
+    case = {"bridge": bridge, "builders": builders, "specialists": specialists, "concurrency": concurrency}
+    return {**case, **summarize([o[0] for o in outcomes], [o[1] for o in outcomes], wall)}
+
+
+def _case_key(case: dict[str, Any]) -> tuple:
+    return case["bridge"], case["builders"], case["specialists"], case["concurrency"]
+
+
+def compare(current: list[dict[str, Any]], baseline: list[dict[str, Any]]) -> list[str]:
+    """Строки сравнения p50/p95 и пропускной способности со случаями из прошлого отчёта."""
+    old = {_case_key(c): c for c in baseline}
+    lines = []
+    for case in current:
+        prev = old.get(_case_key(case))
+        if prev is None:
+            continue
+        deltas = [
+            f"{metric} {prev[metric]:.2f} -> {case[metric]:.2f} ({(case[metric] / prev[metric] - 1) * 100:+.0f}%)"
+            for metric in ("p50", "p95", "runs_per_minute")
+            if prev[metric]
+        ]
+        lines.append(f"{'/'.join(map(str, _case_key(case)))}: " + ", ".join(deltas))
+    return lines
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _ints(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(
+    bridges: str = typer.Option("best_of_n,multi", help="Мосты через запятую: best_of_n, multi"),
+    builders: str = typer.Option("1,3", help="Число билдеров (runner'ов) через запятую"),
+    specialists: str = typer.Option("0,1", help="Специалистов на компонент (только для multi)"),
+    concurrency: str = typer.Option("1,4", help="Сколько мостов выполняется одновременно"),
+    runs: int = typer.Option(10, help="Мостов на каждый случай"),
+    executor: str = typer.Option("subprocess", help="Исполнитель pytest в tester: subprocess или forkserver"),
+    shards: int = typer.Option(1, help="На сколько процессов tester делит прогон pytest (не больше числа ядер)"),
+    runner_concurrency: int = typer.Option(2, help="CODEX_MAX_CONCURRENCY каждого runner'а"),
+    output: Path = typer.Option(Path("bench.json"), help="Куда записать JSON-отчёт"),
+    compare_with: Path | None = typer.Option(None, "--compare", help="Прошлый отчёт для сравнения"),
+) -> None:
+    """Прогоняет сетку случаев и пишет отчёт; с `--compare` печатает изменения относительно прошлого."""
+    bridge_list = [b.strip() for b in bridges.split(",") if b.strip()]
+    builder_list, specialist_list, concurrency_list = _ints(builders), _ints(specialists), _ints(concurrency)
+    runner_env = {"CODEX_MAX_CONCURRENCY": str(runner_concurrency), "CODEX_MAX_QUEUE": "1000"}
+    tester_env = {"TESTER_EXECUTOR": executor, "TESTER_SHARDS": str(shards)}
+    results = []
+    with _stack(max(builder_list), runner_env, tester_env) as urls:
+        for bridge, n, s, c in itertools.product(bridge_list, builder_list, specialist_list, concurrency_list):
+            if bridge != "multi" and s != specialist_list[0]:
+                continue
+            case = run_case(urls, bridge, n, s if bridge == "multi" else 0, c, runs)
+            results.append(case)
+            typer.echo(f"{bridge} builders={n} specialists={case['specialists']} concurrency={c}: "
+                       f"p50={case['p50']:.2f}s p95={case['p95']:.2f}s {case['runs_per_minute']:.1f}/min")
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "timestamp": time.time(),
+            "runs": runs,
+            "executor": executor,
+            "shards": shards,
+            "runner_concurrency": runner_concurrency,
+            "fake_codex": {k: v for k, v in os.environ.items() if k.startswith("FAKE_CODEX_")},
+        },
+        "results": results,
+    }
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    if compare_with is not None:
+        for line in compare(results, json.loads(compare_with.read_text(encoding="utf-8"))["results"]):
+            typer.echo(line)
+
+
+if __name__ == "__main__":
+    typer.run(main)
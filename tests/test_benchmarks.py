@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+from pathlib import Path
+
+from benchmarks.run import FAKE_CODEX, compare, percentile, summarize
+
+
+def test_percentile_and_summary() -> None:
+    """Проверяет перцентили с интерполяцией и сводку случая по этапам."""
+    assert percentile([], 50) == 0.0
+    assert percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.5
+    assert percentile([1.0, 2.0, 3.0, 4.0], 100) == 4.0
+    summary = summarize([1.0, 3.0], [{"implement": 0.5, "test": 0.2}, {"implement": 1.5}], wall=4.0)
+    assert summary["runs_per_minute"] == 30.0
+    assert summary["stages"]["implement"] == {"p50": 1.0, "p95": 1.45}
+    assert summary["stages"]["test"]["p50"] == 0.2
+
+
+def test_compare_reports_relative_change() -> None:
+    """Проверяет сравнение с прошлым отчётом по ключу случая."""
+    case = {"bridge": "best_of_n", "builders": 1, "specialists": 0, "concurrency": 1}
+    old = [{**case, "p50": 2.0, "p95": 4.0, "runs_per_minute": 10.0}]
+    new = [{**case, "p50": 1.0, "p95": 4.0, "runs_per_minute": 20.0}, {**case, "builders": 3, "p50": 1.0}]
+    assert compare(new, old) == ["best_of_n/1/0/1: p50 2.00 -> 1.00 (-50%), p95 4.00 -> 4.00 (+0%), runs_per_minute 10.00 -> 20.00 (+100%)"]
+
+
+def test_fake_codex_edits_project(tmp_path: Path) -> None:
+    """Проверяет, что поддельный Codex правит app.py билдером и добавляет модуль специалистом."""
+    (tmp_path / "app.py").write_text("def add(a, b):\n    return a + b\n", encoding="utf-8")
+    env = {"FAKE_CODEX_DELAY": "0", "FAKE_CODEX_BREAK_RATE": "1"}
+
+    def _run(prompt: str) -> None:
+        subprocess.run([sys.executable, str(FAKE_CODEX), "exec", prompt], cwd=tmp_path, env=env, check=True)
+
+    _run("ROLE: Senior Implementer\nGoal:\nFix add()")
+    _run("ROLE: Senior Implementer\nGoal:\nImplement specialized improvements for component 'core', focus files: any.")
+    assert "return a - b" in (tmp_path / "app.py").read_text()
+    assert len(list(tmp_path.glob("core_*.py"))) == 1
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+
+import httpx
+import pytest
+import respx
+
+from agents_wrangler import orchestrator
+from agents_wrangler.builder_pool import BuilderPool, request_stats
+from agents_wrangler.orchestrator import bridge_best_of_n
+
+URLS = ["http://b1:7002", "http://b2:7002", "http://b3:7002"]
+
+
+def _unavailable(url: str) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", url)
+    return httpx.HTTPStatusError("503", request=request, response=httpx.Response(503, request=request))
+
+
+def test_least_outstanding_spreads_concurrent_leases() -> None:
+    """Проверяет, что одновременные запросы расходятся по разным билдерам."""
+    pool = BuilderPool(URLS)
+    with pool.lease() as a, pool.lease() as b, pool.lease() as c:
+        assert sorted([a, b, c]) == sorted(URLS)
+        with pool.lease() as d:
+            assert d in URLS
+    assert all(s["outstanding"] == 0 for s in pool.stats())
+
+
+def test_least_outstanding_prefers_fast_builder() -> None:
+    """Проверяет, что каждый билдер сначала опрашивается, а затем выбирается самый быстрый."""
+    pool = BuilderPool(URLS[:2])
+    with pool.lease() as first:
+        time.sleep(0.05)
+    with pool.lease() as second:
+        pass
+    assert first != second
+    with pool.lease() as third:
+        assert third == second
+
+
+def test_failing_builder_is_ejected_and_returns() -> None:
+    """Проверяет исключение билдера после сбоев подряд и возврат по истечении срока."""
+    pool = BuilderPool(URLS[:2], eject_after=2, eject_for=0.1)
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPStatusError):
+            with pool.lease() as url:
+                if url == URLS[0]:
+                    raise _unavailable(url)
+    bad = next(s for s in pool.stats() if s["url"] == URLS[0])
+    assert bad["failures"] == 2 and bad["ejected"]
+    for _ in range(3):
+        with pool.lease() as url:
+            assert url == URLS[1]
+    time.sleep(0.15)
+    assert not next(s for s in pool.stats() if s["url"] == URLS[0])["ejected"]
+
+
+def test_model_errors_do_not_eject() -> None:
+    """Проверяет, что отказ модели (400) не считается нездоровьем билдера."""
+    pool = BuilderPool(URLS[:1], eject_after=1)
+    request = httpx.Request("POST", URLS[0])
+    with pytest.raises(httpx.HTTPStatusError):
+        with pool.lease():
+            raise httpx.HTTPStatusError("400", request=request, response=httpx.Response(400, request=request))
+    assert pool.stats()[0]["failures"] == 0
+
+
+def test_p2c_never_picks_busiest_builder() -> None:
+    """Проверяет, что power-of-two-choices сравнивает пару и не выбирает самый загруженный билдер."""
+    pool = BuilderPool(URLS, policy="p2c", rng=random.Random(7))
+    pool._builders[0].outstanding = 5
+    picked = set()
+    for _ in range(30):
+        with pool.lease() as url:
+            picked.add(url)
+    assert picked == set(URLS[1:])
+
+
+@respx.mock
+def test_best_of_n_distributes_candidates_over_pool() -> None:
+    """Проверяет, что кандидатов может быть больше, чем URL, и они делятся между билдерами поровну."""
+    def _slow_implement(request: httpx.Request) -> httpx.Response:
+        time.sleep(0.1)
+        return httpx.Response(200, json={"diff": f"diff from {request.url.host}", "stdout": "", "stderr": ""})
+
+    routes = [respx.post(f"{url}/codex/implement").mock(side_effect=_slow_implement) for url in URLS[:2]]
+    respx.post("http://tester:7001/testrun/batch").mock(return_value=httpx.Response(404))
+    respx.post("http://tester:7001/testrun").mock(
+        return_value=httpx.Response(
+            200,
+            json={"tests_total": 1, "tests_passed": 1, "tests_failed": 0, "return_code": 0, "stdout": "", "stderr": ""},
+        )
+    )
+    pool = BuilderPool(URLS[:2])
+    with httpx.Client() as client:
+        res = bridge_best_of_n(client, "Fix add()", pool, "http://tester:7001", max_concurrency=4, candidates=4)
+    assert len(res.candidate_diffs) == 4
+    assert [r.call_count for r in routes] == [2, 2]
+    assert sum(s["requests"] for s in pool.stats()) == 4
+
+
+def _ok(host: str) -> httpx.Response:
+    return httpx.Response(200, json={"diff": f"diff from {host}", "stdout": "", "stderr": ""})
+
+
+@respx.mock
+def test_retries_5xx_within_bridge_budget(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Проверяет повтор на 503 с учётом в `request_stats` и отказ после исчерпания бюджета."""
+    monkeypatch.setattr(orchestrator, "RETRY_BACKOFF", 0.01)
+    respx.post(f"{URLS[0]}/codex/implement").mock(side_effect=[httpx.Response(503), _ok("b1"), httpx.Response(429)])
+    respx.post("http://tester:7001/testrun/batch").mock(return_value=httpx.Response(404))
+    respx.post("http://tester:7001/testrun").mock(return_value=httpx.Response(200, json={
+        "tests_total": 1, "tests_passed": 1, "tests_failed": 0, "return_code": 0, "stdout": "", "stderr": "",
+    }))
+    with httpx.Client() as client:
+        res = bridge_best_of_n(client, "Fix add()", URLS[:1], "http://tester:7001")
+        assert res.candidate_diffs == ["diff from b1"] and res.request_stats["retries"] == 1
+        monkeypatch.setattr(orchestrator, "RETRY_BUDGET", 0)
+        with pytest.raises(httpx.HTTPStatusError):
+            bridge_best_of_n(client, "Fix add()", URLS[:1], "http://tester:7001")
+
+
+@respx.mock
+def test_slow_builder_is_hedged_to_idle_one() -> None:
+    """Проверяет хедж после квантиля задержек пула: берётся ответ свободного билдера (sync и async)."""
+    def _slow(request: httpx.Request) -> httpx.Response:
+        time.sleep(0.5)
+        return _ok(request.url.host)
+
+    async def _aslow(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.5)
+        return _ok(request.url.host)
+
+    def _pool() -> BuilderPool:
+        pool = BuilderPool(URLS[:2])
+        pool._samples.extend([0.01] * 8)
+        pool._builders[0].latency, pool._builders[1].latency = 0.01, 1.0  # первый запрос уйдёт на b1
+        return pool
+
+    slow = respx.post(f"{URLS[0]}/codex/implement").mock(side_effect=_slow)
+    respx.post(f"{URLS[1]}/codex/implement").mock(side_effect=lambda request: _ok(request.url.host))
+    with request_stats(retry_budget=0) as stats, httpx.Client() as client:
+        assert orchestrator._implement_on(_pool(), client, "Fix add()").diff == "diff from b2"
+    counts = stats.snapshot()
+    assert counts["hedges"] == counts["hedge_wins"] == 1 and counts["wasted_seconds"] > 0
+
+    async def _run() -> tuple[str, dict[str, float]]:
+        with request_stats(retry_budget=0) as stats:
+            async with httpx.AsyncClient() as client:
+                patch = await orchestrator._aimplement_on(_pool(), client, "Fix add()", 5.0)
+        return patch.diff, stats.snapshot()
+
+    slow.mock(side_effect=_aslow)
+    diff, counts = asyncio.run(_run())
+    assert diff == "diff from b2" and counts["hedge_wins"] == 1
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import shutil
 import pytest
 
@@ -14,13 +15,13 @@ CODEx_PRESENT = shutil.which("codex") is not None
 @pytest.mark.skipif(not CODEx_PRESENT, reason="codex binary is not available")
 def test_codex_plan_smoke() -> None:
     """Проверяет, что Codex способен вернуть валидный план в JSON."""
-    plan = codex_plan(PlanRequest(task="Fix add() to return a + b"))
+    plan = asyncio.run(codex_plan(PlanRequest(task="Fix add() to return a + b")))
     assert isinstance(plan.components, list)
 
 @pytest.mark.skipif(not CODEx_PRESENT, reason="codex binary is not available")
 def test_codex_implement_smoke() -> None:
     """Проверяет, что Codex способен вернуть непустой unified diff."""
-    resp = codex_implement(ImplementRequest(task="Fix add() to return a + b"))
+    resp = asyncio.run(codex_implement(ImplementRequest(task="Fix add() to return a + b")))
     assert "diff --git" in resp.diff
 
 @pytest.mark.skipif(not CODEx_PRESENT, reason="codex binary is not available")
@@ -34,6 +35,6 @@ diff --git a/demo_app/app.py b/demo_app/app.py
 -    return a - b
 +    return a + b
 """
-    review = codex_review(ReviewRequest(task="Fix add()", diffs=[good]))
+    review = asyncio.run(codex_review(ReviewRequest(task="Fix add()", diffs=[good])))
     assert 0.0 <= review.score <= 1.0
     assert isinstance(review.rationale, str)
@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+import uvicorn
+from fastapi.testclient import TestClient
+
+from agents_wrangler import codex_runner_service as runner
+from agents_wrangler.cache import MemoryCache, TieredCache
+from agents_wrangler.workspaces import WorkspacePool
+
+
+class _GoneRequest:
+    """Заглушка Request, клиент которой уже отключился."""
+
+    async def is_disconnected(self) -> bool:
+        return True
+
+
+def test_run_kills_process_when_client_disconnects(tmp_path: Path) -> None:
+    """Проверяет, что `codex exec` убивается, если клиент закрыл соединение."""
+    cmd = [sys.executable, "-c", "import time; time.sleep(30)"]
+
+    started = time.monotonic()
+    with pytest.raises(runner.ClientDisconnected):
+        asyncio.run(runner._run(cmd, tmp_path, 180, _GoneRequest()))
+    assert time.monotonic() - started < 5
+
+
+def test_run_without_request_returns_output(tmp_path: Path) -> None:
+    """Проверяет, что прямой вызов без HTTP-запроса ведёт себя как subprocess.run."""
+    proc = asyncio.run(runner._run([sys.executable, "-c", "print('ok')"], tmp_path))
+    assert proc.returncode == 0
+    assert proc.stdout.strip() == "ok"
+
+
+@pytest.fixture(autouse=True)
+def workspaces(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> WorkspacePool:
+    """Отдельный baseline и пул рабочих копий demo_app во временном каталоге на каждый тест."""
+    pool = WorkspacePool(runner.DEMO_APP_DIR, size=1, root=tmp_path / "pool")
+    monkeypatch.setattr(runner, "WORKSPACES", pool)
+    monkeypatch.setattr(runner, "_SNAPSHOT", None)
+    yield pool
+    if runner._SNAPSHOT is not None:
+        runner.set_readonly(runner._SNAPSHOT.target, False)
+    pool.close()
+
+
+@pytest.fixture()
+def fake_codex(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Подменяет CODEX_BIN скриптом, который печатает фиксированный JSON."""
+    script = tmp_path / "codex"
+    script.write_text(
+        f"#!{sys.executable}\n"
+        "import os\n"
+        "import sys\n"
+        "import time\n"
+        "open(__file__ + '.calls', 'a').write('.')\n"
+        "prompt = sys.argv[-1]\n"
+        "if 'hang' in prompt:\n"
+        "    open(__file__ + '.pid', 'w').write(str(os.getpid()))\n"
+        "    time.sleep(30)\n"
+        "if 'slow' in prompt:\n"
+        "    time.sleep(1)\n"
+        "if 'Implementer' in prompt or 'scribble' in prompt:\n"
+        "    open('app.py', 'a').write('# touched\\n')\n"
+        "    open('NEW.txt', 'w').write('new\\n')\n"
+        "    print('edited app.py')\n"
+        "elif 'Architect' in prompt:\n"
+        "    print('{\"components\": [{\"name\": \"core\", \"target_files\": [\"demo_app/app.py\"]}]}')\n"
+        "else:\n"
+        "    print('{\"score\": 0.9, \"rationale\": \"ok\"}')\n",
+        encoding="utf-8",
+    )
+    script.chmod(0o755)
+    monkeypatch.setattr(runner, "CODEX_BIN", str(script))
+    return script
+
+
+def test_plan_endpoint_with_fake_codex(fake_codex: Path) -> None:
+    """Проверяет HTTP-эндпоинт плана поверх подменённого Codex."""
+    with TestClient(runner.app) as client:
+        r = client.post("/codex/plan", json={"task": "Fix add()"})
+    assert r.status_code == 200
+    assert r.json()["components"][0]["name"] == "core"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def test_client_disconnect_kills_codex_through_app(fake_codex: Path) -> None:
+    """
+    Проверяет отключение клиента через настоящий HTTP-сервер со всеми middleware:
+    `codex exec` убивается, а слот очереди освобождается.
+    """
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    url = "http://127.0.0.1:%d" % sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(runner.app, log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    try:
+        deadline = time.monotonic() + 30
+        while not server.started and time.monotonic() < deadline:
+            time.sleep(0.05)
+        pid_file = Path(f"{fake_codex}.pid")
+        with pytest.raises(httpx.ReadTimeout):
+            httpx.post(f"{url}/codex/plan", json={"task": "hang"}, timeout=3)
+        pid = int(pid_file.read_text())
+        deadline = time.monotonic() + 5
+        while (httpx.get(f"{url}/codex/status").json()["in_flight"] or _alive(pid)) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert httpx.get(f"{url}/codex/status").json()["in_flight"] == 0
+        assert not _alive(pid)
+    finally:
+        server.should_exit = True
+        thread.join(10)
+
+
+def test_implement_diffs_against_prebuilt_baseline(fake_codex: Path, workspaces: WorkspacePool) -> None:
+    """Проверяет, что implement работает в копиях из пула, а в дифф попадают и новые файлы."""
+    with TestClient(runner.app) as client:
+        diffs = [client.post("/codex/implement", json={"task": "Fix add()"}) for _ in range(2)]
+    assert [r.status_code for r in diffs] == [200, 200]
+    assert diffs[0].json()["diff"] == diffs[1].json()["diff"]
+    diff = diffs[0].json()["diff"]
+    assert "+# touched" in diff and "b/demo_app/NEW.txt" in diff
+    assert workspaces.stats()["hits"] >= 1
+
+
+def test_implement_streams_codex_output(fake_codex: Path) -> None:
+    """Проверяет NDJSON-режим implement: строки вывода по мере появления и результат последней строкой."""
+    lines: list[tuple[str, str]] = []
+    cmd = [sys.executable, "-c", "import sys; print('one'); print('two', file=sys.stderr); print('three', end='')"]
+    proc = asyncio.run(runner._run(cmd, Path.cwd(), on_line=lambda name, line: lines.append((name, line))))
+    assert proc.stdout == "one\nthree" and proc.stderr == "two\n"
+    assert sorted(lines) == [("stderr", "two"), ("stdout", "one"), ("stdout", "three")]
+
+    with TestClient(runner.app) as client:
+        r = client.post("/codex/implement?stream=true", json={"task": "Fix add()"})
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in r.text.splitlines()]
+    assert events[0] == {"event": "stdout", "line": "edited app.py"}
+    assert events[-1]["event"] == "result" and "b/demo_app/NEW.txt" in events[-1]["result"]["diff"]
+
+
+def test_readonly_snapshot_is_restored_after_writes(fake_codex: Path) -> None:
+    """Проверяет, что plan/review читают снапшот без прав записи и он возвращается к baseline, если Codex в нём писал."""
+    with TestClient(runner.app) as client:
+        snapshot = runner._SNAPSHOT
+        assert snapshot is not None
+        assert not (snapshot.target / "app.py").stat().st_mode & 0o222
+        # Под root права не мешают записи: runner должен сам откатить изменения
+        if os.access(snapshot.target, os.W_OK):
+            client.post("/codex/review", json={"task": "scribble", "diffs": ["diff"]})
+            assert not (snapshot.target / "NEW.txt").exists()
+            assert "# touched" not in (snapshot.target / "app.py").read_text()
+        r = client.post("/codex/plan", json={"task": "Fix add()"})
+    assert r.status_code == 200
+
+
+def test_metrics_expose_codex_stage_histograms(fake_codex: Path) -> None:
+    """Проверяет гистограммы ожидания слота, `codex exec` и подготовки каталога в /metrics."""
+    with TestClient(runner.app) as client:
+        client.post("/codex/plan", json={"task": "Fix add()"})
+        metrics = client.get("/metrics").text
+    assert 'aw_codex_queue_wait_seconds_count{role="plan"}' in metrics
+    assert 'aw_codex_exec_seconds_count{role="plan",status="ok"}' in metrics
+    assert 'aw_codex_workspace_seconds_count{role="plan"}' in metrics
+
+
+def test_exec_queue_hands_slots_over_in_order() -> None:
+    """Проверяет лимит одновременных запусков, FIFO-передачу слота и отказ при полной очереди."""
+    queue = runner.ExecQueue(concurrency=1, max_queue=1)
+    order: list[str] = []
+
+    async def _job(name: str, delay: float) -> None:
+        async with queue.slot():
+            order.append(name)
+            await asyncio.sleep(delay)
+
+    async def _main() -> None:
+        first = asyncio.ensure_future(_job("first", 0.05))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(_job("second", 0))
+        await asyncio.sleep(0)
+        assert (queue.in_flight, queue.queued) == (1, 1)
+        with pytest.raises(runner.QueueFull) as exc:
+            await _job("third", 0)
+        assert exc.value.retry_after >= 1
+        await asyncio.gather(first, second)
+
+    asyncio.run(_main())
+    assert order == ["first", "second"]
+    assert queue.stats() == {
+        "concurrency": 1, "max_queue": 1, "in_flight": 0, "queued": 0, "completed": 2, "rejected": 1,
+    }
+
+
+def test_busy_runner_returns_429(fake_codex: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Проверяет, что при занятом слоте и пустой очереди runner сразу отвечает 429 с Retry-After
+    и не проверяет снапшот, в котором Codex не запускался.
+    """
+    monkeypatch.setattr(runner, "EXEC_QUEUE", runner.ExecQueue(concurrency=1, max_queue=0))
+    verified: list[Path] = []
+    verify = runner._verify_snapshot
+    monkeypatch.setattr(runner, "_verify_snapshot", lambda ws: (verified.append(ws.root), verify(ws))[1])
+    with TestClient(runner.app) as client:
+        slow = threading.Thread(target=client.post, args=("/codex/plan",), kwargs={"json": {"task": "slow"}})
+        slow.start()
+        deadline = time.monotonic() + 5
+        while client.get("/codex/status").json()["in_flight"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        r = client.post("/codex/plan", json={"task": "fast"})
+        slow.join()
+        status = client.get("/codex/status").json()
+    assert r.status_code == 429
+    assert int(r.headers["Retry-After"]) >= 1
+    assert (status["completed"], status["rejected"], status["in_flight"]) == (1, 1, 0)
+    assert len(verified) == 1
+
+
+def test_workspace_returns_to_pool_when_cancelled_during_acquire(
+    workspaces: WorkspacePool, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Проверяет, что отмена запроса, пока копия выдаётся в потоке, не уводит её из пула."""
+    entered, proceed = threading.Event(), threading.Event()
+    start = workspaces.start
+
+    def slow_start() -> None:
+        entered.set()
+        proceed.wait(5)
+        start()
+
+    monkeypatch.setattr(workspaces, "start", slow_start)
+
+    async def scenario() -> None:
+        async def use() -> None:
+            async with runner._workspace():
+                raise AssertionError("unreachable")
+
+        task = asyncio.create_task(use())
+        await asyncio.to_thread(entered.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        proceed.set()
+        deadline = time.monotonic() + 5
+        while workspaces.stats()["in_use"] and time.monotonic() < deadline:
+            await asyncio.sleep(0.02)
+
+    asyncio.run(scenario())
+    assert workspaces.stats()["in_use"] == 0
+
+
+@pytest.fixture()
+def response_cache(monkeypatch: pytest.MonkeyPatch) -> TieredCache:
+    """Включает кэш ответов runner'а с чистым хранилищем в памяти."""
+    cache = TieredCache(MemoryCache(max_entries=8, ttl=60))
+    monkeypatch.setattr(runner, "CACHE_ENABLED", True)
+    monkeypatch.setattr(runner, "RESPONSES", cache)
+    monkeypatch.setattr(runner, "CACHE_STATS", {role: {"hits": 0, "misses": 0, "bypassed": 0} for role in runner.CACHE_TTLS})
+    return cache
+
+
+def _calls(script: Path) -> int:
+    path = Path(f"{script}.calls")
+    return len(path.read_text()) if path.exists() else 0
+
+
+def test_plan_and_review_responses_are_cached(fake_codex: Path, response_cache: TieredCache) -> None:
+    """Проверяет, что повторные plan/review отдаются из кэша без запуска Codex, а bypass его обходит."""
+    review = {"task": "Fix add()", "diffs": ["diff"]}
+    with TestClient(runner.app) as client:
+        first = client.post("/codex/plan", json={"task": "Fix add()"})
+        second = client.post("/codex/plan", json={"task": "Fix add()"})
+        bypass = client.post("/codex/plan", json={"task": "Fix add()"}, headers={"X-AW-Cache": "bypass"})
+        other_model = client.post("/codex/plan", json={"task": "Fix add()", "model": "other"})
+        reviews = [client.post("/codex/review", json=review) for _ in range(2)]
+        stats = client.get("/codex/cache").json()
+    assert [r.headers["X-AW-Cache"] for r in (first, second, bypass, other_model)] == ["miss", "hit", "bypass", "miss"]
+    assert second.json() == first.json()
+    assert [r.headers["X-AW-Cache"] for r in reviews] == ["miss", "hit"]
+    assert _calls(fake_codex) == 4
+    assert stats["enabled"] is True
+    assert stats["roles"]["plan"] == {"hits": 1, "misses": 2, "bypassed": 1}
+    assert stats["roles"]["review"] == {"hits": 1, "misses": 1, "bypassed": 0}
+
+
+def test_implement_is_cached_only_with_seed(response_cache: TieredCache) -> None:
+    """Проверяет, что implement попадает в кэш только при seed/deterministic, а seed входит в ключ."""
+    plain = runner.ImplementRequest(task="Fix add()")
+    assert runner._cache_lookup("implement", "m", "p", None, None, enabled=plain.cacheable()) == (None, None)
+    key_1, _ = runner._cache_lookup("implement", "m", "p", None, None, enabled=True, variant="seed=1")
+    key_2, _ = runner._cache_lookup("implement", "m", "p", None, None, enabled=True, variant="seed=2")
+    assert key_1 and key_2 and key_1 != key_2
+    runner._cache_store("implement", key_1, {"diff": "d", "stdout": "", "stderr": ""})
+    assert runner._cache_lookup("implement", "m", "p", None, None, enabled=True, variant="seed=1")[1]["diff"] == "d"
+    assert runner.ImplementRequest(task="x", seed=3).cacheable()
+    assert runner.ImplementRequest(task="x", deterministic=True).cacheable()
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import gzip
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from agents_wrangler.diff_store import DIFF_STORE_HEADER, DiffStore, GzipRequests, MissingDiffs, diff_ref, install
+
+
+def test_store_resolves_refs_and_evicts_by_size() -> None:
+    """Проверяет ссылки по SHA-256, список всех недостающих и вытеснение самых старых диффов."""
+    store = DiffStore(max_bytes=10)
+    refs = store.put(["aaaa", "bbbb"])
+    assert refs == [diff_ref("aaaa"), diff_ref("bbbb")]
+    assert store.resolve(refs[::-1]) == ["bbbb", "aaaa"]
+    store.put(["cccc"])
+    with pytest.raises(MissingDiffs) as err:
+        store.resolve([refs[1], diff_ref("x"), diff_ref("x")])
+    assert err.value.refs == [refs[1], diff_ref("x")]
+    assert store.stats()["entries"] == 2
+
+
+def test_install_accepts_gzip_uploads_and_answers_409() -> None:
+    """Проверяет PUT /diffs со сжатым телом, 409 на неизвестные ссылки и заголовок хранилища."""
+    app = FastAPI()
+    store = DiffStore(max_bytes=1 << 20)
+    install(app, store)
+
+    @app.post("/echo")
+    def echo(body: dict) -> dict:
+        return {"diffs": store.resolve(body["refs"])}
+
+    with TestClient(app) as client:
+        missing = client.post("/echo", json={"refs": [diff_ref("d1")]})
+        assert missing.status_code == 409 and missing.json()["missing"] == [diff_ref("d1")]
+        body = gzip.compress(json.dumps({"diffs": ["d1"]}).encode())
+        put = client.put("/diffs", content=body, headers={"Content-Encoding": "gzip", "Content-Type": "application/json"})
+        assert put.json() == {"refs": [diff_ref("d1")]} and put.headers[DIFF_STORE_HEADER] == "sha256"
+        assert client.post("/echo", json={"refs": [diff_ref("d1")]}).json() == {"diffs": ["d1"]}
+        bad = client.put("/diffs", content=b"not gzip", headers={"Content-Encoding": "gzip"})
+        assert bad.status_code == 400
+
+
+def test_gzip_requests_rejects_oversized_body() -> None:
+    """Проверяет, что распакованное тело сверх лимита отвергается, а не читается в память целиком."""
+    app = FastAPI()
+    app.add_middleware(GzipRequests, max_bytes=1000)
+
+    @app.post("/size")
+    async def size(body: dict) -> int:
+        return len(body["x"])
+
+    headers = {"Content-Encoding": "gzip", "Content-Type": "application/json"}
+    with TestClient(app) as client:
+        small = gzip.compress(json.dumps({"x": "a" * 100}).encode())
+        big = gzip.compress(json.dumps({"x": "a" * 100_000}).encode())
+        assert client.post("/size", content=small, headers=headers).json() == 100
+        assert client.post("/size", content=big, headers=headers).status_code == 400
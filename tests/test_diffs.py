@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from agents_wrangler.diffs import PatchError, apply_patch, diff_fingerprint, normalize_diff
+
+GIT_DIFF = (
+    "diff --git a/demo_app/app.py b/demo_app/app.py\n"
+    "index 1111111..2222222 100644\n"
+    "--- a/demo_app/app.py\n"
+    "+++ b/demo_app/app.py\n"
+    "@@ -1,3 +1,3 @@ def add(a: int, b: int) -> int:\n"
+    " def add(a: int, b: int) -> int:\n"
+    "-    return a - b\n"
+    "+    return a + b  \n"
+    "diff --git a/demo_app/extra.py b/demo_app/extra.py\n"
+    "new file mode 100644\n"
+    "--- /dev/null\n"
+    "+++ b/demo_app/extra.py\n"
+    "@@ -0,0 +1 @@\n"
+    "+EXTRA = 1\n"
+)
+
+
+def test_equivalent_diffs_share_fingerprint() -> None:
+    """Проверяет, что порядок файлов, хвостовые пробелы, CRLF и заголовки ханков не влияют на отпечаток."""
+    reordered = (
+        "diff --git a/demo_app/extra.py b/demo_app/extra.py\n"
+        "new file mode 100644\n"
+        "--- /dev/null\n"
+        "+++ b/demo_app/extra.py\n"
+        "@@ -0,0 +1,1 @@\n"
+        "+EXTRA = 1\n"
+        "diff --git a/demo_app/app.py b/demo_app/app.py\n"
+        "index 3333333..4444444 100644\n"
+        "--- a/demo_app/app.py\n"
+        "+++ b/demo_app/app.py\n"
+        "@@ -1,3 +1,3 @@\n"
+        " def add(a: int, b: int) -> int:\n"
+        "-    return a - b\n"
+        "+    return a + b\n"
+        "\n"
+    ).replace("\n", "\r\n")
+    assert normalize_diff(GIT_DIFF) == normalize_diff(reordered)
+    assert diff_fingerprint(GIT_DIFF) == diff_fingerprint(reordered)
+
+
+def test_plain_unified_diff_matches_git_diff() -> None:
+    """Проверяет, что вывод `diff -u` с метками времени эквивалентен тому же патчу от git."""
+    plain = (
+        "--- a/demo_app/app.py\t2024-01-01 00:00:00\n"
+        "+++ b/demo_app/app.py\t2024-01-01 00:00:01\n"
+        "@@ -1,3 +1,3 @@\n"
+        " def add(a: int, b: int) -> int:\n"
+        "-    return a - b\n"
+        "+    return a + b\n"
+    )
+    git_only_app = GIT_DIFF.split("diff --git a/demo_app/extra.py")[0]
+    assert diff_fingerprint(plain) == diff_fingerprint(git_only_app)
+
+
+def test_different_changes_differ() -> None:
+    """Проверяет, что отличие в содержимом строк меняет отпечаток."""
+    other = GIT_DIFF.replace("EXTRA = 1", "EXTRA = 2")
+    assert diff_fingerprint(other) != diff_fingerprint(GIT_DIFF)
+    leading = GIT_DIFF.replace("+    return a + b  ", "+      return a + b")
+    assert diff_fingerprint(leading) != diff_fingerprint(GIT_DIFF)
+
+
+
+APP = "def add(a, b):\n    return a - b\n\n\ndef sub(a, b):\n    return a - b\n"
+FIXED = "def add(a, b):\n    return a + b\n\n\ndef sub(a, b):\n    return b - a\n"
+FIX_BOTH = (
+    "diff --git a/app.py b/app.py\n"
+    "--- a/app.py\n"
+    "+++ b/app.py\n"
+    "@@ -1,3 +1,3 @@\n"
+    " def add(a, b):\n"
+    "-    return a - b\n"
+    "+    return a + b\n"
+    " \n"
+    "@@ -5,2 +5,2 @@\n"
+    " def sub(a, b):\n"
+    "-    return a - b\n"
+    "+    return b - a\n"
+)
+NEW_MODULE = (
+    "diff --git a/demo_app/extra.py b/demo_app/extra.py\n"
+    "new file mode 100755\n"
+    "--- /dev/null\n"
+    "+++ b/demo_app/extra.py\n"
+    "@@ -0,0 +1 @@\n"
+    "+EXTRA = 1\n"
+    "\\ No newline at end of file\n"
+)
+
+
+def test_apply_patch_handles_offset_and_fuzz(tmp_path: Path) -> None:
+    """Проверяет применение со смещением (строки сверху) и с fuzz (изменённый край контекста)."""
+    app = tmp_path / "app.py"
+    app.write_text("import os\nimport sys\n" + APP)
+    assert apply_patch(tmp_path, FIX_BOTH) == ["app.py"]
+    assert app.read_text() == "import os\nimport sys\n" + FIXED
+
+    typed = APP.replace("def add(a, b):", "def add(a: int, b: int):")
+    app.write_text(typed)
+    with pytest.raises(PatchError):
+        apply_patch(tmp_path, FIX_BOTH, fuzz=0)
+    apply_patch(tmp_path, FIX_BOTH)
+    assert app.read_text() == FIXED.replace("def add(a, b):", "def add(a: int, b: int):")
+
+
+def test_apply_patch_reports_failed_hunks_without_writing(tmp_path: Path) -> None:
+    """Проверяет, что неприменившийся ханк указан точно, а файлы остаются нетронутыми."""
+    original = APP.replace("def sub(a, b):\n    return a - b", "def sub(x, y):\n    return x - y")
+    (tmp_path / "app.py").write_text(original)
+    with pytest.raises(PatchError) as exc:
+        apply_patch(tmp_path, FIX_BOTH, fuzz=0)
+    [failure] = exc.value.failures
+    assert (failure.path, failure.hunk, failure.header) == ("app.py", 2, "@@ -5,2 +5,2 @@")
+    assert (tmp_path / "app.py").read_text() == original
+
+
+def test_apply_patch_creates_deletes_and_renames_files(tmp_path: Path) -> None:
+    """Проверяет новые, удалённые и переименованные файлы, а также строку без перевода в конце."""
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "old.py").write_text("X = 1\n")
+    (tmp_path / "gone.py").write_text("Y = 2\n")
+    diff = (
+        "diff --git a/pkg/old.py b/pkg/new.py\n"
+        "similarity index 100%\n"
+        "rename from pkg/old.py\n"
+        "rename to pkg/new.py\n"
+        "diff --git a/gone.py b/gone.py\n"
+        "deleted file mode 100644\n"
+        "--- a/gone.py\n"
+        "+++ /dev/null\n"
+        "@@ -1 +0,0 @@\n"
+        "-Y = 2\n"
+        + NEW_MODULE
+    )
+    assert sorted(apply_patch(tmp_path, diff)) == ["demo_app/extra.py", "gone.py", "pkg/new.py", "pkg/old.py"]
+    assert (tmp_path / "demo_app" / "extra.py").read_text() == "EXTRA = 1"
+    assert (tmp_path / "demo_app" / "extra.py").stat().st_mode & 0o111
+    assert (tmp_path / "pkg" / "new.py").read_text() == "X = 1\n"
+    assert not (tmp_path / "pkg" / "old.py").exists() and not (tmp_path / "gone.py").exists()
+    with pytest.raises(PatchError, match="already exists"):
+        apply_patch(tmp_path, NEW_MODULE)
+
+
+@pytest.mark.parametrize("body", [
+    "@@\n-    return a - b\n+    return a + b\n",
+    "-    return a - b\n+    return a + b\n",
+])
+def test_apply_patch_rejects_lines_outside_hunks(tmp_path: Path, body: str) -> None:
+    """Проверяет, что голый `@@` и тело без заголовка ханка — ошибка, а не «применённый» пустой патч."""
+    (tmp_path / "app.py").write_text(APP)
+    diff = "diff --git a/app.py b/app.py\n--- a/app.py\n+++ b/app.py\n" + body
+    with pytest.raises(PatchError, match="outside a hunk"):
+        apply_patch(tmp_path, diff)
+    with pytest.raises(PatchError, match="no hunks"):
+        apply_patch(tmp_path, "--- a/app.py\n+++ b/app.py\n")
+    assert (tmp_path / "app.py").read_text() == APP
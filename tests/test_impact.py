@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from agents_wrangler.impact import ImportGraph, changed_files
+
+FILES = {
+    "proj/pkg/__init__.py": "from .core import run\n",
+    "proj/pkg/core.py": "from . import util\n",
+    "proj/pkg/util.py": "VALUE = 1\n",
+    "proj/other.py": "import json\n",
+    "proj/tests/helpers.py": "from other import *\n",
+    "proj/tests/test_core.py": (
+        "import pytest\nfrom proj.pkg.core import run\n\n"
+        "@pytest.mark.parametrize('x', [1, 2])\ndef test_run(x):\n    pass\n\n"
+        "class TestMore:\n    def test_a(self):\n        pass\n"
+    ),
+    "proj/tests/test_other.py": "import helpers\n\ndef test_other():\n    pass\n",
+}
+
+
+def _write(root: Path, files: dict[str, str]) -> None:
+    for rel, text in files.items():
+        (root / rel).parent.mkdir(parents=True, exist_ok=True)
+        (root / rel).write_text(text, encoding="utf-8")
+
+
+def test_import_graph_finds_transitively_impacted_tests(tmp_path: Path) -> None:
+    """Проверяет относительные, пакетные и соседние импорты, транзитивный выбор и подсчёт тестов."""
+    _write(tmp_path, FILES)
+    graph = ImportGraph.build(tmp_path, "proj")
+    assert graph.tests == {"proj/tests/test_core.py": 3, "proj/tests/test_other.py": 1}
+    assert graph.impacted({"proj/pkg/util.py"}) == {"proj/tests/test_core.py"}
+    assert graph.impacted({"proj/other.py"}) == {"proj/tests/test_other.py"}
+    assert graph.impacted({"proj/tests/test_other.py"}) == {"proj/tests/test_other.py"}
+
+    # Стек добавил модуль и импорт на него: граф дополняется файлами из рабочей копии
+    _write(tmp_path, {"proj/new.py": "X = 1\n", "proj/other.py": "import new\n"})
+    assert graph.impacted({"proj/new.py"}) == set()
+    updated = graph.updated(tmp_path, {"proj/new.py", "proj/other.py"})
+    assert updated.impacted({"proj/new.py"}) == {"proj/tests/test_other.py"}
+
+
+def test_changed_files_requires_full_run_when_selection_is_unsafe() -> None:
+    """Проверяет пути из диффа и откат на полный прогон для не-.py файлов, conftest и удалений."""
+    def _diff(old: str, new: str) -> str:
+        return f"--- {old}\n+++ {new}\n@@ -1 +1 @@\n-a\n+b\n"
+
+    ok = changed_files(_diff("a/proj/app.py", "b/proj/app.py"))
+    assert ok.paths == {"proj/app.py"} and not ok.full_reason
+    assert changed_files(_diff("a/proj/data.json", "b/proj/data.json")).full_reason
+    assert changed_files(_diff("a/proj/tests/conftest.py", "b/proj/tests/conftest.py")).full_reason
+    assert changed_files(_diff("a/proj/app.py", "/dev/null")).full_reason
+    assert changed_files("@@ garbage").full_reason
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import httpx
+import pytest
+import respx
+from typer.testing import CliRunner
+
+from agents_wrangler import orchestrator
+from agents_wrangler.cli import app
+from agents_wrangler import jobs
+from agents_wrangler.jobs import JobSpec, JobStore, JobWorker
+
+GOOD_DIFF = (
+    "diff --git a/demo_app/app.py b/demo_app/app.py\n"
+    "--- a/demo_app/app.py\n+++ b/demo_app/app.py\n@@\n-    return a - b\n+    return a + b\n"
+)
+
+
+def _spec(task: str = "Fix add()") -> JobSpec:
+    return JobSpec(task=task, builder_urls=["http://build:7002"], tester_url="http://tester:7001", candidates=2)
+
+
+def test_store_claims_in_order_and_requeues_stale_runs(tmp_path: Path) -> None:
+    """Проверяет порядок захвата, возврат брошенного задания в очередь и отказ после исчерпания попыток."""
+    store = JobStore(tmp_path / "jobs.sqlite3")
+    first, second = store.submit(_spec("a")), store.submit(_spec("b"))
+    assert store.claim("w1").id == first
+    assert store.claim("w1").id == second
+    assert store.claim("w1") is None
+
+    # Воркер w1 пропал: без heartbeat задания возвращаются в очередь, потом падают окончательно
+    again = store.claim("w2", stale_after=0)
+    assert again.id == first and again.attempts == 2 and again.worker == "w2"
+    assert store.claim("w3", stale_after=0, max_attempts=2).id == second
+    assert store.get(first).status == "failed"
+    assert [e.event for e in store.events(first)] == ["queued", "running", "requeued", "running", "failed"]
+    assert store.get(first[:6]).id == first and store.get("%") is None
+
+
+@respx.mock
+def test_cli_job_mode_runs_bridge_in_worker(tmp_path: Path) -> None:
+    """Проверяет `submit --job` → `worker` → `status`/`watch`/`result` на мокнутых сервисах."""
+    orchestrator._BATCH_UNSUPPORTED.clear()
+    orchestrator._DIFF_STORES.clear()
+    respx.post("http://build:7002/codex/implement").mock(
+        return_value=httpx.Response(200, json={"diff": GOOD_DIFF, "stdout": "", "stderr": ""})
+    )
+    respx.post("http://tester:7001/testrun/batch").mock(return_value=httpx.Response(404))
+    respx.post("http://tester:7001/testrun").mock(return_value=httpx.Response(200, json={
+        "tests_total": 1, "tests_passed": 1, "tests_failed": 0, "return_code": 0, "stdout": "", "stderr": "",
+    }))
+    db = ["--db", str(tmp_path / "jobs.sqlite3")]
+    runner = CliRunner()
+
+    submitted = runner.invoke(app, ["submit", "--job", "-t", "Fix add()", "-n", "2", "--builder-url", "http://build:7002",
+                                    "--tester-url", "http://tester:7001", *db])
+    run_id = json.loads(submitted.output)["run_id"]
+    assert json.loads(runner.invoke(app, ["status", run_id, *db]).output)["status"] == "queued"
+    assert runner.invoke(app, ["result", run_id, *db]).exit_code == 2
+
+    assert json.loads(runner.invoke(app, ["worker", "--until-idle", *db]).output) == {"completed": 1}
+    watched = runner.invoke(app, ["watch", run_id, *db])
+    assert watched.exit_code == 0
+    events = [json.loads(line) for line in watched.output.splitlines()]
+    names = [e["event"] for e in events]
+    assert names[:2] == ["queued", "running"] and names[-2:] == ["winner", "succeeded"]
+    assert names.count("candidate_tested") == 2
+    assert "stdout" not in next(e for e in events if e["event"] == "candidate_tested")["data"]["result"]
+    res = json.loads(runner.invoke(app, ["result", run_id, *db]).output)
+    assert res["winner_index"] == 0 and res["candidate_diffs"] == [GOOD_DIFF, GOOD_DIFF]
+    assert json.loads(runner.invoke(app, ["status", *db]).output)[0]["status"] == "succeeded"
+
+
+def test_worker_records_failures(tmp_path: Path) -> None:
+    """Проверяет, что упавший мост сохраняет трейсбек, а воркер продолжает работу."""
+    store = JobStore(tmp_path / "jobs.sqlite3")
+    run_id = store.submit(JobSpec(task="x", builder_urls=["http://127.0.0.1:9/"], tester_url="http://127.0.0.1:9/"))
+    assert JobWorker(store, workers=1, poll=0.01).run(until_idle=True) == 1
+    record = store.get(run_id)
+    assert record.status == "failed" and "ConnectError" in record.error
+
+
+@respx.mock
+def test_worker_passes_job_timeout_to_requests(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Проверяет, что `JOB_HTTP_TIMEOUT` доходит до каждого HTTP-запроса моста."""
+    orchestrator._BATCH_UNSUPPORTED.clear()
+    orchestrator._DIFF_STORES.clear()
+    monkeypatch.setattr(jobs, "JOB_HTTP_TIMEOUT", 900.0)
+    timeouts = []
+
+    def _respond(payload: dict):  # type: ignore[no-untyped-def]
+        def _handler(request: httpx.Request) -> httpx.Response:
+            timeouts.append(request.extensions["timeout"]["read"])
+            return httpx.Response(200, json=payload)
+        return _handler
+
+    respx.post("http://build:7002/codex/implement").mock(
+        side_effect=_respond({"diff": GOOD_DIFF, "stdout": "", "stderr": ""})
+    )
+    respx.post("http://tester:7001/testrun/batch").mock(side_effect=_respond({"results": [{"index": 0, "result": {
+        "tests_total": 1, "tests_passed": 1, "tests_failed": 0, "return_code": 0, "stdout": "", "stderr": "",
+    }}]}))
+    store = JobStore(tmp_path / "jobs.sqlite3")
+    run_id = store.submit(_spec())
+    assert JobWorker(store, workers=1, poll=0.01).run(until_idle=True) == 1
+    assert store.get(run_id).status == "succeeded"
+    assert timeouts == [900.0, 900.0, 900.0]
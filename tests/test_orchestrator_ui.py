@@ -1,12 +1,19 @@
 from __future__ import annotations
 
+import asyncio
 import itertools
+import json
+import threading
+import time
 
 import httpx
 import pytest
 import respx
 
+from agents_wrangler import orchestrator
 from agents_wrangler.orchestrator import (
+    BestOfNResult,
+    abridge_best_of_n,
     bridge_best_of_n,
     bridge_multi,
 )
@@ -20,6 +27,13 @@ BAD_DIFF = (
     "--- a/demo_app/app.py\n+++ b/demo_app/app.py\n@@\n-    return a - b\n+    return a - b - 1\n"
 )
 
+@pytest.fixture(autouse=True)
+def _reset_batch_support() -> None:
+    """Сбрасывает запомненные тестеры без /testrun/batch и хранилища диффов между тестами."""
+    orchestrator._BATCH_UNSUPPORTED.clear()
+    orchestrator._DIFF_STORES.clear()
+
+
 @pytest.fixture()
 def endpoints() -> dict[str, str]:
     """Возвращает фиктивные URL сервисов для мокирования."""
@@ -44,12 +58,13 @@ def test_best_of_n_picks_good(endpoints: dict[str, str], good_index: int) -> Non
         )
     # Мокаем тестер: "зелено", если есть GOOD_DIFF
     def _testrun_response(request: httpx.Request) -> httpx.Response:
-        body = request.json()
+        body = json.loads(request.content)
         diffs = "".join(body.get("diffs", []))
         failed = 0 if "return a + b" in diffs else 1
         return httpx.Response(200, json={"tests_total": 1, "tests_passed": 1 - failed, "tests_failed": failed, "return_code": 0 if failed == 0 else 1, "stdout": "", "stderr": ""})
 
     respx.post(f"{endpoints['tester']}/testrun").mock(side_effect=_testrun_response)
+    respx.post(f"{endpoints['tester']}/testrun/batch").mock(side_effect=_batch_by_content)
 
     with httpx.Client() as client:
         res = bridge_best_of_n(client, "Fix add()", build_urls, endpoints["tester"])
@@ -63,27 +78,32 @@ def test_multi_bridge_accepts_specialists(endpoints: dict[str, str]) -> None:
     respx.post(f"{endpoints['plan']}/codex/plan").mock(
         return_value=httpx.Response(200, json={"components": [{"name": "fix_add_function", "target_files": ["demo_app/app.py"]}]})
     )
-    # Билдеры: base (good, bad, bad)
+    # Билдеры: base (good, bad, bad); специалисты — безвредный патч (новый файл)
     build_urls = [endpoints["build1"], endpoints["build2"], endpoints["build3"]]
-    respx.post(f"{build_urls[0]}/codex/implement").mock(return_value=httpx.Response(200, json={"diff": GOOD_DIFF, "stdout": "", "stderr": ""}))
-    respx.post(f"{build_urls[1]}/codex/implement").mock(return_value=httpx.Response(200, json={"diff": BAD_DIFF, "stdout": "", "stderr": ""}))
-    respx.post(f"{build_urls[2]}/codex/implement").mock(return_value=httpx.Response(200, json={"diff": BAD_DIFF, "stdout": "", "stderr": ""}))
-    # Специалисты: безвредный патч (новый файл)
     SPEC_DIFF = (
         "diff --git a/demo_app/_meta_spec.py b/demo_app/_meta_spec.py\n"
         "new file mode 100644\n--- /dev/null\n+++ b/demo_app/_meta_spec.py\n@@\n+META=1\n"
     )
-    for url in build_urls:
-        respx.post(f"{url}/codex/implement").mock(return_value=httpx.Response(200, json={"diff": SPEC_DIFF, "stdout": "", "stderr": ""}))
+
+    def _implement(base_diff: str):  # type: ignore[no-untyped-def]
+        def _respond(request: httpx.Request) -> httpx.Response:
+            task = json.loads(request.content)["task"]
+            diff = SPEC_DIFF if task.startswith("Implement specialized") else base_diff
+            return httpx.Response(200, json={"diff": diff, "stdout": "", "stderr": ""})
+        return _respond
+
+    for url, diff in zip(build_urls, [GOOD_DIFF, BAD_DIFF, BAD_DIFF]):
+        respx.post(f"{url}/codex/implement").mock(side_effect=_implement(diff))
 
     # Тестер: зелено, если есть GOOD_DIFF; остальные диффы не ухудшают.
     def _testrun_response(request: httpx.Request) -> httpx.Response:
-        body = request.json()
+        body = json.loads(request.content)
         diffs = "".join(body.get("diffs", []))
         failed = 0 if "return a + b" in diffs else 1
         return httpx.Response(200, json={"tests_total": 1, "tests_passed": 1 - failed, "tests_failed": failed, "return_code": 0 if failed == 0 else 1, "stdout": "", "stderr": ""})
 
     respx.post(f"{endpoints['tester']}/testrun").mock(side_effect=_testrun_response)
+    respx.post(f"{endpoints['tester']}/testrun/batch").mock(side_effect=_batch_by_content)
 
     # Ревью
     respx.post(f"{endpoints['review']}/codex/review").mock(return_value=httpx.Response(200, json={"score": 0.93, "rationale": "looks good"}))
@@ -102,3 +122,527 @@ def test_multi_bridge_accepts_specialists(endpoints: dict[str, str]) -> None:
     assert out.final_tests.tests_failed == 0
     assert any("return a + b" in d for d in out.accepted_diffs)
     assert out.review.score > 0.5
+
+
+def _testrun_by_content(request: httpx.Request) -> httpx.Response:
+    """Ответ тестера по содержимому запроса: «зелено», если есть исправление add()."""
+    diffs = "".join(json.loads(request.content).get("diffs", []))
+    failed = 0 if "return a + b" in diffs else 1
+    return httpx.Response(200, json={"tests_total": 1, "tests_passed": 1 - failed, "tests_failed": failed, "return_code": failed, "stdout": "", "stderr": ""})
+
+
+@respx.mock
+@pytest.mark.parametrize("max_concurrency", [None, 1, 2])
+def test_best_of_n_fans_out_builders(endpoints: dict[str, str], max_concurrency: int | None) -> None:
+    """Проверяет, что билдеры опрашиваются одновременно в пределах лимита, а победитель не меняется."""
+    build_urls = [endpoints["build1"], endpoints["build2"], endpoints["build3"]]
+    lock = threading.Lock()
+    state = {"active": 0, "peak": 0}
+
+    def _slow_build(diff: str):
+        def _handler(request: httpx.Request) -> httpx.Response:
+            with lock:
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            time.sleep(0.2)
+            with lock:
+                state["active"] -= 1
+            return httpx.Response(200, json={"diff": diff, "stdout": "", "stderr": ""})
+        return _handler
+
+    for i, url in enumerate(build_urls):
+        respx.post(f"{url}/codex/implement").mock(side_effect=_slow_build(GOOD_DIFF if i == 2 else BAD_DIFF))
+    respx.post(f"{endpoints['tester']}/testrun").mock(side_effect=_testrun_by_content)
+
+    with httpx.Client() as client:
+        res = bridge_best_of_n(
+            client, "Fix add()", build_urls, endpoints["tester"], max_concurrency=max_concurrency, batch_tests=False,
+        )
+
+    assert res.winner_index == 2
+    assert [tr.tests_failed for tr in res.candidate_tests] == [1, 1, 0]
+    assert state["peak"] == (max_concurrency or len(build_urls))
+
+
+@respx.mock
+def test_abridge_best_of_n_matches_sync_rule(endpoints: dict[str, str]) -> None:
+    """Проверяет, что асинхронный best-of-N возвращает тот же BestOfNResult, что и sync-версия."""
+    build_urls = [endpoints["build1"], endpoints["build2"], endpoints["build3"]]
+    for i, url in enumerate(build_urls):
+        respx.post(f"{url}/codex/implement").mock(
+            return_value=httpx.Response(200, json={"diff": GOOD_DIFF if i == 1 else BAD_DIFF, "stdout": "", "stderr": ""})
+        )
+    respx.post(f"{endpoints['tester']}/testrun").mock(side_effect=_testrun_by_content)
+    respx.post(f"{endpoints['tester']}/testrun/batch").mock(return_value=httpx.Response(404))
+
+    async def _run() -> BestOfNResult:
+        async with httpx.AsyncClient() as client:
+            return await abridge_best_of_n(client, "Fix add()", build_urls, endpoints["tester"])
+
+    res = asyncio.run(_run())
+    assert isinstance(res, BestOfNResult)
+    assert res.winner_index == 1
+    assert res.candidate_diffs[1] == GOOD_DIFF
+
+
+@respx.mock
+def test_abridge_best_of_n_cancels_outstanding_builders(endpoints: dict[str, str]) -> None:
+    """Проверяет, что отмена моста отменяет зависшие вызовы билдеров."""
+    build_urls = [endpoints["build1"], endpoints["build2"]]
+    cancelled: list[str] = []
+
+    async def _hang(request: httpx.Request) -> httpx.Response:
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.append(str(request.url))
+            raise
+        return httpx.Response(500)
+
+    for url in build_urls:
+        respx.post(f"{url}/codex/implement").mock(side_effect=_hang)
+
+    async def _run() -> None:
+        async with httpx.AsyncClient() as client:
+            await asyncio.wait_for(abridge_best_of_n(client, "Fix add()", build_urls, endpoints["tester"]), timeout=0.2)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(_run())
+    assert len(cancelled) == 2
+
+
+def _full_pass_testrun(request: httpx.Request) -> httpx.Response:
+    """Тестер с тремя тестами: исправленный add() проходит все."""
+    diffs = "".join(json.loads(request.content).get("diffs", []))
+    failed = 0 if "return a + b" in diffs else 3
+    return httpx.Response(200, json={"tests_total": 3, "tests_passed": 3 - failed, "tests_failed": failed, "return_code": int(failed > 0), "stdout": "", "stderr": ""})
+
+
+@respx.mock
+def test_best_of_n_first_green_stops_early(endpoints: dict[str, str]) -> None:
+    """Проверяет, что режим first_green не ждёт медленных билдеров после полного прохода."""
+    build_urls = [endpoints["build1"], endpoints["build2"], endpoints["build3"]]
+
+    def _slow(request: httpx.Request) -> httpx.Response:
+        time.sleep(1.5)
+        return httpx.Response(200, json={"diff": BAD_DIFF, "stdout": "", "stderr": ""})
+
+    respx.post(f"{build_urls[0]}/codex/implement").mock(side_effect=_slow)
+    respx.post(f"{build_urls[1]}/codex/implement").mock(return_value=httpx.Response(200, json={"diff": GOOD_DIFF, "stdout": "", "stderr": ""}))
+    respx.post(f"{build_urls[2]}/codex/implement").mock(side_effect=_slow)
+    testrun = respx.post(f"{endpoints['tester']}/testrun").mock(side_effect=_full_pass_testrun)
+
+    started = time.monotonic()
+    with httpx.Client() as client:
+        res = bridge_best_of_n(client, "Fix add()", build_urls, endpoints["tester"], selection="first_green")
+    assert time.monotonic() - started < 1.0
+    assert res.candidate_diffs == [GOOD_DIFF]
+    assert res.winner_index == 0
+    assert res.cancelled == 2
+    assert testrun.call_count == 1
+
+
+@respx.mock
+def test_abridge_first_green_cancels_outstanding(endpoints: dict[str, str]) -> None:
+    """Проверяет, что асинхронный first_green отменяет незавершённые вызовы билдеров."""
+    build_urls = [endpoints["build1"], endpoints["build2"], endpoints["build3"]]
+    cancelled: list[str] = []
+
+    async def _hang(request: httpx.Request) -> httpx.Response:
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.append(str(request.url))
+            raise
+        return httpx.Response(500)
+
+    respx.post(f"{build_urls[0]}/codex/implement").mock(side_effect=_hang)
+    respx.post(f"{build_urls[1]}/codex/implement").mock(return_value=httpx.Response(200, json={"diff": GOOD_DIFF, "stdout": "", "stderr": ""}))
+    respx.post(f"{build_urls[2]}/codex/implement").mock(side_effect=_hang)
+    respx.post(f"{endpoints['tester']}/testrun").mock(side_effect=_full_pass_testrun)
+
+    async def _run() -> BestOfNResult:
+        async with httpx.AsyncClient() as client:
+            return await abridge_best_of_n(client, "Fix add()", build_urls, endpoints["tester"], selection="first_green")
+
+    res = asyncio.run(asyncio.wait_for(_run(), timeout=5))
+    assert res.candidate_diffs == [GOOD_DIFF]
+    assert res.cancelled == 2
+    assert len(cancelled) == 2
+
+
+def _batch_by_content(request: httpx.Request) -> httpx.Response:
+    """Ответ /testrun/batch: по одному результату на стек в порядке запроса."""
+    stacks = json.loads(request.content)["stacks"]
+    results = []
+    for i, stack in enumerate(stacks):
+        failed = 0 if "return a + b" in "".join(stack) else 1
+        results.append({"index": i, "result": {"tests_total": 1, "tests_passed": 1 - failed, "tests_failed": failed, "return_code": failed, "stdout": "", "stderr": ""}})
+    return httpx.Response(200, json={"results": list(reversed(results))})
+
+
+@respx.mock
+def test_best_of_n_uses_batch_endpoint(endpoints: dict[str, str]) -> None:
+    """Проверяет, что все кандидаты тестируются одним запросом /testrun/batch."""
+    build_urls = [endpoints["build1"], endpoints["build2"], endpoints["build3"]]
+    for i, url in enumerate(build_urls):
+        respx.post(f"{url}/codex/implement").mock(
+            return_value=httpx.Response(200, json={"diff": GOOD_DIFF if i == 2 else BAD_DIFF, "stdout": "", "stderr": ""})
+        )
+    batch = respx.post(f"{endpoints['tester']}/testrun/batch").mock(side_effect=_batch_by_content)
+    single = respx.post(f"{endpoints['tester']}/testrun").mock(side_effect=_testrun_by_content)
+
+    with httpx.Client() as client:
+        res = bridge_best_of_n(client, "Fix add()", build_urls, endpoints["tester"])
+    assert res.winner_index == 2
+    assert [tr.tests_failed for tr in res.candidate_tests] == [1, 1, 0]
+    assert batch.call_count == 1
+    assert single.call_count == 0
+
+
+@respx.mock
+def test_best_of_n_falls_back_without_batch(endpoints: dict[str, str]) -> None:
+    """Проверяет откат на /testrun, если tester не знает /testrun/batch, и запоминание этого."""
+    build_urls = [endpoints["build1"], endpoints["build2"]]
+    for i, url in enumerate(build_urls):
+        respx.post(f"{url}/codex/implement").mock(
+            return_value=httpx.Response(200, json={"diff": GOOD_DIFF if i == 0 else BAD_DIFF, "stdout": "", "stderr": ""})
+        )
+    batch = respx.post(f"{endpoints['tester']}/testrun/batch").mock(return_value=httpx.Response(404))
+    single = respx.post(f"{endpoints['tester']}/testrun").mock(side_effect=_testrun_by_content)
+
+    with httpx.Client() as client:
+        bridge_best_of_n(client, "Fix add()", build_urls, endpoints["tester"])
+        res = bridge_best_of_n(client, "Fix add()", build_urls, endpoints["tester"])
+    assert res.winner_index == 0
+    assert batch.call_count == 1
+    assert single.call_count == 4
+
+
+@respx.mock
+@pytest.mark.parametrize("failure", [httpx.Response(503), httpx.ConnectError("refused")])
+def test_best_of_n_falls_back_on_batch_failure(endpoints: dict[str, str], failure: object) -> None:
+    """Проверяет откат на /testrun при 5xx или сетевой ошибке /testrun/batch без запоминания tester'а."""
+    build_urls = [endpoints["build1"], endpoints["build2"]]
+    for i, url in enumerate(build_urls):
+        respx.post(f"{url}/codex/implement").mock(
+            return_value=httpx.Response(200, json={"diff": GOOD_DIFF if i == 1 else BAD_DIFF, "stdout": "", "stderr": ""})
+        )
+    mock = {"side_effect": failure} if isinstance(failure, Exception) else {"return_value": failure}
+    batch = respx.post(f"{endpoints['tester']}/testrun/batch").mock(**mock)
+    single = respx.post(f"{endpoints['tester']}/testrun").mock(side_effect=_testrun_by_content)
+
+    with httpx.Client() as client:
+        bridge_best_of_n(client, "Fix add()", build_urls, endpoints["tester"])
+        res = bridge_best_of_n(client, "Fix add()", build_urls, endpoints["tester"])
+    assert res.winner_index == 1
+    assert batch.call_count == 2
+    assert single.call_count == 4
+
+
+def test_winner_rule_counts_errors_as_failures() -> None:
+    """Проверяет, что ошибки setup/сбора считаются падениями при выборе победителя."""
+    base = dict(return_code=1, stdout="", stderr="")
+    with_errors = orchestrator.TestRunResult(tests_total=5, tests_passed=3, tests_failed=0, tests_errors=2, **base)
+    clean = orchestrator.TestRunResult(tests_total=3, tests_passed=2, tests_failed=1, **base)
+    assert orchestrator._select_winner([with_errors, clean]) == 1
+    assert not orchestrator._is_full_pass(with_errors)
+
+
+def test_specialist_acceptance_helpers() -> None:
+    """Проверяет общие для sync и async мостов решения о приёме патчей специалистов."""
+    base = dict(return_code=0, stdout="", stderr="")
+    current = orchestrator.TestRunResult(tests_total=4, tests_passed=2, tests_failed=2, **base)
+    better = orchestrator.TestRunResult(tests_total=4, tests_passed=3, tests_failed=1, **base)
+    events: list[tuple[str, dict]] = []
+
+    def emit(name: str, **data: object) -> None:
+        events.append((name, data))
+
+    assert orchestrator._accept(emit, 0, "P", None, ["A"], current) == (["A"], current)
+    assert orchestrator._accept(emit, 1, "P", better, ["A"], current) == (["A", "P"], better)
+    assert orchestrator._accept(emit, 2, "Q", current, ["A", "P"], better) == (["A", "P"], better)
+    assert events == [("specialist_accepted", {"index": 1, "diff": "P"})]
+
+    events.clear()
+    raw, patches = ["X", "P", "Q"], ["P", "Q"]
+    assert orchestrator._accept_combined(emit, raw, ["A", "Q", "P"], [1, 0], patches, current, better) is None
+    assert orchestrator._accept_combined(emit, raw, ["A", "Q", "P"], [1, 0], patches, None, better) is None
+    assert orchestrator._accept_combined(emit, raw, ["A", "Q", "P"], [1, 0], patches, better, current) == (["A", "Q", "P"], better)
+    assert [d["index"] for _, d in events] == [2, 1]
+
+    tried = {orchestrator.diff_fingerprint("A")}
+    assert not orchestrator._first_seen("A", tried)
+    assert orchestrator._first_seen("B", tried) and not orchestrator._first_seen("B", tried)
+
+
+def _spec_result(stack: list[str], conflict: bool) -> dict | None:
+    """Четыре теста: каждый FIX_* чинит один, BREAK ломает; при `conflict` FIX_a и FIX_b вместе не применяются."""
+    text = "".join(stack)
+    if conflict and "FIX_a" in text and "FIX_b" in text:
+        return None
+    fixed = sum(f"FIX_{c}" in text for c in "abc") - ("BREAK" in text)
+    failed = 3 - fixed
+    return {"tests_total": 4, "tests_passed": 4 - failed, "tests_failed": failed, "return_code": int(failed > 0), "stdout": "", "stderr": ""}
+
+
+def _mock_speculative(endpoints: dict[str, str], calls: list[float], conflict: bool = False) -> None:
+    """Мокает архитектора (компоненты a, b, c, d), медленных билдеров и тестер с /testrun/batch."""
+    respx.post(f"{endpoints['plan']}/codex/plan").mock(
+        return_value=httpx.Response(200, json={"components": [{"name": c} for c in "abcd"]})
+    )
+
+    def _implement(request: httpx.Request) -> httpx.Response:
+        prompt = json.loads(request.content)["task"]
+        calls.append(time.monotonic())
+        time.sleep(0.2)
+        for c in "abc":
+            if f"component '{c}'" in prompt:
+                return httpx.Response(200, json={"diff": f"FIX_{c}", "stdout": "", "stderr": ""})
+        diff = "BREAK" if "component 'd'" in prompt else "BASE"
+        return httpx.Response(200, json={"diff": diff, "stdout": "", "stderr": ""})
+
+    for key in ("build1", "build2", "build3"):
+        respx.post(f"{endpoints[key]}/codex/implement").mock(side_effect=_implement)
+
+    def _testrun(request: httpx.Request) -> httpx.Response:
+        res = _spec_result(json.loads(request.content)["diffs"], conflict)
+        return httpx.Response(400, json={"detail": "conflict"}) if res is None else httpx.Response(200, json=res)
+
+    def _batch(request: httpx.Request) -> httpx.Response:
+        items = []
+        for i, stack in enumerate(json.loads(request.content)["stacks"]):
+            res = _spec_result(stack, conflict)
+            items.append({"index": i, "result": res} if res else {"index": i, "error": "conflict"})
+        return httpx.Response(200, json={"results": items})
+
+    respx.post(f"{endpoints['tester']}/testrun").mock(side_effect=_testrun)
+    respx.post(f"{endpoints['tester']}/testrun/batch").mock(side_effect=_batch)
+    respx.post(f"{endpoints['review']}/codex/review").mock(
+        return_value=httpx.Response(200, json={"score": 0.9, "rationale": "ok"})
+    )
+
+
+@respx.mock
+def test_multi_speculative_specialists_run_concurrently(endpoints: dict[str, str]) -> None:
+    """Проверяет, что специалисты запрашиваются одновременно, а полезные патчи собираются в один стек."""
+    calls: list[float] = []
+    _mock_speculative(endpoints, calls)
+    build_urls = [endpoints["build1"], endpoints["build2"], endpoints["build3"]]
+    with httpx.Client() as client:
+        res = bridge_multi(
+            client, "Fix", [endpoints["plan"]], build_urls, [endpoints["review"]], endpoints["tester"],
+            specialists_per_component=1, specialist_mode="speculative",
+        )
+    spec_calls = sorted(calls)[3:]
+    assert max(spec_calls) - min(spec_calls) < 0.15
+    assert res.accepted_diffs[0] == "BASE"
+    assert sorted(res.accepted_diffs[1:]) == ["FIX_a", "FIX_b", "FIX_c"]
+    assert res.final_tests.tests_failed == 0
+
+
+@respx.mock
+def test_multi_speculative_falls_back_on_conflicting_stack(endpoints: dict[str, str]) -> None:
+    """Проверяет, что при конфликте стека патчи добавляются по одному, а конфликтующий отбрасывается."""
+    _mock_speculative(endpoints, [], conflict=True)
+    with httpx.Client() as client:
+        res = bridge_multi(
+            client, "Fix", [endpoints["plan"]], [endpoints["build1"]], [endpoints["review"]],
+            endpoints["tester"], specialists_per_component=1, specialist_mode="speculative",
+        )
+    assert res.accepted_diffs == ["BASE", "FIX_a", "FIX_c"]
+    assert res.final_tests.tests_failed == 1
+
+
+@respx.mock
+def test_multi_incremental_skips_conflicting_specialist(endpoints: dict[str, str]) -> None:
+    """Проверяет, что в пошаговом режиме не применившийся патч специалиста отвергается, а не роняет мост."""
+    _mock_speculative(endpoints, [], conflict=True)
+    with httpx.Client() as client:
+        res = bridge_multi(
+            client, "Fix", [endpoints["plan"]], [endpoints["build1"]], [endpoints["review"]],
+            endpoints["tester"], specialists_per_component=1,
+        )
+    assert res.accepted_diffs == ["BASE", "FIX_a", "FIX_c"]
+
+
+@respx.mock
+def test_multi_impacted_trials_merge_and_final_run_is_full(endpoints: dict[str, str]) -> None:
+    """Проверяет, что пробы специалистов выборочные, их итог достраивается по принятому стеку, а финал полный."""
+    _mock_speculative(endpoints, [])
+    requests: list[dict] = []
+
+    def _testrun(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        requests.append(body)
+        text = "".join(body["diffs"])
+        fixed = {c for c in "abc" if f"FIX_{c}" in text}
+        files = [f"tests/test_{c}.py" for c in "abcd"]
+        if body.get("select") == "impacted":
+            files = [f"tests/test_{body['diffs'][-1][-1]}.py"]
+        tests = [
+            {"nodeid": f"{f}::test", "outcome": "passed" if f[-4] in fixed or f[-4] == "d" else "failed"}
+            for f in files
+        ]
+        passed = sum(t["outcome"] == "passed" for t in tests)
+        selection = {"mode": body.get("select", "all"), "test_files": files, "tests_skipped": 4 - len(files)}
+        return httpx.Response(200, json={
+            "tests_total": len(tests), "tests_passed": passed, "tests_failed": len(tests) - passed,
+            "return_code": int(passed < len(tests)), "stdout": "", "stderr": "", "tests": tests, "selection": selection,
+        })
+
+    respx.post(f"{endpoints['tester']}/testrun").mock(side_effect=_testrun)
+    with httpx.Client() as client:
+        res = bridge_multi(
+            client, "Fix", [endpoints["plan"]], [endpoints["build1"]], [endpoints["review"]],
+            endpoints["tester"], specialists_per_component=1, test_select="impacted",
+        )
+    assert res.accepted_diffs == ["BASE", "FIX_a", "FIX_b", "FIX_c"]
+    trials = [r for r in requests if r.get("select") == "impacted"]
+    assert [r["diffs"][-1] for r in trials] == ["FIX_a", "FIX_b", "FIX_c", "BREAK"]
+    assert requests[-1] == {"diffs": res.accepted_diffs}
+    assert res.final_tests.selection.mode == "all" and res.final_tests.tests_failed == 0
+    assert "final_test" in res.timings
+
+
+@respx.mock
+def test_abridge_multi_speculative_matches_sync(endpoints: dict[str, str]) -> None:
+    """Проверяет, что асинхронный спекулятивный режим принимает тот же набор патчей."""
+    _mock_speculative(endpoints, [], conflict=True)
+
+    async def _main():
+        async with httpx.AsyncClient() as client:
+            return await orchestrator.abridge_multi(
+                client, "Fix", [endpoints["plan"]], [endpoints["build1"]], [endpoints["review"]],
+                endpoints["tester"], specialists_per_component=1, specialist_mode="speculative",
+            )
+
+    res = asyncio.run(_main())
+    assert res.accepted_diffs == ["BASE", "FIX_a", "FIX_c"]
+
+
+@respx.mock
+def test_multi_propagates_trace_id_and_stage_timings(endpoints: dict[str, str]) -> None:
+    """Проверяет, что все запросы моста несут один trace ID, а этапы моста, кандидатов и специалистов замерены."""
+    _mock_speculative(endpoints, [])
+    with httpx.Client() as client:
+        res = bridge_multi(
+            client, "Fix", [endpoints["plan"]], [endpoints["build1"]], [endpoints["review"]],
+            endpoints["tester"], specialists_per_component=1,
+        )
+    assert res.trace_id and res.base.trace_id == res.trace_id
+    assert {call.request.headers["X-AW-Trace-Id"] for call in respx.calls} == {res.trace_id}
+    assert set(res.timings) == {"plan", "base", "baseline_test", "specialists", "review"}
+    assert all({"implement", "test"} <= set(t) for t in res.base.candidate_timings)
+    assert len(res.specialist_timings) == 4
+    assert all({"implement", "test"} <= set(t) for t in res.specialist_timings)
+
+
+@respx.mock
+def test_abridge_multi_speculative_records_specialist_timings(endpoints: dict[str, str]) -> None:
+    """Проверяет trace ID и тайминги специалистов в асинхронном спекулятивном режиме."""
+    _mock_speculative(endpoints, [], conflict=True)
+
+    async def _main():
+        async with httpx.AsyncClient() as client:
+            return await orchestrator.abridge_multi(
+                client, "Fix", [endpoints["plan"]], [endpoints["build1"]], [endpoints["review"]],
+                endpoints["tester"], specialists_per_component=1, specialist_mode="speculative",
+            )
+
+    res = asyncio.run(_main())
+    assert {call.request.headers["X-AW-Trace-Id"] for call in respx.calls} == {res.trace_id}
+    assert [sorted(t) for t in res.specialist_timings] == [["implement", "test"]] * 4
+    assert res.timings["plan"] > 0 and res.timings["base"] > 0
+
+
+@respx.mock
+@pytest.mark.parametrize("batch", [True, False])
+def test_best_of_n_tests_each_distinct_diff_once(endpoints: dict[str, str], batch: bool) -> None:
+    """Проверяет, что эквивалентные диффы тестируются один раз и попадают в одну группу дубликатов."""
+    build_urls = [endpoints["build1"], endpoints["build2"], endpoints["build3"]]
+    diffs = [GOOD_DIFF, BAD_DIFF, GOOD_DIFF.replace("a + b\n", "a + b   \n")]
+    for url, diff in zip(build_urls, diffs):
+        respx.post(f"{url}/codex/implement").mock(
+            return_value=httpx.Response(200, json={"diff": diff, "stdout": "", "stderr": ""})
+        )
+    batch_route = respx.post(f"{endpoints['tester']}/testrun/batch").mock(side_effect=_batch_by_content)
+    single_route = respx.post(f"{endpoints['tester']}/testrun").mock(side_effect=_testrun_by_content)
+
+    with httpx.Client() as client:
+        res = bridge_best_of_n(client, "Fix add()", build_urls, endpoints["tester"], batch_tests=batch)
+
+    assert len(res.candidate_tests) == 3
+    good = [i for i, d in enumerate(res.candidate_diffs) if "return a + b" in d]
+    assert res.duplicate_groups == [good]
+    assert all(res.candidate_tests[i].tests_failed == 0 for i in good)
+    if batch:
+        assert len(json.loads(batch_route.calls[0].request.content)["stacks"]) == 2
+    else:
+        assert single_route.call_count == 2
+
+
+@respx.mock
+def test_abridge_best_of_n_tests_each_distinct_diff_once(endpoints: dict[str, str]) -> None:
+    """Проверяет дедупликацию в асинхронном best-of-N без пакетного эндпоинта."""
+    build_urls = [endpoints["build1"], endpoints["build2"], endpoints["build3"]]
+    for url in build_urls:
+        respx.post(f"{url}/codex/implement").mock(
+            return_value=httpx.Response(200, json={"diff": GOOD_DIFF, "stdout": "", "stderr": ""})
+        )
+    single_route = respx.post(f"{endpoints['tester']}/testrun").mock(side_effect=_testrun_by_content)
+
+    async def _main() -> BestOfNResult:
+        async with httpx.AsyncClient() as client:
+            return await abridge_best_of_n(client, "Fix add()", build_urls, endpoints["tester"], batch_tests=False)
+
+    res = asyncio.run(_main())
+    assert single_route.call_count == 1
+    assert res.duplicate_groups == [[0, 1, 2]]
+    assert all(tr.tests_failed == 0 for tr in res.candidate_tests)
+
+
+def test_duplicate_groups_are_sorted_regardless_of_completion_order() -> None:
+    """
+    Проверяет, что индексы в группах дубликатов идут по возрастанию, даже если кандидаты
+    попали в группу в порядке завершения сборки, а отменённые из групп выпадают.
+    """
+    tr = orchestrator.TestRunResult(tests_total=1, tests_passed=1, tests_failed=0, return_code=0, stdout="", stderr="")
+    diffs = ["d0", "d1", "d2", "d3", "d4"]
+    results = [tr, None, tr, tr, tr]
+    groups = {"x": [4, 2, 0], "y": [3, 1]}
+    res = orchestrator._best_of_n_result(diffs, results, groups, [{} for _ in diffs])
+    assert res.candidate_diffs == ["d0", "d2", "d3", "d4"]
+    assert res.duplicate_groups == [[0, 1, 3]]
+    assert res.cancelled == 1
+
+
+@respx.mock
+def test_bridge_events_stream_progress(endpoints: dict[str, str]) -> None:
+    """Проверяет события sync-моста через `iter_bridge_events` и async-моста через `astream_bridge`."""
+    _mock_speculative(endpoints, [], conflict=True)
+    args = (endpoints["plan"], endpoints["build1"], endpoints["review"], endpoints["tester"])
+    with httpx.Client() as client:
+        events = list(orchestrator.iter_bridge_events(
+            bridge_multi, client, "Fix", [args[0]], [args[1]], [args[2]], args[3], specialists_per_component=1,
+        ))
+    names = [e.event for e in events]
+    assert names[:6] == ["plan", "candidate_started", "diff_received", "candidate_tested", "winner", "baseline_tested"]
+    assert names[-3:] == ["final_tested", "review", "done"]
+    assert [e.data["diff"] for e in events if e.event == "specialist_accepted"] == ["FIX_a", "FIX_c"]
+    assert names.count("specialist_tested") == 4
+    done = events[-1]
+    assert done.result.accepted_diffs == ["BASE", "FIX_a", "FIX_c"]
+    assert {e.trace_id for e in events} == {done.result.trace_id}
+
+    async def _main() -> list[orchestrator.BridgeEvent]:
+        async with httpx.AsyncClient() as client:
+            return [e async for e in orchestrator.astream_bridge(
+                orchestrator.abridge_multi, client, "Fix", [args[0]], [args[1]], [args[2]], args[3],
+                specialists_per_component=1, specialist_mode="speculative",
+            )]
+
+    events = asyncio.run(_main())
+    assert [e.data["index"] for e in events if e.event == "specialist_started"] == [0, 1, 2, 3]
+    assert sorted(e.data["diff"] for e in events if e.event == "specialist_accepted") == ["FIX_a", "FIX_c"]
+    assert events[-1].event == "done" and events[-1].result.accepted_diffs == ["BASE", "FIX_a", "FIX_c"]
@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+from agents_wrangler.sharding import DurationHistory, plan_shards
+
+
+def test_plan_shards_balances_by_duration_and_keeps_order() -> None:
+    """Проверяет LPT-разбиение: долгий тест отдельно, короткие вместе в порядке сбора."""
+    nodeids = ["a", "b", "c", "d", "e"]
+    shards = plan_shards(nodeids, [1.0, 4.0, 1.0, 1.0, 1.0], 2)
+    assert sorted(shards) == [["a", "c", "d", "e"], ["b"]]
+    assert plan_shards(nodeids[:1], [1.0], 4) == [["a"]]
+
+
+def test_duration_history_smooths_and_estimates_unknown() -> None:
+    """Проверяет сглаживание длительностей, среднее известных для новых тестов и LRU-вытеснение."""
+    history = DurationHistory(max_entries=2, alpha=0.5)
+    assert history.estimate(["x"]) == [1.0]
+    history.update([("a", 2.0), ("b", 4.0)])
+    history.update([("a", 4.0)])
+    assert history.estimate(["a", "b", "x"]) == [3.0, 4.0, 3.5]
+    history.update([("c", 1.0)])
+    assert len(history) == 2 and history.estimate(["b", "a"]) == [3.0, 3.0]
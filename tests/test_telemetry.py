@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from agents_wrangler.telemetry import TRACE_HEADER, Registry, current_trace_id, instrument, trace, trace_headers
+
+
+def test_histogram_renders_cumulative_buckets() -> None:
+    """Проверяет текстовый формат Prometheus: накопительные бакеты, сумма и число наблюдений по меткам."""
+    registry = Registry()
+    hist = registry.histogram("aw_test_seconds", "Тест", ("role",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        hist.observe(value, role="plan")
+    text = registry.render()
+    assert 'aw_test_seconds_bucket{role="plan",le="0.1"} 1' in text
+    assert 'aw_test_seconds_bucket{role="plan",le="1.0"} 2' in text
+    assert 'aw_test_seconds_bucket{role="plan",le="+Inf"} 3' in text
+    assert 'aw_test_seconds_count{role="plan"} 3' in text
+    assert 'aw_test_seconds_sum{role="plan"} 5.55' in text
+
+
+def test_trace_is_inherited_and_echoed_by_services() -> None:
+    """Проверяет, что вложенный trace продолжает внешний, а сервис возвращает полученный trace ID."""
+    with trace() as outer:
+        with trace() as inner:
+            assert inner == outer
+        assert trace_headers() == {TRACE_HEADER: outer}
+    assert current_trace_id() is None
+
+    app = FastAPI()
+    registry = Registry()
+    instrument(app, registry, "demo")
+
+    @app.get("/ping")
+    def ping() -> dict[str, str | None]:
+        return {"trace": current_trace_id()}
+
+    with TestClient(app) as client:
+        r = client.get("/ping", headers={TRACE_HEADER: "abc"})
+        fresh = client.get("/ping")
+        metrics = client.get("/metrics").text
+    assert r.json() == {"trace": "abc"} and r.headers[TRACE_HEADER] == "abc"
+    assert fresh.headers[TRACE_HEADER] == fresh.json()["trace"]
+    assert 'aw_demo_http_request_seconds_count{method="GET",route="/ping",status="200"} 2' in metrics
@@ -0,0 +1,364 @@
+from __future__ import annotations
+
+import gzip
+import json
+import subprocess
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from agents_wrangler import cache as cache_module
+from agents_wrangler import orchestrator, tester_service
+from agents_wrangler.cache import DiskCache, MemoryCache, TieredCache
+from agents_wrangler.diff_store import diff_ref
+from agents_wrangler.pytest_executors import ForkServerExecutor
+from agents_wrangler.workspaces import PrefixCache, WorkspacePool
+
+BREAK_ADD = (
+    "diff --git a/demo_app/app.py b/demo_app/app.py\n"
+    "--- a/demo_app/app.py\n"
+    "+++ b/demo_app/app.py\n"
+    "@@ -1,3 +1,3 @@\n"
+    " def add(a: int, b: int) -> int:\n"
+    '     """Возвращает сумму a и b."""\n'
+    "-    return a + b\n"
+    "+    return a - b\n"
+)
+ADD_MODULE = (
+    "diff --git a/demo_app/extra.py b/demo_app/extra.py\n"
+    "new file mode 100644\n"
+    "--- /dev/null\n"
+    "+++ b/demo_app/extra.py\n"
+    "@@ -0,0 +1 @@\n"
+    "+EXTRA = 1\n"
+)
+
+
+@pytest.fixture()
+def pool(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> WorkspacePool:
+    """Отдельный пул рабочих копий demo_app во временном каталоге."""
+    p = WorkspacePool(tester_service.DEMO_APP_DIR, size=1, root=tmp_path / "pool")
+    monkeypatch.setattr(tester_service, "POOL", p)
+    monkeypatch.setattr(tester_service, "PREFIXES", PrefixCache(max_entries=2, max_bytes=1 << 20))
+    monkeypatch.setattr(tester_service, "RESULTS", TieredCache(MemoryCache(max_entries=8, ttl=60)))
+    yield p
+    p.close()
+
+
+def test_run_tests_on_clean_baseline(pool: WorkspacePool) -> None:
+    """Проверяет, что baseline demo_app проходит все тесты."""
+    res = tester_service.run_tests_on_diffs([])
+    assert (res.tests_total, res.tests_passed, res.tests_failed) == (3, 3, 0)
+
+
+def test_run_tests_on_diffs_applies_patch(pool: WorkspacePool) -> None:
+    """Проверяет, что дифф применяется и ломает тесты."""
+    res = tester_service.run_tests_on_diffs([BREAK_ADD])
+    assert (res.tests_passed, res.tests_failed) == (1, 2)
+    assert res.return_code != 0
+
+
+def test_pool_reuses_reset_workspace(pool: WorkspacePool) -> None:
+    """Проверяет, что пул выдаёт сброшенную копию повторно и считает hits/misses."""
+    tester_service.run_tests_on_diffs([BREAK_ADD])
+    pool._resetter.submit(lambda: None).result()
+    res = tester_service.run_tests_on_diffs([])
+    assert res.tests_failed == 0
+    stats = pool.stats()
+    assert stats["size"] == 1
+    assert stats["hits"] == 2
+    assert stats["misses"] == 0
+
+
+def test_pool_miss_creates_workspace(pool: WorkspacePool) -> None:
+    """Проверяет, что при пустом пуле копия создаётся на месте и учитывается как miss."""
+    with pool.acquire() as first, pool.acquire() as second:
+        assert first.root != second.root
+        assert (second.target / "app.py").exists()
+    assert pool.stats()["misses"] == 1
+
+
+def test_prefix_cache_reuses_applied_stack(pool: WorkspacePool) -> None:
+    """Проверяет, что стек диффов стартует с закэшированного префикса и даёт тот же результат."""
+    prefixes = tester_service.PREFIXES
+    first = tester_service.run_tests_on_diffs([ADD_MODULE])
+    second = tester_service.run_tests_on_diffs([ADD_MODULE, BREAK_ADD])
+    assert first.tests_failed == 0
+    assert (second.tests_passed, second.tests_failed) == (1, 2)
+    stats = prefixes.stats()
+    assert stats["hits"] == 1
+    assert stats["patches_skipped"] == 1
+    assert stats["entries"] == 2
+
+
+def test_prefix_cache_stores_intermediate_prefixes(pool: WorkspacePool) -> None:
+    """Проверяет, что снапшот сохраняется для каждого префикса, а не только для стека целиком."""
+    tester_service.run_tests_on_diffs([ADD_MODULE, BREAK_ADD])
+    assert tester_service.PREFIXES.stats()["entries"] == 2
+    assert tester_service.run_tests_on_diffs([ADD_MODULE]).tests_failed == 0
+    assert tester_service.PREFIXES.stats()["patches_skipped"] == 1
+
+
+def test_apply_falls_back_to_git_and_reports_hunks(pool: WorkspacePool, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Проверяет откат на git apply, если встроенный движок не справился, и текст ошибки с номером ханка."""
+    def _unsupported(root: Path, diff: str, fuzz: int) -> list[str]:
+        raise tester_service.PatchError([])
+
+    stale = BREAK_ADD.replace("-    return a + b", "-    return a * b")
+    with pytest.raises(RuntimeError, match=r"unable to apply patch #0: demo_app/app.py: hunk #1") as exc:
+        tester_service.run_tests_on_diffs([stale])
+    assert "git apply: error:" in str(exc.value)
+    monkeypatch.setattr(tester_service, "apply_patch", _unsupported)
+    assert tester_service.run_tests_on_diffs([BREAK_ADD]).tests_failed == 2
+
+
+def test_impacted_selection_runs_only_affected_tests(pool: WorkspacePool) -> None:
+    """Проверяет выбор затронутых тестов: новый модуль без импортёров не запускает pytest, правка app.py — запускает."""
+    untouched = tester_service.run_tests_on_diffs([ADD_MODULE], select="impacted")
+    assert untouched.selection.model_dump() == {"mode": "impacted", "reason": "", "test_files": [], "tests_skipped": 3}
+    assert untouched.tests_total == 0 and "pytest" not in untouched.timings
+
+    broken = tester_service.run_tests_on_diffs([ADD_MODULE, BREAK_ADD], select="impacted")
+    assert broken.selection.test_files == ["tests/test_app.py"] and broken.selection.tests_skipped == 0
+    assert (broken.tests_passed, broken.tests_failed) == (1, 2)
+
+    # Полный прогон того же стека уже в кэше и отдаётся вместо выборочного
+    full = tester_service.run_tests_on_diffs([BREAK_ADD])
+    assert tester_service.run_tests_on_diffs([BREAK_ADD], select="impacted").model_dump(exclude={"cached", "timings"}) == (
+        full.model_dump(exclude={"cached", "timings"})
+    )
+
+
+def test_prefix_cache_evicts_lru(pool: WorkspacePool) -> None:
+    """Проверяет вытеснение самых старых снапшотов при превышении бюджета."""
+    tester_service.run_tests_on_diffs([ADD_MODULE, BREAK_ADD])
+    tester_service.run_tests_on_diffs([BREAK_ADD])
+    stats = tester_service.PREFIXES.stats()
+    assert stats["entries"] == 2
+    keys = PrefixCache.keys(pool.baseline, [ADD_MODULE])
+    assert tester_service.PREFIXES.longest(keys) == (0, None)
+
+
+def test_result_cache_returns_hit_for_same_stack(pool: WorkspacePool) -> None:
+    """Проверяет, что повторный прогон того же стека берётся из кэша без workspace."""
+    first = tester_service.run_tests_on_diffs([BREAK_ADD])
+    second = tester_service.run_tests_on_diffs([BREAK_ADD])
+    assert not first.cached
+    assert second.cached
+    assert second.model_dump(exclude={"cached", "timings"}) == first.model_dump(exclude={"cached", "timings"})
+    assert set(first.timings) == {"workspace", "apply", "pytest"} and second.timings == {}
+    assert pool.stats()["hits"] + pool.stats()["misses"] == 1
+
+
+def test_result_cache_disk_tier_survives_restart(pool: WorkspacePool, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Проверяет, что дисковый уровень кэша отдаёт результат после «рестарта» памяти."""
+    disk = tmp_path / "results"
+    monkeypatch.setattr(tester_service, "RESULTS", TieredCache(MemoryCache(8, 60), DiskCache(disk, 100, 60)))
+    tester_service.run_tests_on_diffs([])
+    monkeypatch.setattr(tester_service, "RESULTS", TieredCache(MemoryCache(8, 60), DiskCache(disk, 100, 60)))
+    assert tester_service.run_tests_on_diffs([]).cached
+    assert tester_service.RESULTS.stats()["disk_hits"] == 1
+
+
+def test_result_cache_key_covers_patch_engine(pool: WorkspacePool, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Проверяет, что смена движка применения или fuzz не отдаёт результат, полученный при других настройках."""
+    tester_service.run_tests_on_diffs([BREAK_ADD])
+    assert tester_service.run_tests_on_diffs([BREAK_ADD]).cached
+    monkeypatch.setattr(tester_service, "PATCH_FUZZ", tester_service.PATCH_FUZZ + 1)
+    assert not tester_service.run_tests_on_diffs([BREAK_ADD]).cached
+    monkeypatch.setattr(tester_service, "PATCH_ENGINE", "git")
+    assert not tester_service.run_tests_on_diffs([BREAK_ADD]).cached
+
+
+def test_disk_hit_keeps_entry_ttl_in_memory(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Проверяет, что запись, поднятая с диска в память, истекает по своему TTL, а не по TTL памяти."""
+    now = [1000.0]
+    monkeypatch.setattr(cache_module, "time", SimpleNamespace(time=lambda: now[0]))
+    disk = DiskCache(tmp_path / "results", 100, 86400)
+    disk.set("k", {"v": 1}, ttl=60)
+    cache = TieredCache(MemoryCache(8, 86400), disk)
+    now[0] += 50
+    assert cache.get("k") == {"v": 1}
+    now[0] += 20
+    assert cache.memory.get("k") is None and cache.get("k") is None
+
+
+def test_testrun_reports_cache_header(pool: WorkspacePool) -> None:
+    """Проверяет заголовок X-AW-Cache у HTTP-эндпоинта."""
+    with TestClient(tester_service.app) as client:
+        first = client.post("/testrun", json={"diffs": [BREAK_ADD]})
+        second = client.post("/testrun", json={"diffs": [BREAK_ADD]})
+    assert first.headers["X-AW-Cache"] == "miss"
+    assert second.headers["X-AW-Cache"] == "hit"
+    assert second.json()["cached"] is True
+
+
+def test_metrics_expose_stage_histograms(pool: WorkspacePool) -> None:
+    """Проверяет гистограммы этапов прогона в /metrics и возврат trace ID в ответе."""
+    with TestClient(tester_service.app) as client:
+        r = client.post("/testrun", json={"diffs": [ADD_MODULE]}, headers={"X-AW-Trace-Id": "t-1"})
+        metrics = client.get("/metrics").text
+    assert r.headers["X-AW-Trace-Id"] == "t-1"
+    assert set(r.json()["timings"]) == {"workspace", "apply", "pytest"}
+    for name in ("aw_tester_workspace_seconds_count", "aw_tester_apply_seconds_count", 'aw_tester_pytest_seconds_count{executor="subprocess"}'):
+        assert name in metrics
+    assert 'route="/testrun",status="200"' in metrics
+
+
+def test_batch_endpoint_returns_results_in_input_order(pool: WorkspacePool) -> None:
+    """Проверяет, что пакет стеков возвращается в порядке входа, а ошибка стека не роняет пакет."""
+    with TestClient(tester_service.app) as client:
+        r = client.post("/testrun/batch", json={"stacks": [[BREAK_ADD], ["not a diff"], [ADD_MODULE]]})
+    assert r.status_code == 200
+    items = r.json()["results"]
+    assert [it["index"] for it in items] == [0, 1, 2]
+    assert items[0]["result"]["tests_failed"] == 2
+    assert items[1]["error"]
+    assert items[2]["result"]["tests_failed"] == 0
+
+
+def test_batch_endpoint_streams_ndjson(pool: WorkspacePool) -> None:
+    """Проверяет потоковый режим: по NDJSON-строке на каждый стек."""
+    with TestClient(tester_service.app) as client:
+        r = client.post("/testrun/batch?stream=true", json={"stacks": [[BREAK_ADD], [ADD_MODULE]]})
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    items = [json.loads(line) for line in r.text.splitlines()]
+    assert sorted(it["index"] for it in items) == [0, 1]
+
+
+def test_testrun_streams_stages_and_tests(pool: WorkspacePool) -> None:
+    """Проверяет NDJSON-режим /testrun: этапы и исход каждого теста до итоговой строки с результатом."""
+    with TestClient(tester_service.app) as client:
+        r = client.post("/testrun?stream=true", json={"diffs": [BREAK_ADD]})
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in r.text.splitlines()]
+    stages = [e["stage"] for e in events if e["event"] == "stage"]
+    tests = [e for e in events if e["event"] == "test"]
+    assert stages == ["workspace", "apply", "pytest"]
+    assert events[-1]["event"] == "result"
+    result = events[-1]["result"]
+    assert len(tests) == result["tests_total"] and sum(t["outcome"] == "failed" for t in tests) == 2
+    assert events.index(tests[-1]) < len(events) - 2  # исходы приходят раньше завершения этапа pytest
+
+
+def test_testrun_accepts_diff_refs_after_upload(pool: WorkspacePool) -> None:
+    """Проверяет 409 на неизвестные ссылки, сжатую загрузку через PUT /diffs и прогон по ссылкам."""
+    diff = ADD_MODULE.replace("extra", "by_ref")
+    ref = diff_ref(diff)
+    with TestClient(tester_service.app) as client:
+        missing = client.post("/testrun", json={"diff_refs": [ref, diff_ref(BREAK_ADD)]})
+        assert missing.status_code == 409
+        assert ref in missing.json()["missing"]
+        body = gzip.compress(json.dumps({"diffs": [diff, BREAK_ADD]}).encode())
+        client.put("/diffs", content=body, headers={"Content-Encoding": "gzip", "Content-Type": "application/json"})
+        r = client.post("/testrun", json={"diff_refs": [ref, diff_ref(BREAK_ADD)]})
+        batch = client.post("/testrun/batch", json={"stack_refs": [[ref], [ref, diff_ref(BREAK_ADD)]]})
+    assert r.status_code == 200 and r.json()["tests_failed"] == 2
+    assert [it["result"]["tests_failed"] for it in batch.json()["results"]] == [0, 2]
+
+
+def test_orchestrator_sends_refs_to_diff_store(pool: WorkspacePool, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Проверяет, что оркестратор шлёт тексты только при первом контакте и новых диффах, а 409 догружает."""
+    monkeypatch.setattr(orchestrator, "_DIFF_STORES", {})
+    sent: list[tuple[str, dict]] = []
+    with TestClient(tester_service.app) as client:
+        client.event_hooks["request"] = [lambda req: sent.append((f"{req.method} {req.url.path}", json.loads(req.content)))]
+        orchestrator.tester_run(client, "http://testserver", [ADD_MODULE])
+        orchestrator.tester_run(client, "http://testserver", [ADD_MODULE, BREAK_ADD])
+        # Клиент считает дифф загруженным, а сервис его уже не знает
+        lost = ADD_MODULE.replace("extra", "lost")
+        orchestrator._DIFF_STORES["http://testserver"].add(diff_ref(lost))
+        tr = orchestrator.tester_run(client, "http://testserver", [lost])
+    assert [call for call, _ in sent] == [
+        "POST /testrun", "PUT /diffs", "POST /testrun", "POST /testrun", "PUT /diffs", "POST /testrun",
+    ]
+    assert sent[0][1] == {"diffs": [ADD_MODULE]}
+    assert sent[1][1] == {"diffs": [BREAK_ADD]}
+    assert sent[2][1] == {"diff_refs": [diff_ref(ADD_MODULE), diff_ref(BREAK_ADD)]}
+    assert sent[4][1] == {"diffs": [lost]}
+    assert tr.tests_failed == 0
+
+
+@pytest.fixture()
+def forkserver(monkeypatch: pytest.MonkeyPatch) -> ForkServerExecutor:
+    """Отдельный fork-сервер pytest, останавливаемый после теста."""
+    executor = ForkServerExecutor()
+    monkeypatch.setattr(tester_service, "FORKSERVER", executor)
+    yield executor
+    executor.close()
+
+
+def test_forkserver_executor_matches_subprocess(pool: WorkspacePool, forkserver: ForkServerExecutor) -> None:
+    """Проверяет, что fork-сервер даёт те же счётчики, что и отдельный процесс pytest."""
+    res = tester_service.run_tests_on_diffs([BREAK_ADD], executor="forkserver")
+    assert (res.tests_passed, res.tests_failed) == (1, 2)
+    assert res.return_code != 0
+    res = tester_service.run_tests_on_diffs([], executor="forkserver")
+    assert (res.tests_total, res.tests_passed, res.tests_failed) == (3, 3, 0)
+
+
+def test_sharded_run_merges_shards(pool: WorkspacePool, forkserver: ForkServerExecutor, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Проверяет, что шарды по nodeid сводятся в тот же результат, а число шардов ограничено сервером."""
+    monkeypatch.setattr(tester_service, "MAX_SHARDS", 2)
+    res = tester_service.run_tests_on_diffs([BREAK_ADD], executor="forkserver", shards=8)
+    assert res.shards == 2 and "collect" in res.timings
+    assert (res.tests_total, res.tests_passed, res.tests_failed) == (3, 1, 2)
+    assert len({t.nodeid for t in res.tests}) == 3 and res.return_code == 1
+    assert res.stdout.count("===== shard ") == 2
+    with TestClient(tester_service.app) as client:
+        r = client.post("/testrun", json={"diffs": [ADD_MODULE], "shards": 2})
+    assert r.json()["shards"] == 2 and r.json()["tests_passed"] == 3
+
+
+def test_forkserver_executor_enforces_timeout(tmp_path: Path, forkserver: ForkServerExecutor) -> None:
+    """Проверяет, что зависший прогон убивается по таймауту, а сервер продолжает работать."""
+    (tmp_path / "test_slow.py").write_text("import time\n\ndef test_slow():\n    time.sleep(30)\n")
+    with pytest.raises(subprocess.TimeoutExpired):
+        forkserver.run(tmp_path, [str(tmp_path)], ["-q"], timeout=1)
+    (tmp_path / "test_slow.py").write_text("def test_fast():\n    pass\n")
+    assert forkserver.run(tmp_path, [str(tmp_path)], ["-q", "-p", "no:cacheprovider"], timeout=30).returncode == 0
+
+
+def test_results_plugin_reports_per_test_outcomes(pool: WorkspacePool) -> None:
+    """Проверяет, что исходы и длительности тестов приходят из плагина, а не из stdout."""
+    res = tester_service.run_tests_on_diffs([BREAK_ADD])
+    outcomes = {t.nodeid.split("::")[-1]: t.outcome for t in res.tests}
+    assert sorted(outcomes.values()) == ["failed", "failed", "passed"]
+    assert all(t.duration >= 0 for t in res.tests)
+    assert res.tests_errors == res.tests_skipped == 0
+
+
+def test_results_plugin_counts_errors_skips_and_xfails(tmp_path: Path) -> None:
+    """Проверяет классификацию: ошибка фикстуры, skip, xfail и xpass считаются отдельно."""
+    (tmp_path / "test_mixed.py").write_text(
+        "import pytest\n\n"
+        "@pytest.fixture\ndef broken():\n    raise RuntimeError('boom')\n\n"
+        "def test_ok():\n    pass\n\n"
+        "def test_error(broken):\n    pass\n\n"
+        "@pytest.mark.skip\ndef test_skipped():\n    pass\n\n"
+        "@pytest.mark.xfail\ndef test_xfail():\n    assert False\n\n"
+        "@pytest.mark.xfail\ndef test_xpass():\n    pass\n"
+    )
+    ws = tester_service.Workspace(root=tmp_path, target=tmp_path)
+    res = tester_service._run_pytest(ws, "subprocess")
+    assert (res.tests_passed, res.tests_failed, res.tests_errors) == (2, 0, 1)
+    assert (res.tests_skipped, res.tests_xfailed, res.tests_total) == (1, 1, 3)
+
+    # Ошибка сбора прерывает сессию и засчитывается как error модуля
+    (tmp_path / "test_bad_import.py").write_text("import missing_module_for_aw\n")
+    res = tester_service._run_pytest(ws, "subprocess")
+    assert [(t.nodeid, t.outcome) for t in res.tests] == [("test_bad_import.py", "error")]
+
+
+def test_testrun_output_modes(pool: WorkspacePool) -> None:
+    """Проверяет, что output=none/truncated урезает вывод, не трогая метрики и кэш."""
+    with TestClient(tester_service.app) as client:
+        full = client.post("/testrun", json={"diffs": [BREAK_ADD]}).json()
+        none = client.post("/testrun", json={"diffs": [BREAK_ADD], "output": "none"}).json()
+    assert full["stdout"] and none["stdout"] == none["stderr"] == ""
+    assert none["tests"] == full["tests"]
+    tail = tester_service._trim_output(tester_service.TestRunResult.model_validate(full), "truncated")
+    assert full["stdout"].endswith(tail.stdout)
+    assert len(tail.stdout) <= tester_service.OUTPUT_TAIL_CHARS
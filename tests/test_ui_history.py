@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from agents_wrangler.orchestrator import BestOfNResult, TestRunResult
+from agents_wrangler.ui_history import (
+    HistoryEntry,
+    diff_preview,
+    dump_run,
+    load_run,
+    remember,
+    result_cache,
+    run_key,
+)
+
+
+def _entry(key: str) -> HistoryEntry:
+    tr = TestRunResult(tests_total=1, tests_passed=1, tests_failed=0, return_code=0, stdout="", stderr="")
+    return HistoryEntry(key, "bridge", f"run {key}", BestOfNResult(["diff"], [tr], 0, trace_id="t"))
+
+
+def test_history_is_bounded_and_cache_round_trips(tmp_path: Path) -> None:
+    """Проверяет ограничение истории, подъём повторного запуска и восстановление результата с диска."""
+    history: list[HistoryEntry] = []
+    for key in "abcd":
+        remember(history, _entry(key), limit=3)
+    remember(history, _entry("c"), limit=3)
+    assert [e.key for e in history] == ["c", "d", "b"]
+
+    key = run_key("bridge", {"task": "x", "builders": 2})
+    assert key == run_key("bridge", {"builders": 2, "task": "x"}) != run_key("multi", {"task": "x", "builders": 2})
+    cache = result_cache(tmp_path)
+    cache.set(key, dump_run(_entry(key)))
+    loaded = load_run(key, cache.get(key))
+    assert loaded.cached and loaded.label == f"run {key}"
+    assert loaded.result.candidate_tests[0].tests_passed == 1 and loaded.result.trace_id == "t"
+
+
+def test_diff_preview_cuts_on_line_boundary() -> None:
+    """Проверяет, что превью режется по границе строки и сообщает об усечении."""
+    diff = "".join(f"+line {i}\n" for i in range(1000))
+    assert diff_preview(diff, len(diff)) == (diff, False)
+    preview, truncated = diff_preview(diff, 25)
+    assert truncated and preview == "+line 0\n+line 1\n+line 2\n"